@@ -0,0 +1,73 @@
+"""Compare the vectorised lag features with the previous groupby().shift() implementation.
+
+Run from the root of the repo with `python -m benchmarks.benchmark_features`.
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from src.data.features import build_features
+from src.data.providers import generate_synthetic_bars
+
+
+def build_features_groupby(bars: dict, n_lags: int) -> pd.DataFrame:
+    """Previous implementation of get_data: concat per ticker, then one groupby per lag."""
+
+    data = pd.DataFrame()
+    for ticker, hist in bars.items():
+        hist = hist.copy()
+        hist['ticker'] = ticker
+        data = pd.concat([data, hist])
+
+    data["close_previous_day"] = data.groupby("ticker")["Close"].shift(1)
+    data["close_growth"] = np.log(data["Close"]) - np.log(data["close_previous_day"])
+    data.rename(columns={'Close': 'close'}, inplace=True)
+
+    for i in range(1, n_lags+1):
+        data[f"close_growth_lag_{i}"] = data.groupby("ticker")["close_growth"].shift(i)
+
+    return data.filter(regex='ticker|Date|close')
+
+
+def build_features_vectorised(bars: dict, n_lags: int) -> pd.DataFrame:
+    """Current implementation: one concat, then all lags in one pass."""
+
+    data = pd.concat([hist.assign(ticker=ticker) for ticker, hist in bars.items()])
+
+    return build_features(data, n_lags=n_lags)
+
+
+def time_it(function, *args, repeat: int = 3) -> float:
+    """Best wall-clock time of a few runs, in seconds."""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-days", type=int, default=250)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore", pd.errors.PerformanceWarning) # the groupby implementation fragments the frame on purpose
+
+    print(f"{'tickers':>8} {'lags':>5} {'groupby (s)':>12} {'vectorised (s)':>15} {'speedup':>8}")
+    for n_tickers, n_lags in [(20, 10), (200, 10), (200, 100), (2000, 10), (2000, 100)]:
+        bars = generate_synthetic_bars(n_tickers=n_tickers, n_days=args.n_days)
+
+        expected = build_features_groupby(bars, n_lags)
+        pd.testing.assert_frame_equal(build_features_vectorised(bars, n_lags), expected, check_dtype=False)
+
+        groupby_seconds = time_it(build_features_groupby, bars, n_lags, repeat=args.repeat)
+        vectorised_seconds = time_it(build_features_vectorised, bars, n_lags, repeat=args.repeat)
+
+        print(f"{n_tickers:>8} {n_lags:>5} {groupby_seconds:>12.3f} {vectorised_seconds:>15.3f} {groupby_seconds / vectorised_seconds:>7.1f}x")
@@ -0,0 +1,153 @@
+"""Load test the advice API served by gunicorn with gthread workers (WSGI) and with uvicorn workers (ASGI).
+
+Every server is started with `src/predict/app/gunicorn_config.py` on a local
+port and a synthetic advice file, then hit with keep-alive connections.
+
+Run from the root of the repo with `python -m benchmarks.load_test`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+APP_PATH = os.path.join("src", "predict", "app")
+SERVERS = {
+    "gunicorn-gthread": {"SERVER": "wsgi"},
+    "gunicorn-uvicorn": {"SERVER": "asgi"},
+}
+
+
+def write_advice(data_path: str, n_tickers: int) -> None:
+    """Write an advice file shaped like the one of make_predictions."""
+
+    rng = np.random.default_rng(0)
+    predictions = rng.normal(0, 0.01, n_tickers)
+    tickers = [f"SYN{i:04d}.BR" for i in range(n_tickers)]
+    advice = {"prediction": {ticker: [prediction] for ticker, prediction in zip(tickers, predictions)},
+              "advice": {ticker: "BUY" if prediction > 0 else "SELL" for ticker, prediction in zip(tickers, predictions)}}
+
+    with open(os.path.join(data_path, "advice.json"), "w") as advice_file:
+        json.dump(advice, advice_file)
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(name: str, data_path: str, port: int) -> subprocess.Popen:
+    """Start one server setup and wait until it accepts connections."""
+
+    env = dict(os.environ, **SERVERS[name], DATAPATH=data_path, PYTHONPATH=os.getcwd(), GUNICORN_CMD_ARGS=f"--bind 127.0.0.1:{port}")
+    env.pop("MLFLOW_TRACKING_URI", None) # only the advice endpoint is compared
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn_config.py"], cwd=APP_PATH, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+
+    server.kill()
+    raise RuntimeError(f"{name} did not start")
+
+
+def resident_memory_mb(pid: int) -> float:
+    """Resident memory of a process and its children, from /proc (Linux only)."""
+
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as children_file:
+            pids += [int(child) for child in children_file.read().split()]
+    except OSError:
+        return float("nan")
+
+    total_kb = 0
+    for process in pids:
+        with open(f"/proc/{process}/status", "r") as status_file:
+            total_kb += next(int(line.split()[1]) for line in status_file if line.startswith("VmRSS:"))
+
+    return total_kb / 1024
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    """Read one HTTP/1.1 response and return its status code."""
+
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+    length = int({key.lower(): value for key, value in headers.items()}.get("content-length", 0))
+    if length:
+        await reader.readexactly(length)
+
+    return int(lines[0].split()[1])
+
+
+async def client(port: int, path: str, n_requests: int, latencies: list, etag: str = None) -> None:
+    """Send requests one after the other on a keep-alive connection."""
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = f"GET {path} HTTP/1.1\r\nHost: localhost\r\n" + (f'If-None-Match: "{etag}"\r\n' if etag else "") + "\r\n"
+
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        writer.write(request.encode())
+        status = await read_response(reader)
+        latencies.append(time.perf_counter() - start)
+        if status not in (200, 304):
+            raise RuntimeError(f"status {status}")
+
+    writer.close()
+
+
+async def load(port: int, path: str, n_requests: int, concurrency: int, etag: str = None) -> tuple:
+    """Spread the requests over concurrent connections; return the throughput and the latencies."""
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(port, path, n_requests // concurrency, latencies, etag) for _ in range(concurrency)])
+
+    return len(latencies) / (time.perf_counter() - start), np.array(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--n-tickers", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_path:
+        write_advice(data_path, args.n_tickers)
+
+        print(f"{'server':<18} {'conditional':>11} {'connections':>11} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}")
+        for name in args.servers:
+            port = free_port()
+            server = start_server(name, data_path, port)
+            try:
+                for conditional in (False, True):
+                    etag = None
+                    if conditional: # dashboards polling with the ETag of their last response
+                        etag = urllib.request.urlopen(f"http://127.0.0.1:{port}/advice").headers["ETag"].strip('"')
+
+                    for concurrency in args.concurrency:
+                        asyncio.run(load(port, "/advice", min(args.requests, 200), concurrency, etag)) # warm up every worker
+                        throughput, latencies = asyncio.run(load(port, "/advice", args.requests, concurrency, etag))
+                        print(f"{name:<18} {str(conditional):>11} {concurrency:>11} {throughput:>9.0f} {np.percentile(latencies, 50) * 1000:>8.2f} "
+                              f"{np.percentile(latencies, 99) * 1000:>8.2f} {resident_memory_mb(server.pid):>8.0f}")
+            finally:
+                server.terminate()
+                server.wait()
@@ -1,25 +1,39 @@
 from src.data.get_data import load_datapath, get_BEL20_composition, get_data
+from src.data.providers import load_provider
+from src.data.fingerprint import task_cache_key
 from src.train_model.train_model import get_tracking_uri, train_test_split, train_model, register_best_model
-from src.predict.advice import modify_data, make_predictions
-from src.monitoring.evidently_monitoring import get_workspace_name, get_reference_data, prepare_data, open_workspace_project, add_report
-
-from datetime import date
+from src.predict.advice import get_advice_thresholds, modify_data, make_predictions
+from src.predict.artifact_cache import resolve_stage
+from src.train_model.online import MODEL_NAME, PREPROCESSOR_NAME, ONLINE_STATE_NAME, ONLINE_EXPERIMENT_NAME, full_retrain_time, start_online_model, update_online_model
+from src.backtest.backtest import best_n_lags, run_backtest
+from src.monitoring.evidently_monitoring import get_workspace_name, get_monitoring_policy, get_reference_data, monitor_data, open_workspace_project, add_report, compact_workspace
+
+from datetime import date, timedelta
+import os
 import pandas as pd
 
 from prefect import flow, task
 
+# Tasks with this cache are skipped when their inputs (data by content, parameters) did not change since a previous run,
+# e.g. hourly runs while the market is closed; their results are persisted to be reused by the next flow runs.
+CACHE = dict(cache_key_fn=task_cache_key, cache_expiration=timedelta(days=7), persist_result=True)
+
 @task(retries=2, retry_delay_seconds=5)
-def get_data_task(env_path: str = ".env", length_of_data: str = "60d", n_lags: int = 10) -> str:
-    """ Get data from Yahoo Finance API.
+def get_data_task(env_path: str = ".env", length_of_data: str = "60d", n_lags: int = 10, max_workers: int = 8) -> str:
+    """ Get data from Yahoo Finance API (or the provider configured in the .env file).
     """
     data_path = load_datapath(env_path=env_path)
-    tickers = get_BEL20_composition(data_path=data_path)
+    provider = load_provider(env_path=env_path)
+
+    tickers = provider.list_tickers() # replay providers come with their own universe
+    if tickers is None:
+        tickers = get_BEL20_composition(data_path=data_path)
 
-    data_name = get_data(tickers=tickers, data_path=data_path, length_of_data=length_of_data, n_lags=n_lags)
+    data_name = get_data(tickers=tickers, data_path=data_path, length_of_data=length_of_data, n_lags=n_lags, max_workers=max_workers, provider=provider)
 
     return data_name
 
-@task
+@task(**CACHE)
 def train_test_split_task(data_name: str, train_ratio: float = 0.8) -> tuple:
     """ Split data into train and test set.
     """
@@ -27,28 +41,57 @@ def train_test_split_task(data_name: str, train_ratio: float = 0.8) -> tuple:
 
     return X_train, X_test, y_train, y_test
 
-@task
-def train_model_task(X_train: pd.DataFrame, X_test: pd.DataFrame, y_train: pd.DataFrame, y_test: pd.DataFrame, max_lags_used: int = 10, env_path: str = ".env") -> str:
-    """ Train model and log it in MLFlow.
+@task(**CACHE)
+def train_model_task(X_train: pd.DataFrame, X_test: pd.DataFrame, y_train: pd.DataFrame, y_test: pd.DataFrame, experiment_name: str, max_lags_used: int = 10, search: str = "gram", n_jobs: int = 1, data_name: str = None, n_folds: int = 5, env_path: str = ".env") -> str:
+    """ Train model and log it in MLFlow (cross-validated on data_name if search is "cv").
+    The experiment name is a parameter so that it is part of the cache key: a cached run of another day is not reused.
     """
     tracking_uri = get_tracking_uri(env_path=env_path)
-    experiment_name = f"stock-prediction-BEL-20-{date.today()}"
-    train_model(tracking_uri=tracking_uri, experiment_name=experiment_name, X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test, max_lags_used=max_lags_used)
+    train_model(tracking_uri=tracking_uri, experiment_name=experiment_name, X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test, max_lags_used=max_lags_used, search=search, n_jobs=n_jobs, data_name=data_name, n_folds=n_folds)
 
     return experiment_name
 
-@task
-def register_best_model_task(experiment_name: str, env_path: str = ".env") -> None:
-    """ Register best model and preprocessor in MLFlow.
+@task(**CACHE)
+def register_best_model_task(experiment_name: str, metric: str = "mape", data_name: str = None, env_path: str = ".env") -> None:
+    """ Register best model and preprocessor in MLFlow, as new versions of the stable names.
+    The data the experiment was trained on is only part of the cache key: the experiment name stays the same all day.
     """
     tracking_uri = get_tracking_uri(env_path=env_path)
 
-    model_name = f"best-model-{date.today()}"
-    preprocessor_name = f"preprocessor-{date.today()}"
-    register_best_model(tracking_uri=tracking_uri, experiment_name=experiment_name, model_name=model_name, preprocessor_name=preprocessor_name)
+    model_name = MODEL_NAME
+    preprocessor_name = PREPROCESSOR_NAME
+    register_best_model(tracking_uri=tracking_uri, experiment_name=experiment_name, model_name=model_name, preprocessor_name=preprocessor_name, metric=metric)
     
     return model_name, preprocessor_name
 
+@task
+def update_online_model_task(data_name: str, env_path: str = ".env") -> str:
+    """ Fold the new bars into the online model and publish it, or tell why a full retrain is needed.
+    """
+    data_path = load_datapath(env_path=env_path)
+    tracking_uri = get_tracking_uri(env_path=env_path)
+
+    return update_online_model(data_name=data_name, state_path=f"{data_path}/{ONLINE_STATE_NAME}", tracking_uri=tracking_uri, experiment_name=ONLINE_EXPERIMENT_NAME)
+
+@task
+def start_online_model_task(data_name: str, experiment_name: str, metric: str = "mape", env_path: str = ".env") -> None:
+    """ Start the online model from the whole dataset with the number of lags of the full retrain, and put it in production.
+    """
+    data_path = load_datapath(env_path=env_path)
+    tracking_uri = get_tracking_uri(env_path=env_path)
+    n_lags_used = best_n_lags(tracking_uri=tracking_uri, experiment_name=experiment_name, metric=metric)
+
+    start_online_model(data_name=data_name, state_path=f"{data_path}/{ONLINE_STATE_NAME}", n_lags_used=n_lags_used, tracking_uri=tracking_uri, experiment_name=ONLINE_EXPERIMENT_NAME)
+
+@task
+def backtest_task(data_name: str, experiment_name: str, metric: str = "mape", env_path: str = ".env") -> dict:
+    """ Backtest the advice of the best model walking forward over the data and log the results in MLFlow.
+    """
+    tracking_uri = get_tracking_uri(env_path=env_path)
+    n_lags_used = best_n_lags(tracking_uri=tracking_uri, experiment_name=experiment_name, metric=metric)
+
+    return run_backtest(data_name=data_name, tracking_uri=tracking_uri, experiment_name="backtest-BEL-20", n_lags_used=n_lags_used)
+
 @task
 def make_predictions_task(data_name: str, model_name: str, preprocessor_name: str, experiment_name: str, env_path: str = ".env") -> None:
     """ Make predictions with the best model for the next day.
@@ -58,14 +101,25 @@ def make_predictions_task(data_name: str, model_name: str, preprocessor_name: st
 
     data_path = load_datapath(env_path=env_path)
     tracking_uri = get_tracking_uri(env_path=env_path)
+    thresholds = get_advice_thresholds(env_path=env_path) # hold band, the same as the API
 
-    make_predictions(data=data, preprocessor_name=preprocessor_name, model_name=model_name, data_path=data_path, tracking_uri=tracking_uri, experiment_name=experiment_name, stage="Production")
+    make_predictions(data=data, preprocessor_name=preprocessor_name, model_name=model_name, data_path=data_path, tracking_uri=tracking_uri, experiment_name=experiment_name, stage="Production",
+                     buy_threshold=thresholds["buy_threshold"], sell_threshold=thresholds["sell_threshold"])
 
     return None
 
 @task
-def model_monitoring(data_name: str, model_name: str, preprocessor_name: str, experiment_name: str, env_path: str = ".env") -> None:
+def production_version_task(model_name: str, env_path: str = ".env") -> str:
+    """ Get the version of the model in production, so that the tasks depending on it have it in their cache key.
+    """
+    tracking_uri = get_tracking_uri(env_path=env_path)
+
+    return str(resolve_stage(tracking_uri=tracking_uri, model_name=model_name, stage="Production").version)
+
+@task(**CACHE)
+def model_monitoring(data_name: str, model_name: str, preprocessor_name: str, experiment_name: str, model_version: str, env_path: str = ".env") -> None:
     """ Monitor model performance with Evidently.
+    The version of the model in production is part of the cache key: a new model on the same data is monitored again.
     """
     
     workspace_name = get_workspace_name() # Get workspace name from .env file
@@ -74,10 +128,31 @@ def model_monitoring(data_name: str, model_name: str, preprocessor_name: str, ex
     data_path = load_datapath(env_path=env_path)
     tracking_uri = get_tracking_uri(env_path=env_path)
 
-    ref_data_name = get_reference_data(data_path=data_path) # Get reference data
-    ref_data, data = prepare_data(data_name=data_name, ref_data_name=ref_data_name, tracking_uri=tracking_uri, experiment_name=experiment_name, model_name=model_name, preprocessor_name=preprocessor_name, stage="Production") # Prepare data for Evidently
+    policy = get_monitoring_policy(env_path=env_path) # Reference window and retention of the reports
+
+    pin = None # rolling reference taken again every day of data
+    if policy["reference_pin"] == "model": # or for every full retrain, not for every online update of the same names
+        trained_at = full_retrain_time(state_path=f"{data_path}/{ONLINE_STATE_NAME}")
+        if trained_at is not None:
+            pin = f"{model_name}-{trained_at.tz_convert('UTC'):%Y%m%dT%H%M%S}"
+        else: # no online model: every version in production is a full retrain
+            pin = f"{model_name}-{model_version}"
 
-    add_report(project_id=project_id, workspace=workspace, ref_data=ref_data, data=data) # Add report to project
+    ref_data_name = get_reference_data(data_path=data_path, data_name=data_name, reference_days=policy["reference_days"], pin=pin, keep=policy["references_kept"]) # Get reference data
+    # Bounded reference sample and current window, only the new bars are scored
+    ref_data, data, drift, quality, reference_version = monitor_data(data_name=data_name, ref_data_name=ref_data_name, data_path=data_path, tracking_uri=tracking_uri, model_name=model_name, preprocessor_name=preprocessor_name, stage="Production",
+                                                                     keep=policy["references_kept"])
+
+    metadata = {
+        "reference": reference_version,
+        "psi": {column: f"{psi:.4f}" for column, psi in drift["psi"].items()},
+        "drifted": drift.index[drift["drifted"]].tolist(),
+        "quality": {name: str(value) for name, value in quality.items()},
+    }
+
+    add_report(project_id=project_id, workspace=workspace, ref_data=ref_data, data=data, metadata=metadata) # Add report to project
+
+    compact_workspace(workspace=workspace, project_id=project_id, full_days=policy["full_days"], daily_days=policy["daily_days"]) # Downsample the old reports
  
 @flow
 def main_flow() -> None: 
@@ -88,20 +163,37 @@ def main_flow() -> None:
 
     print(f"Data saved in {data_name}")
 
-    X_train, X_test, y_train, y_test = train_test_split_task(data_name=data_name)
-    experiment_name = train_model_task(X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test)
+    status = update_online_model_task(data_name=data_name) # cost proportional to the new bars
+
+    if status in ("updated", "unchanged"):
+        experiment_name = ONLINE_EXPERIMENT_NAME
+        model_name, preprocessor_name = MODEL_NAME, PREPROCESSOR_NAME
+
+        print(f"Online model {status}")
+    else: # no online model yet, scheduled full retrain or drift
+        print(f"Full retrain ({status})")
+
+        X_train, X_test, y_train, y_test = train_test_split_task(data_name=data_name)
+        experiment_name = train_model_task(X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test, experiment_name=f"stock-prediction-BEL-20-{date.today()}", search="cv", n_jobs=os.cpu_count(), data_name=data_name)
+
+        print(f"Model trained and logged in {experiment_name}")
+
+        model_name, preprocessor_name = register_best_model_task(experiment_name=experiment_name, metric="cv_mape", data_name=data_name)
+
+        print(f"Best model and preprocessor registered in {experiment_name}")
 
-    print(f"Model trained and logged in {experiment_name}")
+        summary = backtest_task(data_name=data_name, experiment_name=experiment_name, metric="cv_mape")
 
-    model_name, preprocessor_name = register_best_model_task(experiment_name=experiment_name)
+        print(f"Best model backtested: {summary}")
 
-    print(f"Best model and preprocessor registered in {experiment_name}")
+        start_online_model_task(data_name=data_name, experiment_name=experiment_name, metric="cv_mape")
 
     make_predictions_task(data_name=data_name, model_name=model_name, preprocessor_name=preprocessor_name, experiment_name=experiment_name)
 
     print("Predictions made and saved in data folder")
 
-    model_monitoring(data_name=data_name, model_name=model_name, preprocessor_name=preprocessor_name, experiment_name=experiment_name)
+    model_version = production_version_task(model_name=model_name)
+    model_monitoring(data_name=data_name, model_name=model_name, preprocessor_name=preprocessor_name, experiment_name=experiment_name, model_version=model_version)
 
     print("Model performance monitored with Evidently")
 
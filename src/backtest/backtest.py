@@ -0,0 +1,310 @@
+import pandas as pd
+import numpy as np
+
+import mlflow
+
+from src.data.storage import read_dataset
+from src.predict.advice import label_advice
+from src.predict.advice_cache import SIGNALS
+from src.train_model.lag_search import encode_tickers
+
+
+def date_statistics(date_codes: np.ndarray, n_dates: int, codes: np.ndarray, n_tickers: int, lags: np.ndarray, y: np.ndarray) -> dict:
+    """Compute the least squares statistics of the fixed effects model per date, cumulated over the dates.
+
+    The statistics of any range of dates are then the difference of two
+    cumulated values, so every walk-forward window is summed in O(1) from
+    one pass over the rows instead of refitting on its rows.
+
+    Parameters
+    ----------
+    date_codes : np.ndarray
+        Date code of every row, between 0 and n_dates - 1.
+    n_dates : int
+        Number of dates.
+    codes : np.ndarray
+        Ticker code of every row, between 0 and n_tickers - 1.
+    n_tickers : int
+        Number of tickers.
+    lags : np.ndarray
+        Lags of every row, shape (n_rows, n_lags_used), without NaNs.
+    y : np.ndarray
+        Target of every row, without NaNs.
+
+    Returns
+    -------
+    dict
+        "counts" (rows per ticker), "dummy_lags" (D'X), "lag_lags" (X'X),
+        "dummy_y" (D'y) and "lag_y" (X'y) of the dates before every date
+        (index 0 to n_dates), stacked along the first axis.
+    """
+
+    n_lags_used = lags.shape[1]
+    cells = date_codes * n_tickers + codes # one cell per date and ticker
+
+    def per_cell(weights: np.ndarray = None) -> np.ndarray:
+        return np.bincount(cells, weights=weights, minlength=n_dates * n_tickers).reshape(n_dates, n_tickers)
+
+    def per_date(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(date_codes, weights=weights, minlength=n_dates)
+
+    lag_lags = np.zeros((n_dates, n_lags_used, n_lags_used))
+    for i in range(n_lags_used): # one bincount per pair of lags, the matrix is symmetric
+        for j in range(i, n_lags_used):
+            lag_lags[:, i, j] = lag_lags[:, j, i] = per_date(lags[:, i] * lags[:, j])
+
+    statistics = {
+        "counts": per_cell(),
+        "dummy_lags": np.stack([per_cell(lags[:, i]) for i in range(n_lags_used)], axis=-1),
+        "lag_lags": lag_lags,
+        "dummy_y": per_cell(y),
+        "lag_y": np.stack([per_date(lags[:, i] * y) for i in range(n_lags_used)], axis=-1),
+    }
+
+    # Dates before every date: prefix sums with a leading zero
+    return {name: np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)]) for name, values in statistics.items()}
+
+
+def solve_windows(statistics: dict, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Solve the fixed effects fit of every window of dates [start, end) at once.
+
+    Same elimination of the ticker block as `solve_lags`, on a stack of
+    windows: one batched n_lags_used x n_lags_used solve for all refits.
+
+    Parameters
+    ----------
+    statistics : dict
+        Output of `date_statistics`.
+    starts : np.ndarray
+        First date code of every window.
+    ends : np.ndarray
+        Date code after the last date of every window.
+
+    Returns
+    -------
+    tuple
+        Effect of every ticker per window (NaN for tickers without rows in
+        the window), shape (n_windows, n_tickers), and lag coefficients per
+        window, shape (n_windows, n_lags_used).
+    """
+
+    window = {name: values[ends] - values[starts] for name, values in statistics.items()}
+
+    counts = window["counts"]
+    present = counts > 0.5 # counts are sums of ones, kept as floats
+    inverse = np.where(present, 1 / np.where(present, counts, 1), 0.0)
+
+    schur = window["lag_lags"] - np.einsum("wtk,wt,wtl->wkl", window["dummy_lags"], inverse, window["dummy_lags"])
+    rhs = window["lag_y"] - np.einsum("wtk,wt->wk", window["dummy_lags"], window["dummy_y"] * inverse)
+
+    try:
+        lag_coefficients = np.linalg.solve(schur, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError: # a singular window, e.g. too few dates
+        lag_coefficients = (np.linalg.pinv(schur) @ rhs[..., None])[..., 0]
+
+    effects = np.where(present, (window["dummy_y"] - np.einsum("wtk,wk->wt", window["dummy_lags"], lag_coefficients)) * inverse, np.nan)
+
+    return effects, lag_coefficients
+
+
+def backtest(data: pd.DataFrame, n_lags_used: int, refit_every: int = 5, train_window: int = None, min_train_dates: int = 20,
+             buy_threshold: float = 0.0, sell_threshold: float = None, allow_short: bool = True, cost_bps: float = 0.0,
+             periods_per_year: int = 252) -> tuple:
+    """Replay the advice of the lag model walking forward over the dates, for all tickers at once.
+
+    The model is refitted every `refit_every` dates on the dates before
+    (all of them, or the last `train_window`) and advises on the next
+    `refit_every` dates, as `make_predictions` would have. Every day the
+    portfolio holds the tickers with a prediction in equal weight: long on
+    BUY, short on SELL (flat if not `allow_short`) and flat on HOLD.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Data indexed by date, with the columns ticker, close_growth and
+        close_growth_lag_1 up to at least close_growth_lag_{n_lags_used}.
+    n_lags_used : int
+        Number of lags used in the model.
+    refit_every : int, optional
+        Number of dates between two refits, by default 5
+    train_window : int, optional
+        Number of dates to fit on, by default all dates before the refit
+    min_train_dates : int, optional
+        Number of dates before the first refit, by default 20
+    buy_threshold : float, optional
+        BUY above this prediction, by default 0.0
+    sell_threshold : float, optional
+        SELL at or below this prediction, by default buy_threshold
+    allow_short : bool, optional
+        Go short on SELL instead of flat, by default True
+    cost_bps : float, optional
+        Trading cost in basis points of the traded weight, by default 0.0
+    periods_per_year : int, optional
+        Dates per year to annualise the returns, by default 252
+
+    Returns
+    -------
+    tuple
+        Daily results (DataFrame indexed by date with the columns return,
+        equity, drawdown, turnover and n_positions) and summary (dict of
+        metrics: total_return, annual_return, annual_volatility, sharpe,
+        hit_rate, mean_turnover, max_drawdown, n_trades, n_dates, n_refits).
+    """
+
+    date_codes, dates = pd.factorize(data.index, sort=True)
+    vocabulary, codes = encode_tickers(data["ticker"])
+    n_dates, n_tickers = len(dates), len(vocabulary)
+
+    y = data["close_growth"].to_numpy(dtype=np.float64)
+    lags = data[[f"close_growth_lag_{i}" for i in range(1, n_lags_used + 1)]].to_numpy(dtype=np.float64)
+    known = ~np.isnan(lags).any(axis=1)
+    complete = known & ~np.isnan(y)
+
+    refits = np.arange(min_train_dates, n_dates, refit_every)
+    if len(refits) == 0:
+        raise ValueError(f"{n_dates} dates leave nothing to test after {min_train_dates} training dates")
+
+    # All walk-forward fits from one pass over the rows
+    statistics = date_statistics(date_codes[complete], n_dates, codes[complete], n_tickers, lags[complete], y[complete])
+    starts = np.zeros_like(refits) if train_window is None else np.maximum(refits - train_window, 0)
+    effects, lag_coefficients = solve_windows(statistics, starts, refits)
+
+    # Every test row is predicted by the last model fitted before its date
+    test = np.flatnonzero((date_codes >= refits[0]) & known)
+    fit = (date_codes[test] - refits[0]) // refit_every
+    predictions = effects[fit, codes[test]] + np.einsum("rk,rk->r", lags[test], lag_coefficients[fit]) # NaN for tickers unseen in the window
+
+    # Unknown predictions are HOLD, i.e. flat
+    advice = label_advice(predictions, buy_threshold=buy_threshold, sell_threshold=sell_threshold)
+    sides = np.zeros(len(SIGNALS))
+    sides[SIGNALS.index("BUY")] = 1.0
+    sides[SIGNALS.index("SELL")] = -1.0 if allow_short else 0.0
+    positions = sides[advice.codes]
+
+    # Dense test dates x tickers grid
+    test_dates = n_dates - refits[0]
+    row, column = date_codes[test] - refits[0], codes[test]
+    growth = y[test]
+
+    held = np.zeros((test_dates, n_tickers))
+    held[row, column] = positions
+    returns = np.zeros((test_dates, n_tickers))
+    returns[row, column] = np.where(np.isnan(growth), 0.0, np.expm1(growth)) # close growth is a log return
+
+    n_predicted = np.bincount(row, weights=~np.isnan(predictions), minlength=test_dates)
+    weights = held / np.maximum(n_predicted, 1)[:, None] # equal weight over the tickers with a prediction
+
+    trades = np.abs(np.diff(weights, axis=0, prepend=0.0))
+    turnover = trades.sum(axis=1)
+    daily_returns = (weights * returns).sum(axis=1) - cost_bps / 1e4 * turnover
+
+    equity = np.cumprod(1 + daily_returns)
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+
+    daily = pd.DataFrame({"return": daily_returns, "equity": equity, "drawdown": drawdown, "turnover": turnover,
+                          "n_positions": np.count_nonzero(held, axis=1)}, index=dates[refits[0]:])
+
+    traded = (positions != 0) & ~np.isnan(growth)
+    volatility = daily_returns.std(ddof=1) if test_dates > 1 else np.nan
+
+    summary = {
+        "total_return": float(equity[-1] - 1),
+        "annual_return": float(equity[-1] ** (periods_per_year / test_dates) - 1),
+        "annual_volatility": float(volatility * np.sqrt(periods_per_year)),
+        "sharpe": float(daily_returns.mean() / volatility * np.sqrt(periods_per_year)) if volatility > 0 else np.nan,
+        "hit_rate": float(np.mean(positions[traded] * growth[traded] > 0)) if traded.any() else np.nan,
+        "mean_turnover": float(turnover.mean()),
+        "max_drawdown": float(drawdown.min()),
+        "n_trades": int(np.count_nonzero(np.diff(held, axis=0, prepend=0.0))),
+        "n_dates": int(test_dates),
+        "n_refits": int(len(refits)),
+    }
+
+    return daily, summary
+
+
+def log_backtest(tracking_uri: str, experiment_name: str, daily: pd.DataFrame, summary: dict, params: dict) -> str:
+    """Log a backtest in MLFlow: its settings as parameters, its summary as metrics and the daily results as a CSV artifact.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    experiment_name : str
+        Name of the experiment.
+    daily : pd.DataFrame
+        Daily results of `backtest`.
+    summary : dict
+        Summary of `backtest`.
+    params : dict
+        Settings of the backtest.
+
+    Returns
+    -------
+    str
+        ID of the run.
+    """
+
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment(experiment_name)
+
+    with mlflow.start_run(run_name="backtest") as run:
+        mlflow.log_params(params)
+        mlflow.log_metrics({name: value for name, value in summary.items() if np.isfinite(value)})
+        mlflow.log_text(daily.to_csv(), "backtest/daily.csv")
+
+    return run.info.run_id
+
+
+def best_n_lags(tracking_uri: str, experiment_name: str, metric: str = "mape") -> int:
+    """Get the number of lags of the best run of a training experiment, the one `register_best_model` registers.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    experiment_name : str
+        Name of the training experiment.
+    metric : str, optional
+        Metric the best run has the lowest value of, by default "mape"
+
+    Returns
+    -------
+    int
+        Number of lags used in the best model.
+    """
+
+    mlflow.set_tracking_uri(tracking_uri)
+    run = mlflow.search_runs(experiment_names=[experiment_name], max_results=1, order_by=[f"metrics.{metric} ASC"])
+
+    return int(run["params.n_lags_used"][0])
+
+
+def run_backtest(data_name: str, tracking_uri: str, experiment_name: str, n_lags_used: int, **kwargs) -> dict:
+    """Backtest the lag model on a dataset and log the results in MLFlow.
+
+    Parameters
+    ----------
+    data_name : str
+        Path to the data file.
+    tracking_uri : str
+        Tracking uri.
+    experiment_name : str
+        Name of the experiment.
+    n_lags_used : int
+        Number of lags used in the model.
+    **kwargs
+        Settings passed on to `backtest`.
+
+    Returns
+    -------
+    dict
+        Summary of the backtest.
+    """
+
+    data = read_dataset(data_name, regex="ticker|close_growth") # Load only the columns used by the model
+
+    daily, summary = backtest(data, n_lags_used=n_lags_used, **kwargs)
+    log_backtest(tracking_uri=tracking_uri, experiment_name=experiment_name, daily=daily, summary=summary, params=dict(kwargs, n_lags_used=n_lags_used))
+
+    return summary
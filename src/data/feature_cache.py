@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import pandas as pd
+import numpy as np
+
+
+MATRIX_NAME = "matrix.npy"
+DATES_NAME = "dates.npy"
+CODES_NAME = "tickers.npy"
+META_NAME = "meta.json"
+VERSIONS_KEPT = 2 # builds kept in the cache: readers that read the meta before a rewrite still open the build it names
+
+
+def is_feature_cache(path: str) -> bool:
+    """Check whether a path points to a feature cache written by `write_feature_cache`.
+
+    Parameters
+    ----------
+    path : str
+        Path to check.
+
+    Returns
+    -------
+    bool
+        True if the path is a feature cache.
+    """
+
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_NAME))
+
+
+def feature_cache_version(cache_path: str) -> str:
+    """Get the version of the build a feature cache points to, a hash of its content, None for caches written before builds were versioned."""
+
+    with open(os.path.join(cache_path, META_NAME), "r") as meta_file:
+        return json.load(meta_file).get("version")
+
+
+def write_feature_cache(data: pd.DataFrame, cache_path: str) -> str:
+    """Write a dataset as a memory-mappable float matrix plus a ticker/date index.
+
+    Every build is written to its own folder, named after a hash of its
+    content, and `meta.json` is replaced last to point to it: a reader
+    opens the matrix, dates and tickers of the build its meta names, so
+    it never mixes arrays of two builds. The previous build is kept for
+    readers that read the meta just before the switch.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Data indexed by date, with a ticker column and float columns.
+    cache_path : str
+        Folder to write the cache to.
+
+    Returns
+    -------
+    str
+        Path to the cache.
+    """
+
+    os.makedirs(cache_path, exist_ok=True)
+
+    data = data.sort_index(kind="stable") # same row order as the Parquet dataset: by date
+    float_columns = [column for column in data.columns if column != "ticker"]
+    codes, tickers = pd.factorize(data["ticker"], sort=True)
+
+    dates = data.index
+    tz = str(dates.tz) if dates.tz is not None else None
+    if tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+
+    arrays = {MATRIX_NAME: np.ascontiguousarray(data[float_columns].to_numpy(dtype=np.float64)),
+              DATES_NAME: dates.to_numpy(dtype="datetime64[ns]").view(np.int64), CODES_NAME: codes.astype(np.int32)}
+    meta = {"columns": data.columns.tolist(), "float_columns": float_columns, "tickers": tickers.tolist(), "tz": tz, "index_name": data.index.name}
+
+    # Version of the build: its content, so rewriting the same bars gives the same cache
+    digest = hashlib.blake2b(json.dumps(meta).encode(), digest_size=16)
+    for name, array in arrays.items():
+        digest.update(name.encode())
+        digest.update(repr(array.shape).encode())
+        digest.update(array.tobytes())
+    meta["version"] = f"v-{digest.hexdigest()}"
+
+    version_path = os.path.join(cache_path, meta["version"])
+    if not os.path.isdir(version_path):
+        tmp = os.path.join(cache_path, f"{meta['version']}.{os.getpid()}.tmp")
+        os.makedirs(tmp, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name), array)
+        try:
+            os.rename(tmp, version_path)
+        except OSError: # the same build was moved in place by another writer
+            shutil.rmtree(tmp, ignore_errors=True)
+    os.utime(version_path) # most recent build
+
+    with open(os.path.join(cache_path, f"{META_NAME}.tmp"), "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(os.path.join(cache_path, f"{META_NAME}.tmp"), os.path.join(cache_path, META_NAME)) # written last: switches the readers to the build
+
+    # Older builds, and the arrays of caches written before builds were versioned
+    builds = sorted((entry.path for entry in os.scandir(cache_path) if entry.is_dir() and entry.name.startswith("v-") and not entry.name.endswith(".tmp")), key=os.path.getmtime)
+    for path in builds[:-VERSIONS_KEPT]:
+        if path != version_path:
+            shutil.rmtree(path, ignore_errors=True)
+    for name in arrays:
+        if os.path.exists(os.path.join(cache_path, name)):
+            os.remove(os.path.join(cache_path, name))
+
+    return cache_path
+
+
+def open_feature_cache(cache_path: str, columns: list = None, regex: str = None, start=None, end=None, latest: bool = False) -> pd.DataFrame:
+    """Open a feature cache as a DataFrame backed by the memory-mapped matrix.
+
+    Rows are selected with a slice on the date-sorted matrix and contiguous
+    columns with a slice as well, so the returned float block is a view on
+    the file and only the pages that are used are read.
+
+    Parameters
+    ----------
+    cache_path : str
+        Path to the cache.
+    columns : list, optional
+        Columns to read besides the date index, by default all columns
+    regex : str, optional
+        Only read the columns matching this regular expression, by default None
+    start : str, date or pd.Timestamp, optional
+        First date to read (inclusive), by default the first date
+    end : str, date or pd.Timestamp, optional
+        Last date to read (inclusive), by default the last date
+    latest : bool, optional
+        Only read the rows of the latest date, by default False
+
+    Returns
+    -------
+    pd.DataFrame
+        Data indexed by date, with the ticker column as a categorical.
+    """
+
+    with open(os.path.join(cache_path, META_NAME), "r") as meta_file:
+        meta = json.load(meta_file)
+
+    version_path = os.path.join(cache_path, meta["version"]) if "version" in meta else cache_path # the build the meta describes
+    matrix = np.load(os.path.join(version_path, MATRIX_NAME), mmap_mode="r")
+    dates = np.load(os.path.join(version_path, DATES_NAME), mmap_mode="r")
+    codes = np.load(os.path.join(version_path, CODES_NAME), mmap_mode="r")
+
+    # Rows: dates are sorted, so any date range is a slice
+    first, last = 0, len(dates)
+    if latest and len(dates):
+        first = int(np.searchsorted(dates, dates[-1], side="left"))
+    if start is not None:
+        first = max(first, int(np.searchsorted(dates, _to_utc_ns(start, meta["tz"]), side="left")))
+    if end is not None:
+        last = int(np.searchsorted(dates, _to_utc_ns(end, meta["tz"]), side="right"))
+
+    # Columns: explicit list, regular expression or all
+    selected = meta["columns"]
+    if columns is not None:
+        selected = [column for column in meta["columns"] if column in columns]
+    if regex is not None:
+        selected = [column for column in selected if re.search(regex, column)]
+
+    positions = [meta["float_columns"].index(column) for column in selected if column != "ticker"]
+    if positions and positions == list(range(positions[0], positions[-1] + 1)):
+        block = matrix[first:last, positions[0]:positions[-1] + 1] # contiguous columns: view on the file
+    else:
+        block = matrix[first:last][:, positions]
+
+    index = pd.DatetimeIndex(np.asarray(dates[first:last]).view("datetime64[ns]"), name=meta["index_name"])
+    if meta["tz"] is not None:
+        index = index.tz_localize("UTC").tz_convert(meta["tz"])
+
+    data = pd.DataFrame(block, index=index, columns=[column for column in selected if column != "ticker"], copy=False)
+
+    if "ticker" in selected:
+        data.insert(selected.index("ticker"), "ticker", pd.Categorical.from_codes(np.asarray(codes[first:last]), categories=meta["tickers"]))
+
+    return data
+
+
+def _to_utc_ns(value, tz: str) -> np.int64:
+    """Convert a date-like value to nanoseconds since the epoch in UTC, like the stored dates."""
+
+    timestamp = pd.Timestamp(value)
+
+    if timestamp.tz is None and tz is not None:
+        timestamp = timestamp.tz_localize(tz)
+    if timestamp.tz is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+
+    return np.int64(timestamp.value)
@@ -0,0 +1,64 @@
+import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def build_features(data: pd.DataFrame, n_lags: int = 10) -> pd.DataFrame:
+    """Add the close growth and its lags to the bars of all tickers in one pass.
+
+    The bars are laid out as one contiguous block per ticker, so the previous
+    close and all lags are read from a sliding window over the growth column
+    instead of grouping the data again for every lag.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Bars indexed by date, with a "Close" and a "ticker" column.
+    n_lags : int, optional
+        Number of lags to add to the data, by default 10
+
+    Returns
+    -------
+    pd.DataFrame
+        Data with the columns close, ticker, close_previous_day, close_growth
+        and close_growth_lag_1 up to close_growth_lag_{n_lags}, sorted by
+        ticker (in order of appearance) and date.
+    """
+
+    # Contiguous layout: rows sorted by ticker, then by date
+    codes, tickers = pd.factorize(data["ticker"], sort=False)
+    dates = data.index.asi8 if isinstance(data.index, pd.DatetimeIndex) else data.index.to_numpy() # sort on int64, not on Timestamp objects
+    order = np.lexsort((dates, codes))
+    codes = codes[order]
+    close = data["Close"].to_numpy(dtype=np.float64)[order]
+    n_rows = len(close)
+
+    # Position of every row within its ticker block
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if n_rows else np.array([], dtype=int)
+    position = np.arange(n_rows) - np.repeat(starts, np.diff(np.r_[starts, n_rows]))
+
+    close_previous_day = np.r_[np.nan, close[:-1]] if n_rows else close.copy()
+    close_previous_day[position == 0] = np.nan # the first bar of a ticker has no previous close
+    close_growth = np.log(close) - np.log(close_previous_day)
+
+    # One contiguous float block: close, previous close, growth and all lags
+    block = np.empty((n_rows, 3 + n_lags))
+    block[:, 0] = close
+    block[:, 1] = close_previous_day
+    block[:, 2] = close_growth
+
+    # windows[r, j] holds close_growth[r + j - n_lags], so the lags are the first n_lags columns in reverse
+    padded = np.r_[np.full(n_lags, np.nan), close_growth]
+    block[:, 3:] = sliding_window_view(padded, n_lags + 1)[:, :n_lags][:, ::-1]
+
+    # Lags reaching into the previous ticker are missing, only the first n_lags rows of each ticker are affected
+    head = np.flatnonzero(position < n_lags)
+    head_lags = block[head, 3:]
+    head_lags[position[head, None] < np.arange(1, n_lags + 1)] = np.nan
+    block[head, 3:] = head_lags
+
+    features = pd.DataFrame(block, index=data.index[order],
+                            columns=["close", "close_previous_day", "close_growth"] + [f"close_growth_lag_{i}" for i in range(1, n_lags + 1)])
+    features.insert(1, "ticker", tickers.to_numpy()[codes])
+
+    return features
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from typing import Callable
+
+import pandas as pd
+
+
+def fetch_with_retry(fetch: Callable[[str], pd.DataFrame], ticker: str, retries: int = 3, backoff_seconds: float = 1.0) -> pd.DataFrame:
+    """Fetch the history of one ticker, retrying with exponential backoff.
+
+    Parameters
+    ----------
+    fetch : Callable[[str], pd.DataFrame]
+        Function returning the history of a ticker.
+    ticker : str
+        Ticker of the stock.
+    retries : int, optional
+        Number of retries after the first attempt, by default 3
+    backoff_seconds : float, optional
+        Wait before the first retry, doubled after every retry, by default 1.0
+
+    Returns
+    -------
+    pd.DataFrame
+        History of the ticker.
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            return fetch(ticker)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff_seconds * 2 ** attempt)
+
+
+def fetch_histories(tickers: list, fetch: Callable[[str], pd.DataFrame], max_workers: int = 8, retries: int = 3, backoff_seconds: float = 1.0) -> tuple:
+    """Fetch the history of several tickers concurrently with a bounded pool of threads.
+
+    Parameters
+    ----------
+    tickers : list
+        List of tickers of stocks.
+    fetch : Callable[[str], pd.DataFrame]
+        Function returning the history of a ticker.
+    max_workers : int, optional
+        Maximum number of concurrent downloads, by default 8
+    retries : int, optional
+        Number of retries per ticker, by default 3
+    backoff_seconds : float, optional
+        Wait before the first retry of a ticker, by default 1.0
+
+    Returns
+    -------
+    tuple
+        Dictionary of ticker to history for the tickers that succeeded and
+        dictionary of ticker to exception for the tickers that failed.
+    """
+
+    histories, failures = {}, {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tickers)))) as executor:
+        futures = {executor.submit(fetch_with_retry, fetch, ticker, retries, backoff_seconds): ticker for ticker in tickers}
+
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                histories[ticker] = future.result()
+            except Exception as error: # report the failure, the other tickers still go through
+                failures[ticker] = error
+
+    return histories, failures
@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+import pandas as pd
+
+from src.data.feature_cache import feature_cache_version, is_feature_cache
+
+
+_fingerprints = {} # content hash per (path, modification time, size), a file is only read once per process while it does not change
+
+
+def fingerprint(path: str) -> str:
+    """Hash the content of a file, or of all files of a folder such as a feature cache.
+
+    Parameters
+    ----------
+    path : str
+        Path to a file or a folder.
+
+    Returns
+    -------
+    str
+        Hex digest, the same for the same content wherever and whenever it was written.
+    """
+
+    version = feature_cache_version(path) if is_feature_cache(path) else None
+    if version is not None: # named after the content of the build the cache points to
+        return version[len("v-"):]
+
+    if os.path.isdir(path):
+        digest = hashlib.blake2b(digest_size=16)
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".tmp"): # files being replaced
+                digest.update(name.encode())
+                digest.update(fingerprint(os.path.join(path, name)).encode())
+        return digest.hexdigest()
+
+    status = os.stat(path)
+    key = (os.path.abspath(path), status.st_mtime_ns, status.st_size)
+    if key not in _fingerprints:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as content:
+            for chunk in iter(lambda: content.read(1 << 20), b""):
+                digest.update(chunk)
+        _fingerprints[key] = digest.hexdigest()
+
+    return _fingerprints[key]
+
+
+def _update(digest, value) -> None:
+    """Add a parameter to a hash: data by content, paths by the content they point to, anything else by its repr."""
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(value.columns.tolist() if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _update(digest, item)
+    elif isinstance(value, str) and os.path.exists(value):
+        digest.update(fingerprint(value).encode())
+    else:
+        digest.update(repr(value).encode())
+
+
+def task_cache_key(context, parameters: dict) -> str:
+    """Cache key of a Prefect task: its name and the content of its inputs.
+
+    Used as `cache_key_fn`, a task is skipped and its persisted result reused
+    when it is called again with data files, data frames and parameters that
+    did not change, even if the files were rewritten in the meantime.
+
+    Parameters
+    ----------
+    context : prefect.context.TaskRunContext
+        Context of the task run.
+    parameters : dict
+        Parameters of the task run.
+
+    Returns
+    -------
+    str
+        Cache key.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(context.task.name.encode())
+    for name in sorted(parameters):
+        digest.update(name.encode())
+        _update(digest, parameters[name])
+
+    return digest.hexdigest()
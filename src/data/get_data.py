@@ -6,9 +6,15 @@ import requests
 from tabula import read_pdf
 import pandas as pd 
 
-import yfinance as yf
 import numpy as np
 
+from src.data.price_store import last_bar, append_bars, read_bars, load_manifest
+from src.data.fetch import fetch_histories
+from src.data.features import build_features
+from src.data.storage import write_dataset
+from src.data.feature_cache import write_feature_cache
+from src.data.providers import MarketDataProvider, YahooFinanceProvider, period_to_timedelta
+
 def load_datapath(env_path: str = ".env") -> str:
     """Load the data path from the .env file.
     
@@ -48,8 +54,59 @@ def get_BEL20_composition(data_path: str) -> pd.Series:
 
     return tickers
 
-def get_data(tickers: list, data_path: str, length_of_data: str = "60d", n_lags: int = 10) -> None:
-    """Get data from Yahoo Finance.
+def update_price_store(tickers: list, store_path: str, length_of_data: str = "60d", max_workers: int = 8, retries: int = 3, backoff_seconds: float = 1.0, provider: MarketDataProvider = None) -> tuple:
+    """Download the bars missing from the price store and append them.
+
+    Tickers that are not stored yet get the full period, the others only the
+    bars from their last stored bar onwards. Downloads run concurrently.
+
+    Parameters
+    ----------
+    tickers : list
+        List of tickers of stocks.
+    store_path : str
+        Path to the price store.
+    length_of_data : str, optional
+        Length of the data to get for tickers that are not stored yet, by default "60d"
+    max_workers : int, optional
+        Maximum number of concurrent downloads, by default 8
+    retries : int, optional
+        Number of retries per ticker, by default 3
+    backoff_seconds : float, optional
+        Wait before the first retry of a ticker, by default 1.0
+    provider : MarketDataProvider, optional
+        Source of the bars, by default Yahoo Finance
+
+    Returns
+    -------
+    tuple
+        Number of new bars appended to the store and dictionary of ticker to
+        exception for the tickers that could not be downloaded.
+    """
+
+    provider = provider or YahooFinanceProvider()
+
+    def fetch(ticker: str) -> pd.DataFrame:
+        last = last_bar(store_path, ticker)
+
+        if last is None:
+            return provider.history(ticker, period=length_of_data)
+
+        return provider.history(ticker, start=last.strftime("%Y-%m-%d")) # refetch the last bar, it may have been incomplete
+
+    histories, failures = fetch_histories(tickers=list(tickers), fetch=fetch, max_workers=max_workers, retries=retries, backoff_seconds=backoff_seconds)
+
+    n_new_bars = 0
+    for ticker, hist in histories.items(): # the store is only written from this thread
+        n_new_bars += append_bars(store_path, ticker, hist)
+
+    return n_new_bars, failures
+
+def get_data(tickers: list, data_path: str, length_of_data: str = "60d", n_lags: int = 10, max_workers: int = 8, retries: int = 3, provider: MarketDataProvider = None, feature_cache: bool = True) -> None:
+    """Get data from Yahoo Finance or another market data provider.
+
+    Only the bars missing from the local price store are downloaded, the
+    dataset is then built from the last `length_of_data` of the store.
     
     Parameters
     ----------
@@ -61,29 +118,44 @@ def get_data(tickers: list, data_path: str, length_of_data: str = "60d", n_lags:
         Length of the data to get from Yahoo Finance, by default "60d"
     n_lags : int, optional
         Number of lags to add to the data, by default 10
+    max_workers : int, optional
+        Maximum number of concurrent downloads, by default 8
+    retries : int, optional
+        Number of retries per ticker, by default 3
+    provider : MarketDataProvider, optional
+        Source of the bars, by default Yahoo Finance
+    feature_cache : bool, optional
+        Also write a memory-mapped copy of the data for the downstream tasks, by default True
     
     Returns
     -------
-    String with location of data.
+    String with location of data (the feature cache if it is written).
     
     """
 
-    # Get data from Yahoo Finance
-    data = pd.DataFrame()
-    for ticker in tickers: 
-        msft = yf.Ticker(ticker)
-        hist = msft.history(period=length_of_data)
-        hist['ticker'] = ticker
-        data = pd.concat([data, hist])
-    
-    data["close_previous_day"] = data.groupby("ticker")["Close"].shift(1) # shift the close price by 1 day
-    data["close_growth"] = np.log(data["Close"]) - np.log(data["close_previous_day"]) # calculate the growth rate
-    data.rename(columns={'Close': 'close'}, inplace=True) # rename the column
+    # Get new data from Yahoo Finance
+    store_path = f"{data_path}/price_store"
+    n_new_bars, failures = update_price_store(tickers=tickers, store_path=store_path, length_of_data=length_of_data, max_workers=max_workers, retries=retries, provider=provider)
+
+    print(f"{n_new_bars} new bars stored")
+    for ticker, error in failures.items(): # tickers that failed keep their previously stored bars
+        print(f"Could not download {ticker}: {error!r}")
 
-    for i in range(1, n_lags+1): 
-        data[f"close_growth_lag_{i}"] = data.groupby("ticker")["close_growth"].shift(i) # shift the close price by i days
+    # Read the requested window from the store
+    manifest = load_manifest(store_path)
+    if not any(ticker in manifest for ticker in tickers):
+        raise RuntimeError(f"No data available for any of the {len(tickers)} tickers")
+
+    window_end = max(pd.Timestamp(manifest[ticker]) for ticker in tickers if ticker in manifest)
+    data = read_bars(store_path, tickers=list(tickers), start=window_end - period_to_timedelta(length_of_data))
+    
+    data = build_features(data, n_lags=n_lags) # add growth rate and its lags
     
-    # Write data to pickle file
-    data.filter(regex='ticker|Date|close').to_pickle(f"{data_path}/BEL_20.pkl")  # filter columns and write to pickle file
+    # Write data to Parquet file
+    data = data.filter(regex='ticker|Date|close')  # filter columns
+    data_name = write_dataset(data, f"{data_path}/BEL_20.parquet")  # write with one row group per date
+
+    if feature_cache: # downstream tasks open this copy zero-copy instead of deserializing the dataset again
+        data_name = write_feature_cache(data, f"{data_path}/BEL_20.features")
 
-    return f"{data_path}/BEL_20.pkl"
\ No newline at end of file
+    return data_name
\ No newline at end of file
@@ -0,0 +1,250 @@
+import json
+import os
+
+import pandas as pd
+
+
+MANIFEST_NAME = "manifest.json"
+PARTITION_FORMAT = "%Y-%m"
+PARTITION_SUFFIX = ".parquet"
+LEGACY_PARTITION_SUFFIX = ".pkl" # partitions written before the switch to Parquet
+
+
+def _ticker_path(store_path: str, ticker: str) -> str:
+    """Get the folder holding the partitions of one ticker.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the price store.
+    ticker : str
+        Ticker of the stock.
+
+    Returns
+    -------
+    str
+        Path to the folder of the ticker.
+    """
+
+    return os.path.join(store_path, f"ticker={ticker}")
+
+
+def _as_timestamp(value, tz) -> pd.Timestamp:
+    """Convert a date-like value to a timestamp comparable with the stored bars.
+
+    Parameters
+    ----------
+    value : str, date or pd.Timestamp
+        Date to convert.
+    tz : tzinfo or None
+        Timezone of the stored bars.
+
+    Returns
+    -------
+    pd.Timestamp
+        Timestamp in the timezone of the stored bars.
+    """
+
+    timestamp = pd.Timestamp(value)
+
+    if timestamp.tz is None and tz is not None:
+        timestamp = timestamp.tz_localize(tz)
+    elif timestamp.tz is not None and tz is None:
+        timestamp = timestamp.tz_localize(None)
+
+    return timestamp
+
+
+def load_manifest(store_path: str) -> dict:
+    """Load the manifest with the last stored bar of each ticker.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the price store.
+
+    Returns
+    -------
+    dict
+        Mapping of ticker to the ISO timestamp of its last stored bar.
+    """
+
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, "r") as manifest_file:
+        return json.load(manifest_file)
+
+
+def _write_manifest(store_path: str, manifest: dict) -> None:
+    """Write the manifest atomically so a crashed run never leaves it half written."""
+
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+
+    with open(f"{manifest_path}.tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def last_bar(store_path: str, ticker: str) -> pd.Timestamp:
+    """Get the timestamp of the last stored bar of a ticker.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the price store.
+    ticker : str
+        Ticker of the stock.
+
+    Returns
+    -------
+    pd.Timestamp
+        Timestamp of the last stored bar, None if the ticker is not stored yet.
+    """
+
+    last = load_manifest(store_path).get(ticker)
+
+    return pd.Timestamp(last) if last is not None else None
+
+
+def _partition_files(ticker_path: str) -> dict:
+    """Map every partition of a ticker to its file, preferring Parquet over legacy pickle files."""
+
+    files = {}
+    for suffix in (LEGACY_PARTITION_SUFFIX, PARTITION_SUFFIX):
+        for name in os.listdir(ticker_path):
+            if name.endswith(suffix):
+                files[name[:-len(suffix)]] = os.path.join(ticker_path, name)
+
+    return files
+
+
+def _read_partition(path: str) -> pd.DataFrame:
+    """Read one partition of the store."""
+
+    if path.endswith(LEGACY_PARTITION_SUFFIX):
+        return pd.read_pickle(path)
+
+    return pd.read_parquet(path)
+
+
+def _write_partition(bars: pd.DataFrame, path: str) -> None:
+    """Write one partition of the store atomically."""
+
+    bars.to_parquet(f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+def append_bars(store_path: str, ticker: str, bars: pd.DataFrame) -> int:
+    """Append new bars of a ticker to the store.
+
+    Stored bars from the first new bar onwards are replaced, so the last
+    (possibly still incomplete) bar of the previous run is refreshed.
+    Only the partitions touched by the new bars are rewritten.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the price store.
+    ticker : str
+        Ticker of the stock.
+    bars : pd.DataFrame
+        New bars, indexed by date.
+
+    Returns
+    -------
+    int
+        Number of bars that were not in the store before.
+    """
+
+    if bars.empty:
+        return 0
+
+    bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+
+    ticker_path = _ticker_path(store_path, ticker)
+    os.makedirs(ticker_path, exist_ok=True)
+
+    previous_last = last_bar(store_path, ticker)
+    first_new = bars.index.min()
+    stored_files = _partition_files(ticker_path)
+
+    for partition, new_bars in bars.groupby(bars.index.strftime(PARTITION_FORMAT)): # only rewrite touched months
+        partition_path = os.path.join(ticker_path, f"{partition}{PARTITION_SUFFIX}")
+
+        if partition in stored_files:
+            stored = _read_partition(stored_files[partition])
+            new_bars = pd.concat([stored[stored.index < first_new], new_bars])
+
+        _write_partition(new_bars, partition_path)
+
+        if stored_files.get(partition, partition_path) != partition_path: # the legacy file is superseded
+            os.remove(stored_files[partition])
+
+    manifest = load_manifest(store_path)
+    manifest[ticker] = bars.index.max().isoformat()
+    _write_manifest(store_path, manifest)
+
+    if previous_last is None:
+        return len(bars)
+
+    return int((bars.index > _as_timestamp(previous_last, bars.index.tz)).sum())
+
+
+def read_bars(store_path: str, tickers: list = None, start=None, end=None) -> pd.DataFrame:
+    """Read bars from the store for a date range.
+
+    Only the monthly partitions overlapping the range are loaded.
+
+    Parameters
+    ----------
+    store_path : str
+        Path to the price store.
+    tickers : list, optional
+        Tickers to read, by default all stored tickers.
+    start : str, date or pd.Timestamp, optional
+        First date to read (inclusive), by default the first stored bar.
+    end : str, date or pd.Timestamp, optional
+        Last date to read (inclusive), by default the last stored bar.
+
+    Returns
+    -------
+    pd.DataFrame
+        Bars of all tickers, indexed by date and with a ticker column.
+    """
+
+    if tickers is None:
+        tickers = sorted(load_manifest(store_path))
+
+    start_partition = pd.Timestamp(start).strftime(PARTITION_FORMAT) if start is not None else None
+    end_partition = pd.Timestamp(end).strftime(PARTITION_FORMAT) if end is not None else None
+
+    frames = []
+    for ticker in tickers:
+        ticker_path = _ticker_path(store_path, ticker)
+        if not os.path.isdir(ticker_path):
+            continue
+
+        files = _partition_files(ticker_path)
+        partitions = [partition for partition in sorted(files)
+                      if (start_partition is None or partition >= start_partition) and (end_partition is None or partition <= end_partition)]
+
+        for partition in partitions:
+            bars = _read_partition(files[partition])
+
+            if start is not None:
+                bars = bars[bars.index >= _as_timestamp(start, bars.index.tz)]
+            if end is not None:
+                bars = bars[bars.index <= _as_timestamp(end, bars.index.tz)]
+
+            bars = bars.copy()
+            bars["ticker"] = ticker
+            frames.append(bars)
+
+    if not frames:
+        return pd.DataFrame(columns=["ticker"])
+
+    return pd.concat(frames) # concatenate once instead of growing the frame per ticker
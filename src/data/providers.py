@@ -0,0 +1,241 @@
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+import os
+
+import pandas as pd
+import numpy as np
+
+import yfinance as yf
+
+
+def period_to_timedelta(period: str) -> pd.Timedelta:
+    """Convert a Yahoo Finance period (e.g. "60d", "3mo", "1y") to a timedelta.
+
+    Parameters
+    ----------
+    period : str
+        Period in Yahoo Finance notation.
+
+    Returns
+    -------
+    pd.Timedelta
+        Length of the period.
+    """
+
+    units = {"d": 1, "wk": 7, "mo": 31, "y": 366} # upper bounds, so the window never comes up short
+
+    for unit, days in units.items():
+        if period.endswith(unit) and period[:-len(unit)].isdigit():
+            return pd.Timedelta(days=int(period[:-len(unit)]) * days)
+
+    raise ValueError(f"Unsupported period: {period}")
+
+
+class MarketDataProvider(ABC):
+    """Source of daily OHLCV bars, indexed by date."""
+
+    @abstractmethod
+    def history(self, ticker: str, period: str = None, start: str = None) -> pd.DataFrame:
+        """Get the history of one ticker.
+
+        Parameters
+        ----------
+        ticker : str
+            Ticker of the stock.
+        period : str, optional
+            Length of the data to get (e.g. "60d"), by default None
+        start : str, optional
+            First date to get, takes precedence over `period`, by default None
+
+        Returns
+        -------
+        pd.DataFrame
+            History of the ticker, indexed by date.
+        """
+
+    def list_tickers(self) -> list:
+        """Tickers served by the provider, None if it serves any ticker."""
+
+        return None
+
+
+class YahooFinanceProvider(MarketDataProvider):
+    """Live bars from the Yahoo Finance API."""
+
+    def history(self, ticker: str, period: str = None, start: str = None) -> pd.DataFrame:
+        if start is not None:
+            return yf.Ticker(ticker).history(start=start)
+
+        return yf.Ticker(ticker).history(period=period)
+
+
+class ReplayProvider(MarketDataProvider):
+    """Recorded or synthetic bars replayed from one CSV file per ticker.
+
+    Parameters
+    ----------
+    replay_path : str
+        Folder with a `{ticker}.csv` file per ticker.
+    end : str or pd.Timestamp, optional
+        Replay the data as if it was requested at this date, by default the last recorded bar.
+    tz : str, optional
+        Timezone of the bars, by default "Europe/Brussels" like Yahoo Finance for Euronext Brussels.
+    """
+
+    def __init__(self, replay_path: str, end=None, tz: str = "Europe/Brussels"):
+        self.replay_path = replay_path
+        self.end = end
+        self.tz = tz
+        self._bars = {} # parsed files, so replaying many runs only reads each file once
+
+    def _load(self, ticker: str) -> pd.DataFrame:
+        if ticker not in self._bars:
+            bars = pd.read_csv(os.path.join(self.replay_path, f"{ticker}.csv"), index_col="Date")
+            bars.index = pd.to_datetime(bars.index, utc=True).tz_convert(self.tz)
+            self._bars[ticker] = bars.sort_index()
+
+        return self._bars[ticker]
+
+    def history(self, ticker: str, period: str = None, start: str = None) -> pd.DataFrame:
+        bars = self._load(ticker)
+
+        if self.end is not None:
+            bars = bars[bars.index <= _localize(self.end, self.tz)]
+        if bars.empty:
+            return bars
+
+        if start is not None:
+            return bars[bars.index >= _localize(start, self.tz)]
+
+        return bars[bars.index > bars.index.max() - period_to_timedelta(period)]
+
+    def list_tickers(self) -> list:
+        return sorted(name[:-len(".csv")] for name in os.listdir(self.replay_path) if name.endswith(".csv"))
+
+
+def _localize(value, tz: str) -> pd.Timestamp:
+    """Convert a date-like value to a timestamp in the given timezone."""
+
+    timestamp = pd.Timestamp(value)
+
+    return timestamp.tz_localize(tz) if timestamp.tz is None else timestamp.tz_convert(tz)
+
+
+def generate_synthetic_bars(n_tickers: int = 20, n_days: int = 250, end: str = None, seed: int = 42, tz: str = "Europe/Brussels") -> dict:
+    """Generate daily OHLCV bars following a geometric Brownian motion.
+
+    Parameters
+    ----------
+    n_tickers : int, optional
+        Number of tickers, by default 20
+    n_days : int, optional
+        Number of trading days per ticker, by default 250
+    end : str, optional
+        Last trading day, by default today
+    seed : int, optional
+        Seed of the random generator, by default 42
+    tz : str, optional
+        Timezone of the bars, by default "Europe/Brussels"
+
+    Returns
+    -------
+    dict
+        Dictionary of ticker to bars, in the format returned by Yahoo Finance.
+    """
+
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=end or pd.Timestamp.today().normalize(), periods=n_days, name="Date").tz_localize(tz)
+
+    # Simulate all tickers at once: one column per ticker
+    drift = rng.normal(0.0002, 0.0005, size=n_tickers)
+    volatility = rng.uniform(0.005, 0.03, size=n_tickers)
+    log_returns = drift + volatility * rng.standard_normal((n_days, n_tickers))
+    close = rng.uniform(10, 200, size=n_tickers) * np.exp(np.cumsum(log_returns, axis=0))
+
+    open_ = np.vstack([close[:1], close[:-1]]) * np.exp(volatility * 0.2 * rng.standard_normal((n_days, n_tickers)))
+    high = np.maximum(open_, close) * (1 + np.abs(volatility * 0.5 * rng.standard_normal((n_days, n_tickers))))
+    low = np.minimum(open_, close) * (1 - np.abs(volatility * 0.5 * rng.standard_normal((n_days, n_tickers))))
+    volume = rng.integers(10_000, 1_000_000, size=(n_days, n_tickers))
+
+    bars = {}
+    for i in range(n_tickers):
+        bars[f"SYN{i:04d}.BR"] = pd.DataFrame({"Open": open_[:, i], "High": high[:, i], "Low": low[:, i], "Close": close[:, i],
+                                               "Volume": volume[:, i], "Dividends": 0.0, "Stock Splits": 0.0}, index=dates)
+
+    return bars
+
+
+def write_replay_data(replay_path: str, n_tickers: int = 20, n_days: int = 250, end: str = None, seed: int = 42) -> list:
+    """Write synthetic bars as replay files for the `ReplayProvider`.
+
+    Parameters
+    ----------
+    replay_path : str
+        Folder to write the `{ticker}.csv` files to.
+    n_tickers : int, optional
+        Number of tickers, by default 20
+    n_days : int, optional
+        Number of trading days per ticker, by default 250
+    end : str, optional
+        Last trading day, by default today
+    seed : int, optional
+        Seed of the random generator, by default 42
+
+    Returns
+    -------
+    list
+        Tickers written.
+    """
+
+    os.makedirs(replay_path, exist_ok=True)
+
+    bars = generate_synthetic_bars(n_tickers=n_tickers, n_days=n_days, end=end, seed=seed)
+    for ticker, hist in bars.items():
+        hist.to_csv(os.path.join(replay_path, f"{ticker}.csv"))
+
+    return list(bars)
+
+
+def load_provider(env_path: str = ".env") -> MarketDataProvider:
+    """Load the market data provider configured in the .env file.
+
+    DATA_PROVIDER selects "yahoo" (default) or "replay", in which case
+    REPLAY_PATH points to the folder with the replay files and the optional
+    REPLAY_END to the date the data is replayed at.
+
+    Parameters
+    ----------
+    env_path : str, optional
+        Path to the .env file, by default ".env"
+
+    Returns
+    -------
+    MarketDataProvider
+        Configured provider.
+    """
+
+    # get environment variables
+    load_dotenv(dotenv_path=env_path)
+    DATA_PROVIDER = os.getenv("DATA_PROVIDER", "yahoo")
+
+    if DATA_PROVIDER == "yahoo":
+        return YahooFinanceProvider()
+    if DATA_PROVIDER == "replay":
+        return ReplayProvider(replay_path=os.getenv("REPLAY_PATH"), end=os.getenv("REPLAY_END"))
+
+    raise ValueError(f"Unknown data provider: {DATA_PROVIDER}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write synthetic replay data for the ReplayProvider.")
+    parser.add_argument("replay_path")
+    parser.add_argument("--n-tickers", type=int, default=20)
+    parser.add_argument("--n-days", type=int, default=250)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tickers = write_replay_data(args.replay_path, n_tickers=args.n_tickers, n_days=args.n_days, end=args.end, seed=args.seed)
+    print(f"Wrote {len(tickers)} tickers x {args.n_days} days to {args.replay_path}")
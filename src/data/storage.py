@@ -0,0 +1,160 @@
+import os
+import re
+
+import pandas as pd
+import numpy as np
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.data.feature_cache import is_feature_cache, open_feature_cache
+
+
+DATE_COLUMN = "Date"
+
+
+def write_dataset(data: pd.DataFrame, path: str) -> str:
+    """Write a dataset indexed by date to a Parquet file with one row group per date.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Data indexed by date.
+    path : str
+        Path to the Parquet file.
+
+    Returns
+    -------
+    str
+        Path to the Parquet file.
+    """
+
+    data = data.sort_index(kind="stable") # row groups in date order, the last one holds the latest date
+    table = pa.Table.from_pandas(data, preserve_index=True)
+
+    # Boundaries of the blocks of rows sharing a date
+    dates = data.index.to_numpy()
+    starts = np.r_[0, np.flatnonzero(dates[1:] != dates[:-1]) + 1, len(dates)]
+
+    with pq.ParquetWriter(f"{path}.tmp", table.schema) as writer:
+        for start, end in zip(starts[:-1], starts[1:]):
+            writer.write_table(table.slice(start, end - start))
+
+    os.replace(f"{path}.tmp", path) # readers never see a half written file
+
+    return path
+
+
+def _row_group_dates(parquet_file: pq.ParquetFile) -> list:
+    """Get the first and last date of every row group from the Parquet statistics."""
+
+    date_index = parquet_file.schema_arrow.get_field_index(DATE_COLUMN)
+
+    bounds = []
+    for i in range(parquet_file.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(date_index).statistics
+        bounds.append((pd.Timestamp(statistics.min), pd.Timestamp(statistics.max)) if statistics is not None and statistics.has_min_max else (None, None))
+
+    return bounds
+
+
+def _project(parquet_file: pq.ParquetFile, columns: list, regex: str) -> list:
+    """Resolve the columns to read from an explicit list or a regular expression on the column names."""
+
+    if regex is None:
+        return columns
+
+    pattern = re.compile(regex)
+
+    return [name for name in parquet_file.schema_arrow.names if name != DATE_COLUMN and pattern.search(name)]
+
+
+def read_dataset(path: str, columns: list = None, regex: str = None, start=None, end=None) -> pd.DataFrame:
+    """Read a dataset written by `write_dataset`, only loading the requested columns and dates.
+
+    Feature caches written by `write_feature_cache` are opened memory-mapped instead.
+
+    Parameters
+    ----------
+    path : str
+        Path to the Parquet file.
+    columns : list, optional
+        Columns to read besides the date index, by default all columns
+    regex : str, optional
+        Only read the columns matching this regular expression, like `pd.DataFrame.filter`, by default None
+    start : str, date or pd.Timestamp, optional
+        First date to read (inclusive), by default the first date
+    end : str, date or pd.Timestamp, optional
+        Last date to read (inclusive), by default the last date
+
+    Returns
+    -------
+    pd.DataFrame
+        Data indexed by date.
+    """
+
+    if is_feature_cache(path):
+        return open_feature_cache(path, columns=columns, regex=regex, start=start, end=end)
+
+    parquet_file = pq.ParquetFile(path)
+
+    row_groups = list(range(parquet_file.num_row_groups))
+    if start is not None or end is not None: # skip row groups outside of the range based on their statistics
+        tz = parquet_file.schema_arrow.field(DATE_COLUMN).type.tz
+        start = _localize(start, tz)
+        end = _localize(end, tz)
+        row_groups = [i for i, (first, last) in enumerate(_row_group_dates(parquet_file))
+                      if first is None or ((start is None or last >= start) and (end is None or first <= end))]
+
+    data = parquet_file.read_row_groups(row_groups, columns=_project(parquet_file, columns, regex), use_pandas_metadata=True).to_pandas()
+
+    if start is not None:
+        data = data[data.index >= start]
+    if end is not None:
+        data = data[data.index <= end]
+
+    return data
+
+
+def read_latest(path: str, columns: list = None, regex: str = None) -> pd.DataFrame:
+    """Read only the rows of the latest date of a dataset written by `write_dataset`.
+
+    Feature caches written by `write_feature_cache` are opened memory-mapped instead.
+
+    Parameters
+    ----------
+    path : str
+        Path to the Parquet file.
+    columns : list, optional
+        Columns to read besides the date index, by default all columns
+    regex : str, optional
+        Only read the columns matching this regular expression, like `pd.DataFrame.filter`, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        Data of the latest date, indexed by date.
+    """
+
+    if is_feature_cache(path):
+        return open_feature_cache(path, columns=columns, regex=regex, latest=True)
+
+    parquet_file = pq.ParquetFile(path)
+
+    return parquet_file.read_row_group(parquet_file.num_row_groups - 1, columns=_project(parquet_file, columns, regex), use_pandas_metadata=True).to_pandas()
+
+
+def _localize(value, tz) -> pd.Timestamp:
+    """Convert a date-like value to a timestamp comparable with the stored dates."""
+
+    if value is None:
+        return None
+
+    timestamp = pd.Timestamp(value)
+
+    if timestamp.tz is None and tz is not None:
+        return timestamp.tz_localize(tz)
+    if timestamp.tz is not None and tz is None:
+        return timestamp.tz_convert("UTC").tz_localize(None)
+
+    return timestamp
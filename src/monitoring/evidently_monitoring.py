@@ -4,6 +4,8 @@ from dotenv import load_dotenv
 import os
 import numpy as np
 import uuid
+import shutil
+import hashlib
 
 import mlflow
 from datetime import date
@@ -11,9 +13,17 @@ from datetime import date
 from evidently.metrics import DatasetDriftMetric, DataDriftTable, ColumnDriftMetric, RegressionQualityMetric
 from evidently.metric_preset import DataDriftPreset, TargetDriftPreset, DataQualityPreset, RegressionPreset
 from evidently.report import Report
+from evidently.suite.base_suite import Snapshot
 from evidently.ui.dashboards import CounterAgg, DashboardPanelCounter, DashboardPanelPlot, PanelValue, PlotType, ReportFilter
 from evidently.ui.workspace import Workspace, WorkspaceBase
 
+from src.data.storage import read_dataset, read_latest, write_dataset
+from src.data.fingerprint import fingerprint
+from src.predict.history import HISTORY_NAME, features_hash, read_predictions
+from src.predict.artifact_cache import ARTIFACT_CACHE_NAME, artifact_cache, load_registered_model, resolve_stage
+from src.predict.compact_model import load_compact_model
+from src.monitoring.sketches import utc_dates, build_reference_sketch, rebuild_column, empty_window, update_window, window_drift, window_quality, save_arrays, load_arrays
+
 
 def get_workspace_name(env_path: str = ".env") -> str:
     """Get the name of the workspace.   
@@ -35,31 +45,103 @@ def get_workspace_name(env_path: str = ".env") -> str:
 
     return EVIDENTLY_WORKSPACE
 
-def get_reference_data(data_path: str) -> str:
+def get_monitoring_policy(env_path: str = ".env") -> dict:
+    """Get the reference window and the retention of the reports.
+
+    Parameters
+    ----------
+    env_path : str, optional
+        Path to the .env file, by default ".env"
+
+    Returns
+    -------
+    dict
+        reference_days (None keeps the first dataset as reference), reference_pin
+        ("model": one reference per full retrain, "day": one per day of data),
+        references_kept, full_days (reports kept whole) and daily_days (reports
+        kept per day, per week after).
+    """
+
+    load_dotenv(dotenv_path=env_path)
+    REFERENCE_DAYS = os.getenv("REFERENCE_DAYS")
+
+    return {
+        "reference_days": int(REFERENCE_DAYS) if REFERENCE_DAYS else None,
+        "reference_pin": os.getenv("REFERENCE_PIN", "model"),
+        "references_kept": int(os.getenv("REFERENCES_KEPT", 3)),
+        "full_days": float(os.getenv("REPORT_FULL_DAYS", 7)),
+        "daily_days": float(os.getenv("REPORT_DAILY_DAYS", 90)),
+    }
+
+def get_reference_data(data_path: str, data_name: str = None, reference_days: int = None, pin: str = None, keep: int = 3) -> str:
     """Get the reference data.
 
     Parameters
     ----------
     data_path : str
         Path to the data folder.
-    
+    data_name : str, optional
+        Path to the data file of the rolling references, by default the one of the data folder
+    reference_days : int, optional
+        Take the last reference_days days of the data as reference, by default
+        None: the first dataset ever seen is kept as reference
+    pin : str, optional
+        Version of the rolling reference, e.g. the served model version: a new
+        reference is only taken for a new pin, by default the date of the last bar
+    keep : int, optional
+        Number of rolling references kept on disk, by default 3
+
     Returns
     -------
     str
         Path to the reference dataset.
     """
 
+    if data_name is None:
+        data_name = f"{data_path}/BEL_20.parquet"
+
+    if reference_days is not None: # rolling reference, versioned by its pin
+        last_date = read_latest(data_name, columns=["ticker"]).index.max()
+        if pin is None:
+            pin = f"{last_date:%Y-%m-%d}"
+
+        reference_path = f"{data_path}/references/BEL_20_reference-{pin}.parquet"
+        if not os.path.exists(reference_path):
+            os.makedirs(f"{data_path}/references", exist_ok=True)
+            write_dataset(read_dataset(data_name, start=last_date - pd.Timedelta(days=reference_days)), reference_path)
+
+            references = sorted((entry.path for entry in os.scandir(f"{data_path}/references") if entry.name.endswith(".parquet")), key=os.path.getmtime)
+            for path in references[:-keep]: # older references than the last ones
+                os.remove(path)
+
+        return reference_path
+
     # Load reference data
-    reference_path = f"{data_path}/BEL_20_reference.pkl" # Path to the reference dataset
+    reference_path = f"{data_path}/BEL_20_reference.parquet" # Path to the reference dataset
+    legacy_reference_path = f"{data_path}/BEL_20_reference.pkl" # Reference dataset from before the switch to Parquet
 
-    if not os.path.exists(reference_path): # If the reference dataset does not exist
-        ref_data = pd.read_pickle(f"{data_path}/BEL_20.pkl") # Load data
-        ref_data.to_pickle(reference_path) # Save data as reference dataset
+    if not os.path.exists(reference_path) and os.path.exists(legacy_reference_path): # Keep the existing reference dataset
+        write_dataset(pd.read_pickle(legacy_reference_path), reference_path)
+    elif not os.path.exists(reference_path): # If the reference dataset does not exist
+        shutil.copyfile(f"{data_path}/BEL_20.parquet", reference_path) # Save data as reference dataset
     
     return reference_path
 
-def prepare_data(data_name: str, ref_data_name: str, tracking_uri: str, experiment_name: str, model_name: str, preprocessor_name: str, stage: str = "Production") -> tuple:
-    """Prepare data for Evidently.
+def monitor_data(data_name: str, ref_data_name: str, data_path: str, tracking_uri: str, model_name: str, preprocessor_name: str, stage: str = "Production",
+                 window_dates: int = 20, n_bins: int = 20, sample_size: int = 5000, history_path: str = None, keep: int = 3) -> tuple:
+    """Prepare bounded data and drift statistics for Evidently, from the logged predictions of the new bars.
+
+    The reference is summarised once per version of its content: quantile
+    bins with their counts per feature, target and prediction, and a
+    bounded sample of its rows. Every run then only reads the rows after
+    the last monitored date, joins them with the predictions logged by
+    `make_predictions` for the same ticker and features, and adds them to
+    the statistics of the current window (its last window_dates dates).
+    The model is only loaded to build a new reference, to score rows
+    without a logged prediction (e.g. from before the log existed) and,
+    when a new version reaches the stage, to score the reference sample
+    again, whose predictions then replace the prediction bins. The
+    window of a new reference starts from the rows of the previous one.
 
     Parameters
     ----------
@@ -67,45 +149,139 @@ def prepare_data(data_name: str, ref_data_name: str, tracking_uri: str, experime
         Path to the data file.
     ref_data_name : str
         Path to the reference data file.
+    data_path : str
+        Path to the data folder, the sketches are kept in its monitoring folder.
     tracking_uri : str
         Tracking uri of MLFlow.
-    experiment_name : str
-        Name of the experiment.
     model_name : str
         Name of the model.
     preprocessor_name : str
         Name of the preprocessor.
     stage : str, optional
         Stage of the model, by default "Production"
-    
+    window_dates : int, optional
+        Number of dates in the current window, by default 20
+    n_bins : int, optional
+        Number of bins per column of the reference sketch, by default 20
+    sample_size : int, optional
+        Number of reference rows kept for the reports, by default 5000
+    history_path : str, optional
+        Path to the advice history with the logged predictions, by default the one of the data folder
+    keep : int, optional
+        Number of reference versions whose sketches and window are kept, by default 3
+
     Returns
     -------
-    tuple with the reference data and the current data
-    """    
+    tuple with the reference sample, the rows of the current window, the drift per column (psi and drifted), the quality of the window
+    (mape, rmse and n) and the version of the reference
+    """
 
-    # Load reference data
-    ref_data = pd.read_pickle(ref_data_name) 
+    if history_path is None:
+        history_path = os.path.join(data_path, HISTORY_NAME)
 
-    # Load latest model
-    mlflow.set_tracking_uri(tracking_uri)
-    mlflow.set_experiment(experiment_name)
+    # Model the predictions of the reference come from: a new version only scores the sample of the reference again
+    model_key = f"{model_name}/{resolve_stage(tracking_uri, model_name, stage).version}"
+
+    # Version of the reference: its content and the sketch settings
+    reference_version = hashlib.blake2b(f"{fingerprint(ref_data_name)}/{n_bins}/{sample_size}".encode(), digest_size=16).hexdigest()
+
+    folder = f"{data_path}/monitoring"
+    os.makedirs(folder, exist_ok=True)
+    sketch_path, sample_path = f"{folder}/reference-{reference_version}.npz", f"{folder}/reference-{reference_version}.parquet"
+    window_path, rows_path = f"{folder}/window-{reference_version}.npz", f"{folder}/window-{reference_version}.parquet"
+
+    pair = []
+    def score(data: pd.DataFrame) -> np.ndarray:
+        """Predict the rows with the model of the stage, loading it on first use, compact if it can."""
 
-    preprocessor = mlflow.sklearn.load_model(model_uri=f"models:/{preprocessor_name}/{stage}")
-    model = mlflow.pyfunc.load_model(model_uri=f"models:/{model_name}/{stage}")
+        if data.empty:
+            return np.zeros(0)
 
-    # Load latest data
-    data = pd.read_pickle(data_name)
+        if not pair:
+            cache = artifact_cache(os.path.join(data_path, ARTIFACT_CACHE_NAME)) # shared with the predictions
+            compact, _ = load_compact_model(tracking_uri=tracking_uri, model_name=model_name, stage=stage, cache=cache)
+            if compact is not None:
+                pair.append(compact)
+            else: # registered before compact models were logged
+                pair.append(load_registered_model(tracking_uri, preprocessor_name, stage=stage, cache=cache))
+                pair.append(load_registered_model(tracking_uri, model_name, stage=stage, cache=cache, loader=mlflow.pyfunc.load_model))
 
-    # Make target and prediction column for Evidently to work
-    ref_data["target"] = ref_data["close_growth"]
-    ref_data.dropna(inplace=True) # Drop rows with missing values
-    ref_data["prediction"] = model.predict(preprocessor.transform(ref_data)) # Apply both model and preprocessor to reference data
+        if len(pair) == 1:
+            return pair[0].predict(data)
 
-    data["target"] = data["close_growth"]
-    data.dropna(inplace=True) # Drop rows with missing values
-    data["prediction"] = model.predict(preprocessor.transform(data)) # Apply both model and preprocessor to reference data
+        return np.asarray(pair[1].predict(pair[0].transform(data)), dtype=np.float64).reshape(len(data), -1)[:, 0]
 
-    return ref_data, data
+    mlflow.set_tracking_uri(tracking_uri)
+
+    # Reference: features, target and prediction summarised once per version
+    sketch = load_arrays(sketch_path)
+    if sketch is None:
+        ref_data = read_dataset(ref_data_name).assign(target=lambda frame: frame["close_growth"]).dropna() # Drop rows with missing values
+        ref_data["prediction"] = score(ref_data)
+        columns = ref_data.filter(like="close_growth_lag").columns.tolist() + ["target", "prediction"]
+        sketch, sample = build_reference_sketch(ref_data, columns, n_bins=n_bins, sample_size=sample_size)
+        sketch["model"] = np.array([model_key])
+        sample.to_parquet(sample_path)
+        save_arrays(sketch, sketch_path) # written last: marks the sketch as complete
+
+    sample = pd.read_parquet(sample_path)
+
+    rescored = str(sketch.get("model", [""])[0]) != model_key
+    if rescored: # new model in the stage: its predictions on the bounded sample replace the prediction bins
+        sample["prediction"] = score(sample)
+        sketch = dict(rebuild_column(sketch, sample, "prediction"), model=np.array([model_key]))
+        sample.to_parquet(f"{sample_path}.tmp")
+        os.replace(f"{sample_path}.tmp", sample_path)
+        save_arrays(sketch, sketch_path)
+
+    # Current window: only the dates after the last monitored one are read
+    window = load_arrays(window_path)
+    if window is not None:
+        rows = pd.read_parquet(rows_path)
+        if rescored: # binned again on the new prediction bins
+            window = update_window(empty_window(sketch), sketch, rows, window_dates=window_dates)
+    else: # new reference: the rows of the previous window are binned again
+        previous = sorted((entry.path for entry in os.scandir(folder) if entry.name.startswith("window-") and entry.name.endswith(".parquet")), key=os.path.getmtime)
+        rows = pd.read_parquet(previous[-1]) if previous else None
+        window = update_window(empty_window(sketch), sketch, rows if rows is not None else pd.DataFrame(), window_dates=window_dates)
+
+    last_date = window["dates"][-1] if len(window["dates"]) else None
+    data = read_dataset(data_name, start=pd.Timestamp(last_date, tz="UTC") if last_date is not None else None)
+    if last_date is not None:
+        data = data[utc_dates(data.index) > last_date]
+    new_rows = data.assign(target=data["close_growth"]).dropna()
+
+    # The features of a bar are the ones the previous bar was predicted from: join on their hash
+    logged = read_predictions(history_path, start=pd.Timestamp(last_date, tz="UTC") if last_date is not None else None)
+    positions = pd.Index(logged["ticker"] + "/" + logged["features_hash"]).get_indexer(new_rows["ticker"].astype(str) + "/" + features_hash(new_rows))
+    prediction = np.r_[logged["prediction"].to_numpy(dtype=np.float64), np.nan][positions] # -1 when not logged
+
+    missing = positions < 0
+    prediction[missing] = score(new_rows[missing])
+    new_rows = new_rows.assign(prediction=prediction)
+
+    window = update_window(window, sketch, new_rows, window_dates=window_dates)
+
+    rows = new_rows if rows is None else pd.concat([rows, new_rows])
+    if len(window["dates"]):
+        rows = rows[utc_dates(rows.index) >= window["dates"][0]]
+
+    rows.to_parquet(f"{rows_path}.tmp")
+    os.replace(f"{rows_path}.tmp", rows_path)
+    save_arrays(window, window_path)
+
+    # Files of the references that are not the last ones used
+    last_used = {}
+    for entry in os.scandir(folder):
+        if entry.name.startswith(("reference-", "window-")) and not entry.name.endswith(".tmp"):
+            version = entry.name.split("-", 1)[1].split(".")[0]
+            last_used[version] = max(last_used.get(version, 0), entry.stat().st_mtime)
+    for version in sorted(last_used, key=last_used.get)[:-keep]:
+        for name in (f"reference-{version}.npz", f"reference-{version}.parquet", f"window-{version}.npz", f"window-{version}.parquet"):
+            if os.path.exists(f"{folder}/{name}"):
+                os.remove(f"{folder}/{name}")
+
+    return sample, rows, window_drift(sketch, window), window_quality(window), reference_version
 
 def open_workspace_project(workspace_name: str, project_name: str = "Algorhythmic Trading") -> tuple:
     """Open the workspace and project in Evidently.
@@ -181,7 +357,7 @@ def open_workspace_project(workspace_name: str, project_name: str = "Algorhythmi
 
     return project.id, ws 
 
-def add_report(workspace: WorkspaceBase, project_id: uuid.UUID, ref_data: pd.DataFrame, data: pd.DataFrame) -> None: 
+def add_report(workspace: WorkspaceBase, project_id: uuid.UUID, ref_data: pd.DataFrame, data: pd.DataFrame, metadata: dict = None) -> None: 
     """Add report to project.
 
     Parameters
@@ -194,6 +370,8 @@ def add_report(workspace: WorkspaceBase, project_id: uuid.UUID, ref_data: pd.Dat
         Reference data.
     data : pd.DataFrame
         Current data.
+    metadata : dict, optional
+        Metadata of the report, e.g. the drift statistics of `monitor_data`, by default None
     
     Returns
     -------
@@ -207,11 +385,142 @@ def add_report(workspace: WorkspaceBase, project_id: uuid.UUID, ref_data: pd.Dat
                 DataQualityPreset(),
                 TargetDriftPreset(),
                 RegressionPreset()
-            ]
+            ],
+            metadata=metadata
         )
 
     report.run(reference_data=ref_data.reset_index(drop=True), current_data=data.reset_index(drop=True))
 
     workspace.add_report(project_id, report)
 
-    return None
\ No newline at end of file
+    return None
+
+def list_reports(project) -> list:
+    """Reports of a project, with their id, timestamp and metadata.
+
+    The locked evidently 0.4.1 gives them through `Project.reports`; the
+    later 0.4 releases allowed by the Pipfile list the snapshots instead.
+    """
+
+    if hasattr(project, "list_snapshots"):
+        return project.list_snapshots(include_test_suites=False)
+
+    return list(project.reports.values())
+
+def load_report_snapshot(project, snapshot_id: uuid.UUID) -> Snapshot:
+    """Snapshot of a report of a project, as listed by `list_reports`."""
+
+    if hasattr(project, "load_snapshot"):
+        return project.load_snapshot(snapshot_id)
+
+    return project.get_snapshot(snapshot_id).value
+
+def compact_snapshot(snapshot: Snapshot, metric_ids: set, metadata: dict = None) -> Snapshot:
+    """Keep only the given metrics of a report snapshot, e.g. the ones plotted on the dashboard.
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        Snapshot of a report.
+    metric_ids : set
+        Ids of the metrics to keep, such as "DatasetDriftMetric".
+    metadata : dict, optional
+        Metadata added to the one of the snapshot, by default None
+
+    Returns
+    -------
+    Snapshot
+        Snapshot with the same id and timestamp, a fraction of the size.
+    """
+
+    kept = [i for i, metric in enumerate(snapshot.suite.metrics) if metric.get_id() in metric_ids]
+    suite = snapshot.suite.copy(update={"metrics": [snapshot.suite.metrics[i] for i in kept], "metric_results": [snapshot.suite.metric_results[i] for i in kept]})
+
+    return snapshot.copy(update={"suite": suite, "metrics_ids": [kept.index(i) for i in snapshot.metrics_ids if i in kept],
+                                 "metadata": dict(snapshot.metadata, **(metadata or {}))})
+
+def _summary(snapshot: Snapshot, values: list) -> tuple:
+    """Number of reports summarised by a snapshot, and mean, minimum and maximum of every plotted value over them."""
+
+    if "compacted" in snapshot.metadata: # already a summary
+        return int(snapshot.metadata["snapshots"]), {name: {legend: float(value) for legend, value in snapshot.metadata[name].items()} for name in ("mean", "min", "max")}
+
+    report = snapshot.as_report()
+    summary = {"mean": {}, "min": {}, "max": {}}
+    for value in values:
+        points = [float(point) for point in value.get(report).values()]
+        if points:
+            legend = value.legend or value.metric_id
+            summary["mean"][legend], summary["min"][legend], summary["max"][legend] = np.mean(points), min(points), max(points)
+
+    return 1, summary
+
+def compact_workspace(workspace: WorkspaceBase, project_id: uuid.UUID, full_days: float = 7, daily_days: float = 90, now=None) -> int:
+    """Downsample the old reports of a project, so the workspace and the dashboard stay small.
+
+    Reports of the last full_days days are kept whole. Older ones are
+    merged per day, and per week after daily_days days: the last report of
+    the period is kept with only the metrics of the dashboard panels, and
+    the mean, minimum and maximum of the plotted values over the period in
+    its metadata.
+
+    Parameters
+    ----------
+    workspace : WorkspaceBase
+        Workspace.
+    project_id : uuid.UUID
+        Project id.
+    full_days : float, optional
+        Age in days under which reports are kept whole, by default 7
+    daily_days : float, optional
+        Age in days under which reports are merged per day, per week above, by default 90
+    now : str, date or pd.Timestamp, optional
+        Current time, in the local time of the report timestamps, by default now
+
+    Returns
+    -------
+    int
+        Number of reports removed.
+    """
+
+    project = workspace.get_project(project_id)
+    values = [value for panel in project.dashboard.panels for value in getattr(panel, "values", [])]
+    metric_ids = {value.metric_id for value in values}
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+
+    # Periods of the old reports
+    periods = {}
+    for snapshot in list_reports(project):
+        timestamp = pd.Timestamp(snapshot.timestamp)
+        if now - timestamp < pd.Timedelta(days=full_days):
+            continue
+        day = timestamp.floor("D")
+        period = ("day", day) if now - timestamp < pd.Timedelta(days=daily_days) else ("week", day - pd.Timedelta(days=day.dayofweek))
+        periods.setdefault(period, []).append(snapshot)
+
+    removed = 0
+    for (level, _), snapshots in periods.items():
+        if len(snapshots) == 1 and snapshots[0].metadata.get("compacted") == level: # already merged
+            continue
+
+        snapshots = [load_report_snapshot(project, snapshot.id) for snapshot in sorted(snapshots, key=lambda snapshot: snapshot.timestamp)]
+        counts, summaries = zip(*(_summary(snapshot, values) for snapshot in snapshots))
+
+        metadata = {"compacted": level, "snapshots": str(sum(counts))}
+        for name, merge in (("mean", None), ("min", min), ("max", max)):
+            legends = {legend for summary in summaries for legend in summary[name]}
+            if merge is None: # weighted by the number of reports summarised
+                merged = {legend: sum(count * summary[name][legend] for count, summary in zip(counts, summaries) if legend in summary[name])
+                          / sum(count for count, summary in zip(counts, summaries) if legend in summary[name]) for legend in legends}
+            else:
+                merged = {legend: merge(summary[name][legend] for summary in summaries if legend in summary[name]) for legend in legends}
+            metadata[name] = {legend: repr(float(value)) for legend, value in merged.items()}
+
+        compact = compact_snapshot(snapshots[-1], metric_ids, metadata=metadata)
+        for snapshot in snapshots:
+            workspace.delete_snapshot(project_id, snapshot.id)
+        workspace.add_snapshot(project_id, compact) # same id and timestamp as the last report of the period
+
+        removed += len(snapshots) - 1
+
+    return removed
@@ -0,0 +1,256 @@
+import os
+
+import pandas as pd
+import numpy as np
+
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+DRIFT_PSI = 0.2 # population stability index above which a column has drifted
+
+
+def bin_indices(edges: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Bin of every value of every column, with one binary search per column over all rows."""
+
+    return np.stack([np.searchsorted(edges[column, 1:-1], values[:, column], side="right") for column in range(edges.shape[0])], axis=1)
+
+
+def bin_counts(edges: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Count the values of every column in the bins of its edges, in one pass.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        Bin edges of every column, shape (n_columns, n_bins + 1), the outer ones infinite.
+    values : np.ndarray
+        Values, shape (n_rows, n_columns), NaNs are not counted.
+
+    Returns
+    -------
+    np.ndarray
+        Counts, shape (n_columns, n_bins).
+    """
+
+    n_columns, n_bins = edges.shape[0], edges.shape[1] - 1
+    cells = (bin_indices(edges, values) + np.arange(n_columns) * n_bins)[~np.isnan(values)]
+
+    return np.bincount(cells, minlength=n_columns * n_bins).reshape(n_columns, n_bins).astype(np.float64)
+
+
+def utc_dates(index: pd.Index) -> np.ndarray:
+    """Dates of an index as UTC nanoseconds, naive dates taken as UTC."""
+
+    dates = pd.DatetimeIndex(index)
+    if dates.tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+
+    return dates.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def build_reference_sketch(reference: pd.DataFrame, columns: list, n_bins: int = 20, sample_size: int = 5000, seed: int = 0) -> tuple:
+    """Summarise the reference data once: quantile bins with their counts, quantiles and moments per column, and a bounded sample.
+
+    Parameters
+    ----------
+    reference : pd.DataFrame
+        Reference data, with the monitored columns.
+    columns : list
+        Monitored columns, e.g. the features, target and prediction.
+    n_bins : int, optional
+        Number of bins per column, equally filled on the reference, by default 20
+    sample_size : int, optional
+        Maximum number of reference rows kept for the reports, by default 5000
+    seed : int, optional
+        Seed of the sample, by default 0
+
+    Returns
+    -------
+    tuple
+        Sketch (dict of arrays: columns, edges, counts, quantiles, mean, std
+        and n) and sample of the reference rows (DataFrame).
+    """
+
+    values = reference[columns].to_numpy(dtype=np.float64)
+
+    edges = np.nanquantile(values, np.linspace(0, 1, n_bins + 1), axis=0).T
+    edges[:, 0], edges[:, -1] = -np.inf, np.inf # current values outside of the reference range fall in the outer bins
+
+    sketch = {
+        "columns": np.array(columns, dtype=str),
+        "edges": edges,
+        "counts": bin_counts(edges, values),
+        "quantiles": np.nanquantile(values, QUANTILES, axis=0).T,
+        "mean": np.nanmean(values, axis=0),
+        "std": np.nanstd(values, axis=0),
+        "n": np.sum(~np.isnan(values), axis=0),
+    }
+
+    rows = np.sort(np.random.default_rng(seed).choice(len(reference), size=min(sample_size, len(reference)), replace=False))
+
+    return sketch, reference.iloc[rows]
+
+
+def rebuild_column(sketch: dict, rows: pd.DataFrame, column: str) -> dict:
+    """Summarise one column of the sketch again from other rows, e.g. the predictions of a new model on the reference sample.
+
+    Parameters
+    ----------
+    sketch : dict
+        Sketch of the reference.
+    rows : pd.DataFrame
+        Rows with the column, e.g. the sample of the reference.
+    column : str
+        Monitored column to summarise again.
+
+    Returns
+    -------
+    dict
+        New sketch with the same bins per column, the sketch given is not modified.
+    """
+
+    column_sketch, _ = build_reference_sketch(rows, [column], n_bins=sketch["edges"].shape[1] - 1, sample_size=0)
+    position = sketch["columns"].tolist().index(column)
+
+    rebuilt = dict(sketch)
+    for name in ("edges", "counts", "quantiles", "mean", "std", "n"):
+        rebuilt[name] = sketch[name].copy()
+        rebuilt[name][position] = column_sketch[name][0]
+
+    return rebuilt
+
+
+def population_stability_index(reference_counts: np.ndarray, current_counts: np.ndarray, epsilon: float = 1e-4) -> np.ndarray:
+    """Population stability index of every column between two sets of bin counts.
+
+    Parameters
+    ----------
+    reference_counts : np.ndarray
+        Reference counts, shape (n_columns, n_bins).
+    current_counts : np.ndarray
+        Current counts in the same bins.
+    epsilon : float, optional
+        Smallest share of a bin, so empty bins do not give infinite values, by default 1e-4
+
+    Returns
+    -------
+    np.ndarray
+        Index per column, NaN for columns without current values.
+    """
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected = np.clip(reference_counts / reference_counts.sum(axis=1, keepdims=True), epsilon, None)
+        actual = np.clip(current_counts / current_counts.sum(axis=1, keepdims=True), epsilon, None)
+
+    return np.sum((actual - expected) * np.log(actual / expected), axis=1)
+
+
+def empty_window(sketch: dict) -> dict:
+    """Statistics of a current window without any date yet."""
+
+    n_columns, n_bins = sketch["counts"].shape
+
+    return {"dates": np.zeros(0, dtype=np.int64), "counts": np.zeros((0, n_columns, n_bins)),
+            "n": np.zeros(0), "abs_perc_error": np.zeros(0), "squared_error": np.zeros(0)}
+
+
+def update_window(window: dict, sketch: dict, rows: pd.DataFrame, window_dates: int = 20) -> dict:
+    """Add the statistics of new rows to the current window, per date, and keep only its last dates.
+
+    Only the new rows are binned, so the cost depends on the new bars and
+    not on the size of the reference or of the window.
+
+    Parameters
+    ----------
+    window : dict
+        Statistics of the current window, from `empty_window` or a previous update.
+    sketch : dict
+        Sketch of the reference.
+    rows : pd.DataFrame
+        New rows indexed by date, with the monitored columns (target and prediction included).
+    window_dates : int, optional
+        Number of dates in the window, by default 20
+
+    Returns
+    -------
+    dict
+        Statistics of the window: dates (UTC ns), bin counts, number of rows,
+        sum of absolute percentage errors and of squared errors per date.
+    """
+
+    if rows.empty:
+        return window
+
+    date_codes, new_dates = pd.factorize(utc_dates(rows.index), sort=True)
+
+    values = rows[sketch["columns"].tolist()].to_numpy(dtype=np.float64)
+    bins = bin_indices(sketch["edges"], values)
+    n_columns, n_bins = sketch["counts"].shape
+
+    # One bincount over (date, column, bin) for all new rows
+    cells = (date_codes[:, None] * n_columns + np.arange(n_columns)) * n_bins + bins
+    counts = np.bincount(cells[~np.isnan(values)], minlength=len(new_dates) * n_columns * n_bins).reshape(len(new_dates), n_columns, n_bins).astype(np.float64)
+
+    target, prediction = rows["target"].to_numpy(dtype=np.float64), rows["prediction"].to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        abs_perc_error = np.abs(target - prediction) / np.maximum(np.abs(target), np.finfo(np.float64).eps) # as sklearn's MAPE
+
+    updated = {
+        "dates": np.r_[window["dates"], new_dates],
+        "counts": np.concatenate([window["counts"], counts]),
+        "n": np.r_[window["n"], np.bincount(date_codes, minlength=len(new_dates))],
+        "abs_perc_error": np.r_[window["abs_perc_error"], np.bincount(date_codes, weights=abs_perc_error, minlength=len(new_dates))],
+        "squared_error": np.r_[window["squared_error"], np.bincount(date_codes, weights=(target - prediction) ** 2, minlength=len(new_dates))],
+    }
+
+    return {name: values[-window_dates:] for name, values in updated.items()}
+
+
+def window_drift(sketch: dict, window: dict) -> pd.DataFrame:
+    """Drift of every monitored column of the current window from the reference.
+
+    Parameters
+    ----------
+    sketch : dict
+        Sketch of the reference.
+    window : dict
+        Statistics of the current window.
+
+    Returns
+    -------
+    pd.DataFrame
+        Population stability index and drift flag per column.
+    """
+
+    psi = population_stability_index(sketch["counts"], window["counts"].sum(axis=0))
+
+    return pd.DataFrame({"psi": psi, "drifted": psi > DRIFT_PSI}, index=pd.Index(sketch["columns"], name="column"))
+
+
+def window_quality(window: dict) -> dict:
+    """Regression quality over the current window: MAPE, RMSE and number of rows, NaN without rows."""
+
+    n = window["n"].sum()
+    if n == 0:
+        return {"mape": np.nan, "rmse": np.nan, "n": 0}
+
+    return {"mape": float(window["abs_perc_error"].sum() / n), "rmse": float(np.sqrt(window["squared_error"].sum() / n)), "n": int(n)}
+
+
+def save_arrays(arrays: dict, path: str) -> str:
+    """Write arrays next to their destination and move them in place."""
+
+    with open(f"{path}.tmp", "wb") as arrays_file:
+        np.savez(arrays_file, **arrays)
+
+    os.replace(f"{path}.tmp", path)
+
+    return path
+
+
+def load_arrays(path: str) -> dict:
+    """Read arrays written by `save_arrays`, None if there are none."""
+
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path, allow_pickle=False) as arrays_file:
+        return {name: arrays_file[name] for name in arrays_file.files}
@@ -6,6 +6,12 @@ import numpy as np
 import mlflow
 from datetime import date
 
+from src.data.storage import read_latest
+from src.predict.advice_cache import SIGNALS
+from src.predict.artifact_cache import ARTIFACT_CACHE_NAME, artifact_cache, load_registered_model
+from src.predict.compact_model import load_compact_model
+from src.predict.history import HISTORY_NAME, append_advice, features_hash
+
 def modify_data(data_name: str) -> pd.DataFrame:
     """ Modify data to be used for training.
 
@@ -20,13 +26,7 @@ def modify_data(data_name: str) -> pd.DataFrame:
         Modified data.
     """
 
-    data = pd.read_pickle(data_name).sort_values("Date") # Load data
-
-    # Find the maximum date in the DataFrame
-    max_date = data.index.max()
-
-    # Filter the DataFrame to get only the rows with the maximum date
-    data = data[data.index == max_date]
+    data = read_latest(data_name, regex="ticker|close_growth") # Load only the rows with the maximum date
 
     # Rename columns by shifting names one place to the left
     old_col_names = data.filter(like="close_growth").columns.tolist()
@@ -45,7 +45,90 @@ def modify_data(data_name: str) -> pd.DataFrame:
 
     return data
 
-def make_predictions(data: pd.DataFrame, preprocessor_name: str, model_name: str, data_path: str, tracking_uri: str, experiment_name: str, stage: str = "Production") -> None:
+def get_advice_thresholds(env_path: str = ".env") -> dict:
+    """Get the thresholds of the advice, the same for the advice file, the history and the API.
+
+    Parameters
+    ----------
+    env_path : str, optional
+        Path to the .env file, by default ".env"
+
+    Returns
+    -------
+    dict
+        buy_threshold (BUY above it, 0.0 if not set) and sell_threshold (SELL
+        at or below it, None if not set: no hold band), the arguments of `label_advice`.
+    """
+
+    load_dotenv(dotenv_path=env_path)
+    SELL_THRESHOLD = os.getenv("SELL_THRESHOLD")
+
+    return {
+        "buy_threshold": float(os.getenv("BUY_THRESHOLD", 0.0)),
+        "sell_threshold": float(SELL_THRESHOLD) if SELL_THRESHOLD else None,
+    }
+
+def label_advice(predictions: np.ndarray, buy_threshold: float = 0.0, sell_threshold: float = None) -> pd.Categorical:
+    """Label predictions as BUY, HOLD or SELL in one vectorised pass.
+
+    Parameters
+    ----------
+    predictions : np.ndarray
+        Predicted close growth, one per ticker.
+    buy_threshold : float, optional
+        BUY above this prediction, by default 0.0
+    sell_threshold : float, optional
+        SELL at or below this prediction, by default buy_threshold, i.e. no
+        hold band; predictions in between are HOLD.
+
+    Returns
+    -------
+    pd.Categorical
+        Advice with the categories SIGNALS.
+    """
+
+    if sell_threshold is None:
+        sell_threshold = buy_threshold
+    if sell_threshold > buy_threshold:
+        raise ValueError("sell_threshold must not be above buy_threshold")
+
+    predictions = np.asarray(predictions, dtype=np.float64)
+    codes = np.select([predictions > buy_threshold, predictions <= sell_threshold], [SIGNALS.index("BUY"), SIGNALS.index("SELL")], SIGNALS.index("HOLD"))
+
+    return pd.Categorical.from_codes(codes, categories=list(SIGNALS))
+
+def write_advice(tickers: np.ndarray, predictions: np.ndarray, advice: pd.Categorical, path: str) -> str:
+    """Write the advice file served by the API, atomically.
+
+    The JSON is encoded in one call of the C writer of pandas, straight from
+    the arrays, with flat predictions: {"prediction": {ticker: value}, "advice": {ticker: signal}}.
+
+    Parameters
+    ----------
+    tickers : np.ndarray
+        Ticker of every prediction.
+    predictions : np.ndarray
+        Predicted close growth.
+    advice : pd.Categorical
+        Advice of every prediction.
+    path : str
+        Path to the advice file.
+
+    Returns
+    -------
+    str
+        Path to the advice file.
+    """
+
+    content = pd.DataFrame({"prediction": np.asarray(predictions, dtype=np.float64), "advice": advice}, index=tickers)
+    content.to_json(f"{path}.tmp", double_precision=15)
+
+    os.replace(f"{path}.tmp", path) # the API never reads a half written file
+
+    return path
+
+def make_predictions(data: pd.DataFrame, preprocessor_name: str, model_name: str, data_path: str, tracking_uri: str, experiment_name: str, stage: str = "Production",
+                     buy_threshold: float = 0.0, sell_threshold: float = None) -> None:
     """ Make predictions with the best model for the next day.
 
     Parameters
@@ -64,30 +147,40 @@ def make_predictions(data: pd.DataFrame, preprocessor_name: str, model_name: str
         Name of the experiment.
     stage : str, optional
         Stage of the model, by default "Production"
+    buy_threshold : float, optional
+        BUY above this prediction, by default 0.0
+    sell_threshold : float, optional
+        SELL at or below this prediction, by default buy_threshold (no HOLD)
     
     Returns
     -------
-    None, but puts .json file in data folder with advice.
+    None, but puts .json file in data folder with advice and appends it, with the bar and features predicted from, to the advice history.
     """
 
     mlflow.set_tracking_uri(tracking_uri)
     mlflow.set_experiment(experiment_name)
 
-    # Load model
-    preprocessor = mlflow.sklearn.load_model(model_uri=f"models:/{preprocessor_name}/{stage}")
-    model = mlflow.pyfunc.load_model(model_uri=f"models:/{model_name}/{stage}")
+    # Load the compact model of the stage, with its version to record it with the advice; versions already used are read from the artifact cache
+    cache = artifact_cache(os.path.join(data_path, ARTIFACT_CACHE_NAME))
+    compact, model_version = load_compact_model(tracking_uri=tracking_uri, model_name=model_name, stage=stage, cache=cache)
 
-    # Make predictions
-    data_reduced = preprocessor.transform(data)
-    predictions = model.predict(data_reduced).tolist()
+    # Make predictions, one per ticker (first column if the model has several outputs)
+    if compact is not None:
+        predictions = compact.predict(data)
+    else: # registered before compact models were logged
+        preprocessor = load_registered_model(tracking_uri, preprocessor_name, stage=stage, cache=cache)
+        model = load_registered_model(tracking_uri, model_name, stage=stage, cache=cache, loader=mlflow.pyfunc.load_model)
+        predictions = np.asarray(model.predict(preprocessor.transform(data)), dtype=np.float64).reshape(len(data), -1)[:, 0]
 
     # Give advice based on predictions
-    advice = pd.DataFrame({"ticker": data["ticker"], "prediction": predictions})
-    advice["advice"] = advice["prediction"].apply(lambda x: "BUY" if x[0] > 0 else "SELL")
-    advice.reset_index(drop=True, inplace=True)
+    advice = pd.DataFrame({"ticker": data["ticker"].to_numpy(), "prediction": predictions, "advice": label_advice(predictions, buy_threshold, sell_threshold)})
+    advice["date"], advice["features_hash"] = data.index, features_hash(data) # log of the predictions, joined with the realised growth by the monitoring
 
     # Write predictions to json file
-    advice.set_index("ticker", inplace=False).to_json(f'{data_path}/advice.json')
+    write_advice(advice["ticker"].to_numpy(), predictions, advice["advice"].array, f'{data_path}/advice.json')
+
+    # Keep the advice of every run, with the version of the model that gave it
+    append_advice(os.path.join(data_path, HISTORY_NAME), advice, model_name=model_name, model_version=model_version)
 
     return None
 
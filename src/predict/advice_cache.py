@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+SIGNALS = ("BUY", "HOLD", "SELL") # categories of the advice, HOLD only with a hold band
+
+
+class AdviceIndex:
+    """In-memory index of the advice for lookups by ticker and range queries on the prediction.
+
+    Built once per advice file: per-ticker records are serialized up front
+    and the rows of every signal are sorted by prediction, so a query costs
+    a dictionary lookup or a binary search instead of a scan of the file.
+
+    Parameters
+    ----------
+    advice : dict
+        Advice as written by `make_predictions`: {"prediction": {ticker: value}, "advice": {ticker: signal}},
+        where a value may also be a list holding the prediction.
+    """
+
+    def __init__(self, advice: dict):
+        predictions = advice.get("prediction", {})
+        signals = advice.get("advice", {})
+
+        self.tickers = np.array(sorted(predictions), dtype=object)
+        self.predictions = np.array([_flat(predictions[ticker]) for ticker in self.tickers], dtype=np.float64)
+        self.signals = np.array([signals.get(ticker) for ticker in self.tickers], dtype=object)
+
+        self.records = [{"ticker": ticker, "prediction": float(prediction), "advice": signal}
+                        for ticker, prediction, signal in zip(self.tickers, self.predictions, self.signals)]
+        self.positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.serialized = {record["ticker"]: json.dumps(record).encode() for record in self.records}
+
+        # Rows of all tickers and of every signal, sorted by prediction
+        order = np.argsort(self.predictions, kind="stable")
+        self._sorted = {None: order}
+        for signal in SIGNALS:
+            self._sorted[signal] = order[self.signals[order] == signal]
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    def query(self, tickers: list = None, signal: str = None, min_prediction: float = None, max_prediction: float = None) -> list:
+        """Get the advice records matching all the given conditions.
+
+        Parameters
+        ----------
+        tickers : list, optional
+            Only these tickers (unknown ones are skipped), by default all
+        signal : str, optional
+            Only this advice, one of SIGNALS, by default all
+        min_prediction : float, optional
+            Only predictions >= min_prediction, by default no bound
+        max_prediction : float, optional
+            Only predictions <= max_prediction, by default no bound
+
+        Returns
+        -------
+        list
+            Records with a ticker, prediction and advice; by ticker if tickers
+            are given, by increasing prediction otherwise.
+        """
+
+        if tickers is not None:
+            rows = [self.positions[ticker] for ticker in tickers if ticker in self.positions]
+            return [self.records[row] for row in rows
+                    if (signal is None or self.signals[row] == signal)
+                    and (min_prediction is None or self.predictions[row] >= min_prediction)
+                    and (max_prediction is None or self.predictions[row] <= max_prediction)]
+
+        rows = self._sorted[signal]
+        predictions = self.predictions[rows]
+        first = np.searchsorted(predictions, min_prediction, side="left") if min_prediction is not None else 0
+        last = np.searchsorted(predictions, max_prediction, side="right") if max_prediction is not None else len(rows)
+
+        return [self.records[row] for row in rows[first:last]]
+
+
+def _flat(prediction) -> float:
+    """Prediction as a float, also when stored as a one-element list."""
+
+    while isinstance(prediction, list):
+        prediction = prediction[0]
+
+    return float(prediction)
+
+
+class AdviceCache:
+    """Keep the serialized advice in memory and reload it only when the file changes.
+
+    The file is checked at most every `check_seconds`, by its modification
+    time and size. The body is served as stored, so a request costs no
+    parsing or serialization, and the ETag is derived from the content so
+    every worker gives the same one for the same advice.
+
+    Parameters
+    ----------
+    path : str
+        Path to the advice file.
+    check_seconds : float, optional
+        Minimum number of seconds between two checks of the file, by default 1.0
+    """
+
+    def __init__(self, path: str, check_seconds: float = 1.0):
+        self.path = path
+        self.check_seconds = check_seconds
+
+        self._entry = None # (version, body, etag, last_modified, index), replaced as a whole
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self) -> tuple:
+        """Get the advice, reloading it if the file changed since the last check.
+
+        Returns
+        -------
+        tuple
+            Body (bytes), ETag and last modification time (UTC), or None if
+            the file was never readable.
+        """
+
+        entry = self._current()
+
+        return entry[1:4] if entry is not None else None
+
+    def index(self) -> tuple:
+        """Get the index of the advice, rebuilt only when the file changed.
+
+        Returns
+        -------
+        tuple
+            Index (AdviceIndex), ETag and last modification time (UTC) of the
+            same version of the advice, or None if the file was never readable.
+        """
+
+        entry = self._current()
+
+        return (entry[4], entry[2], entry[3]) if entry is not None else None
+
+    def _current(self) -> tuple:
+        """Get the current entry, reloading it if the file changed since the last check."""
+
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_seconds:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.check_seconds: # another thread may have reloaded meanwhile
+                    self._reload()
+                    self._checked_at = now
+
+        return self._entry
+
+    def _reload(self) -> None:
+        """Read the file again if its modification time or size changed."""
+
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        version = (status.st_mtime_ns, status.st_size)
+        if self._entry is not None and self._entry[0] == version:
+            return
+
+        with open(self.path, "rb") as advice_file:
+            body = advice_file.read()
+
+        try:
+            index = AdviceIndex(json.loads(body))
+        except (ValueError, TypeError, IndexError): # caught while being written: keep serving the previous advice
+            return
+
+        etag = hashlib.sha1(body).hexdigest()
+        last_modified = datetime.fromtimestamp(status.st_mtime, tz=timezone.utc)
+
+        self._entry = (version, body, etag, last_modified, index)
@@ -1,22 +1,101 @@
-from flask import Flask, jsonify, Response 
-from dotenv import load_dotenv
-import json
-import os
+from flask import Flask, jsonify, Response, request, abort
+
+import pandas as pd
+
+from src.predict import serving
+from src.predict.advice import label_advice
 
 # Create app
-app = Flask('Trading_Advisor') 
+app = Flask('Trading_Advisor')
+
+def _served_model():
+    """Get the pair to answer the request with, or abort if no model is loaded yet."""
+
+    served = serving.served_model()
+    if served is None:
+        abort(503, description="No model is loaded yet")
+
+    return served
+
+def _conditional(advice: tuple) -> Response:
+    """Response with the serialized advice, or 304 if the client already has this version."""
+
+    body, etag, last_modified = advice
+
+    response = Response(body, mimetype="application/json") # Flask route should always return a Flask repsonse object
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True # clients may keep it, but revalidate: unchanged advice costs a 304 without body
+
+    return response.make_conditional(request)
 
 # Specify result of GET request
-@app.route('/advice', methods=['GET'])  
+@app.route('/advice', methods=['GET'])
 def give_advice() -> Response:
-    
-    load_dotenv(dotenv_path="../../.env")
-    DATAPATH = os.getenv("DATAPATH")
+    """All advice, or the advice matching the filters: tickers=A,B, signal=BUY|HOLD|SELL, min_prediction, max_prediction."""
+
+    try:
+        query = serving.parse_advice_query(request.args)
+    except ValueError as error:
+        abort(400, description=f"Invalid query: {error}")
+
+    advice = serving.advice_cache.get() if query is None else serving.query_advice(query) # in memory, only read again when the file changed
+    if advice is None:
+        abort(503, description="No advice available yet")
+
+    return _conditional(advice)
+
+@app.route('/advice/history', methods=['GET'])
+def give_advice_history() -> Response:
+    """Advice of past runs: ticker, from and to (dates or timestamps, UTC if naive), limit."""
+
+    try:
+        body = serving.advice_history(request.args)
+    except ValueError as error:
+        abort(400, description=f"Invalid query: {error}")
+
+    return Response(body, mimetype="application/json")
+
+@app.route('/advice/<ticker>', methods=['GET'])
+def give_ticker_advice(ticker: str) -> Response:
+    """Advice of one ticker."""
+
+    advice = serving.ticker_advice(ticker)
+    if advice is None:
+        abort(503, description="No advice available yet")
+    if not advice[0]:
+        abort(404, description=f"No advice for ticker {ticker}")
+
+    return _conditional(advice)
+
+@app.route('/predict', methods=['GET'])
+def predict_ticker() -> Response:
+    """Prediction of one ticker for the next day, precomputed when the model or the data changed."""
+
+    served = _served_model() # read once: a swap during the request does not mix two models
+    ticker = request.args.get("ticker")
+
+    if ticker not in served.predictions:
+        abort(404, description=f"No prediction for ticker {ticker}")
+
+    prediction = served.predictions[ticker]
+
+    return jsonify({"ticker": ticker, "prediction": prediction, "advice": label_advice([prediction], **serving.advice_thresholds)[0], "model": served.key[0], "version": served.key[1]})
+
+@app.route('/predict', methods=['POST'])
+def predict_features() -> Response:
+    """Predictions for posted features: one record or a list of records with a ticker and the close growth lags."""
+
+    served = _served_model()
+    records = request.get_json(force=True)
+    features = pd.DataFrame([records] if isinstance(records, dict) else records)
 
-    with open(f"{DATAPATH}/advice.json", 'r') as json_file:
-        data = json.load(json_file)
+    try:
+        predictions = served.predict(features).tolist()
+    except (KeyError, ValueError) as error:
+        abort(400, description=f"Invalid features: {error}")
 
-    return jsonify(data) # Flask route should always return a Flask repsonse object
+    return jsonify({"predictions": predictions, "model": served.key[0], "version": served.key[1]})
 
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    app.run()
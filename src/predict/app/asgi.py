@@ -0,0 +1,123 @@
+from contextlib import asynccontextmanager
+from email.utils import format_datetime, parsedate_to_datetime
+
+import pandas as pd
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from src.predict import serving
+from src.predict.advice import label_advice
+
+# ASGI variant of the Flask app (app.py), with the same routes and the same per-process caches.
+# One event loop per process serves many connections, so fewer processes are needed than with gthread workers.
+
+def _error(status_code: int, detail: str) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code)
+
+def _not_modified(request: Request, etag: str, last_modified) -> bool:
+    """Check the conditional headers of a request, If-None-Match taking precedence like in Flask."""
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return any(tag.strip() in ("*", f'"{etag}"', f'W/"{etag}"') for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= last_modified.replace(microsecond=0)
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+def _conditional(request: Request, advice: tuple) -> Response:
+    """Response with the serialized advice, or 304 if the client already has this version."""
+
+    body, etag, last_modified = advice
+    headers = {"ETag": f'"{etag}"', "Last-Modified": format_datetime(last_modified, usegmt=True), "Cache-Control": "no-cache"}
+
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers) # pre-serialized bytes with a Content-Length, sent as is
+
+async def give_advice(request: Request) -> Response:
+
+    try:
+        query = serving.parse_advice_query(request.query_params)
+    except ValueError as error:
+        return _error(400, f"Invalid query: {error}")
+
+    advice = serving.advice_cache.get() if query is None else serving.query_advice(query) # in memory; the file is only read, briefly, when it changed
+    if advice is None:
+        return _error(503, "No advice available yet")
+
+    return _conditional(request, advice)
+
+async def give_advice_history(request: Request) -> Response:
+
+    try:
+        body = await run_in_threadpool(serving.advice_history, request.query_params) # blocking SQLite read off the event loop
+    except ValueError as error:
+        return _error(400, f"Invalid query: {error}")
+
+    return Response(body, media_type="application/json")
+
+async def give_ticker_advice(request: Request) -> Response:
+
+    ticker = request.path_params["ticker"]
+    advice = serving.ticker_advice(ticker)
+    if advice is None:
+        return _error(503, "No advice available yet")
+    if not advice[0]:
+        return _error(404, f"No advice for ticker {ticker}")
+
+    return _conditional(request, advice)
+
+async def predict_ticker(request: Request) -> Response:
+
+    served = serving.served_model() # read once: a swap during the request does not mix two models
+    if served is None:
+        return _error(503, "No model is loaded yet")
+
+    ticker = request.query_params.get("ticker")
+    if ticker not in served.predictions:
+        return _error(404, f"No prediction for ticker {ticker}")
+
+    prediction = served.predictions[ticker]
+
+    return JSONResponse({"ticker": ticker, "prediction": prediction, "advice": label_advice([prediction], **serving.advice_thresholds)[0], "model": served.key[0], "version": served.key[1]})
+
+async def predict_features(request: Request) -> Response:
+
+    served = serving.served_model()
+    if served is None:
+        return _error(503, "No model is loaded yet")
+
+    try:
+        records = await request.json()
+        features = pd.DataFrame([records] if isinstance(records, dict) else records)
+        predictions = served.predict(features).tolist()
+    except (KeyError, ValueError) as error:
+        return _error(400, f"Invalid features: {error}")
+
+    return JSONResponse({"predictions": predictions, "model": served.key[0], "version": served.key[1]})
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    """Load the Production models before serving, without blocking the event loop."""
+
+    await run_in_threadpool(serving.get_model_cache)
+    yield
+
+# Create app
+app = Starlette(routes=[Route("/advice", give_advice, methods=["GET"]),
+                        Route("/advice/history", give_advice_history, methods=["GET"]), # before /advice/{ticker}, which would match it
+                        Route("/advice/{ticker}", give_ticker_advice, methods=["GET"]),
+                        Route("/predict", predict_ticker, methods=["GET"]),
+                        Route("/predict", predict_features, methods=["POST"])],
+                lifespan=lifespan)
@@ -1,7 +1,18 @@
 import multiprocessing
+import os
 
 bind = "0.0.0.0:9696"
 workers = multiprocessing.cpu_count() * 2 + 1 # Number of workers that can handle a request
 threads = multiprocessing.cpu_count() * 2    
 worker_class = "gthread"
-wsgi_app = "app:app"
\ No newline at end of file
+wsgi_app = "app:app"
+
+if os.getenv("SERVER", "wsgi") == "asgi": # ASGI variant (asgi.py): one event loop per worker handles many connections
+    workers = multiprocessing.cpu_count()
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "asgi:app"
+
+def post_worker_init(worker):
+    """Load the Production models in every worker before it accepts requests."""
+    from src.predict.serving import get_model_cache
+    get_model_cache()
@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from urllib.parse import quote
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+
+ARTIFACT_CACHE_NAME = "artifacts" # folder of the artifact cache in the data folder
+RESOLVE_TTL = 30.0 # seconds a stage keeps resolving to the same version without asking the registry
+ARTIFACT_CACHE_BYTES = 512 * 2 ** 20 # size of the artifact cache beyond which the least recently used versions are removed
+EVICTION_GRACE = 600.0 # seconds a used version is kept whatever the size, so other processes can still load the path they got
+
+_resolved = {} # (tracking uri, model name, stage): (time resolved, model version), shared by the callers of the process
+_resolved_lock = threading.Lock()
+
+
+def resolve_stage(tracking_uri: str, model_name: str, stage: str = "Production", ttl: float = RESOLVE_TTL):
+    """Get the latest version of a registered model in a stage, asking the registry at most every ttl seconds.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    model_name : str
+        Registered name of the model.
+    stage : str, optional
+        Stage, by default "Production"
+    ttl : float, optional
+        Seconds the version is reused, by default RESOLVE_TTL
+
+    Returns
+    -------
+    ModelVersion
+        Version of the model, with its run id and source.
+
+    Raises
+    ------
+    LookupError
+        If no version of the model is in the stage.
+    """
+
+    key = (tracking_uri, model_name, stage)
+    now = time.monotonic()
+
+    with _resolved_lock:
+        resolved, model_version = _resolved.get(key, (None, None))
+    if resolved is not None and now - resolved < ttl:
+        return model_version
+
+    versions = MlflowClient(tracking_uri=tracking_uri).get_latest_versions(model_name, stages=[stage])
+    if not versions:
+        raise LookupError(f"No version of {model_name} in {stage}")
+
+    with _resolved_lock:
+        _resolved[key] = (now, versions[0])
+
+    return versions[0]
+
+
+def forget_stage(tracking_uri: str, model_name: str) -> None:
+    """Resolve the stages of a model from the registry again, e.g. after a new version was put in production."""
+
+    with _resolved_lock:
+        for key in [key for key in _resolved if key[:2] == (tracking_uri, model_name)]:
+            del _resolved[key]
+
+
+class ArtifactCache:
+    """On-disk cache of model artifacts by model name, version and run, shared by the processes using the same folder.
+
+    An artifact is downloaded once into a temporary folder of the cache and
+    moved in place, so a process never reads a half downloaded one. Every
+    use of a version marks it as recently used, and a download removes the
+    least recently used versions while the cache is above max_bytes,
+    except the ones used in the last grace_seconds: the lock only guards
+    the threads of one process, the API workers and the flow share the
+    folder. A version removed by another process is downloaded again.
+
+    Parameters
+    ----------
+    root : str
+        Folder of the cache.
+    max_bytes : int, optional
+        Size of the cache, by default ARTIFACT_CACHE_BYTES
+    grace_seconds : float, optional
+        Seconds after its last use before a version can be removed, by default EVICTION_GRACE
+    """
+
+    def __init__(self, root: str, max_bytes: int = ARTIFACT_CACHE_BYTES, grace_seconds: float = EVICTION_GRACE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+
+        self._lock = threading.Lock()
+
+    def entry(self, model_name: str, version, run_id: str) -> str:
+        """Folder of the artifacts of a model version."""
+
+        return os.path.join(self.root, quote(model_name, safe=""), f"{version}-{run_id}")
+
+    def get(self, model_version, artifact_uri: str = None, tracking_uri: str = None) -> str:
+        """Get the local path of an artifact of a model version, downloading it on first use.
+
+        Parameters
+        ----------
+        model_version : ModelVersion
+            Version of the registered model, e.g. from `resolve_stage`.
+        artifact_uri : str, optional
+            Artifact to get, e.g. runs:/<run id>/<path>, by default the source of the version (the model itself)
+        tracking_uri : str, optional
+            Tracking uri, for runs:/ uris, by default the current one
+
+        Returns
+        -------
+        str
+            Local path of the artifact.
+        """
+
+        if artifact_uri is None:
+            artifact_uri = model_version.source
+
+        entry = self.entry(model_version.name, model_version.version, model_version.run_id)
+        path = os.path.join(entry, artifact_uri.rstrip("/").rsplit("/", 1)[-1])
+
+        for _ in range(3): # downloaded again if another process removes it meanwhile
+            if not os.path.exists(path):
+                with self._lock:
+                    if not os.path.exists(path): # another thread may have downloaded it meanwhile
+                        self._download(artifact_uri, path, tracking_uri)
+                        self._evict(keep=entry)
+
+            try:
+                os.utime(entry) # most recently used: not removed for grace_seconds
+            except FileNotFoundError: # removed by another process since the check
+                continue
+            if os.path.exists(path):
+                return path
+
+        raise FileNotFoundError(f"{path} keeps being removed from the artifact cache")
+
+    def _download(self, artifact_uri: str, path: str, tracking_uri: str) -> None:
+        """Download an artifact next to its place in the cache and move it in place."""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".download-", dir=self.root)
+        try:
+            local_path = mlflow.artifacts.download_artifacts(artifact_uri=artifact_uri, dst_path=tmp, tracking_uri=tracking_uri)
+            try:
+                os.replace(local_path, path)
+            except OSError: # moved in place by another process
+                if not os.path.exists(path):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _evict(self, keep: str) -> None:
+        """Remove the least recently used versions, except keep and the recently used ones, while the cache is larger than max_bytes."""
+
+        entries = {} # entry: (last use, size)
+        for model in os.scandir(self.root):
+            if not model.is_dir() or model.name.startswith("."):
+                continue
+            for version in os.scandir(model.path):
+                try:
+                    if version.is_dir():
+                        entries[version.path] = (version.stat().st_mtime, sum(os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(version.path) for name in names))
+                except FileNotFoundError: # removed by another process
+                    continue
+
+        total = sum(size for _, size in entries.values())
+        used_since = time.time() - self.grace_seconds
+        for entry, (last_use, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            if entry != keep and last_use < used_since:
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+
+_caches = {} # one cache per folder in a process, so its threads share the lock
+_caches_lock = threading.Lock()
+
+
+def artifact_cache(root: str, max_bytes: int = ARTIFACT_CACHE_BYTES) -> ArtifactCache:
+    """Get the artifact cache of a folder, the same instance for every caller of the process."""
+
+    with _caches_lock:
+        key = os.path.abspath(root)
+        if key not in _caches:
+            os.makedirs(key, exist_ok=True)
+            _caches[key] = ArtifactCache(key, max_bytes=max_bytes)
+
+        return _caches[key]
+
+
+def load_registered_model(tracking_uri: str, model_name: str, stage: str = "Production", cache: ArtifactCache = None, loader=None):
+    """Load the model of a stage, from the artifact cache once it was downloaded.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    model_name : str
+        Registered name of the model.
+    stage : str, optional
+        Stage, by default "Production"
+    cache : ArtifactCache, optional
+        Artifact cache, by default None: downloaded by MLflow on every call
+    loader : callable, optional
+        MLflow flavor to load the model with, by default `mlflow.sklearn.load_model`
+
+    Returns
+    -------
+    Model loaded by the loader.
+    """
+
+    if loader is None:
+        loader = mlflow.sklearn.load_model
+
+    model_version = resolve_stage(tracking_uri, model_name, stage)
+    if cache is None:
+        return loader(model_uri=model_version.source)
+
+    return loader(model_uri=cache.get(model_version, tracking_uri=tracking_uri))
@@ -0,0 +1,195 @@
+import os
+import tempfile
+
+import pandas as pd
+import numpy as np
+
+import mlflow
+from mlflow.exceptions import MlflowException
+from mlflow.tracking import MlflowClient
+
+from src.predict.artifact_cache import ArtifactCache, resolve_stage
+
+
+COMPACT_MODEL_PATH = "compact_model" # artifact folder of the compact model in the run of the registered model
+COMPACT_MODEL_NAME = "compact_model.npz"
+
+
+class CompactModel:
+    """Linear model on ticker dummies and close growth lags, predicting with NumPy only.
+
+    Holds the same coefficients as the registered preprocessor and model,
+    in a few arrays: loading it reads a small npz file instead of
+    unpickling scikit-learn objects with their MLflow environment.
+
+    Parameters
+    ----------
+    tickers : np.ndarray
+        Tickers with a dummy, sorted.
+    effects : np.ndarray
+        Coefficient of the dummy of every ticker.
+    lag_columns : list
+        Lag columns, in the order of the coefficients.
+    lag_coefficients : np.ndarray
+        Coefficient of every lag.
+    intercept : float
+        Intercept.
+    """
+
+    def __init__(self, tickers: np.ndarray, effects: np.ndarray, lag_columns: list, lag_coefficients: np.ndarray, intercept: float):
+        order = np.argsort(np.asarray(tickers, dtype=str), kind="stable")
+        self.tickers = np.asarray(tickers, dtype=str)[order]
+        self.effects = np.asarray(effects, dtype=np.float64)[order]
+        self.lag_columns = [str(column) for column in lag_columns]
+        self.lag_coefficients = np.asarray(lag_coefficients, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    @classmethod
+    def from_pipeline(cls, preprocessor, model) -> "CompactModel":
+        """Read the coefficients of a linear model on ticker dummies and lags, as made by `make_preprocessor`.
+
+        Returns None for any other pipeline, which is then scored with scikit-learn.
+        """
+
+        from sklearn.linear_model import LinearRegression # only needed to export: loading and predicting use NumPy alone
+        from sklearn.compose import ColumnTransformer
+
+        if not isinstance(model, LinearRegression) or not isinstance(preprocessor, ColumnTransformer):
+            return None
+
+        transformers = {name: (transformer, columns) for name, transformer, columns in preprocessor.transformers_}
+        if set(transformers) - {"remainder"} != {"cat", "num"} or transformers["num"][0] != "passthrough" or list(transformers["cat"][1]) != ["ticker"]:
+            return None
+        if transformers.get("remainder", ("drop",))[0] != "drop":
+            return None
+
+        categories = preprocessor.named_transformers_["cat"].named_steps["create_dummies"].categories_[0]
+        coefficients = np.asarray(model.coef_, dtype=np.float64).reshape(-1)
+        intercept = float(np.asarray(model.intercept_).reshape(-1)[0])
+        lag_columns = list(transformers["num"][1])
+
+        if len(coefficients) != len(categories) + len(lag_columns):
+            return None
+
+        return cls(tickers=np.asarray(categories).astype(str), effects=coefficients[:len(categories)], lag_columns=lag_columns,
+                   lag_coefficients=coefficients[len(categories):], intercept=intercept)
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        """Predict the next day close growth of every row of the features.
+
+        Parameters
+        ----------
+        features : pd.DataFrame
+            Ticker and close growth lags.
+
+        Returns
+        -------
+        np.ndarray
+            One prediction per row, the same as the preprocessor and the model.
+
+        Raises
+        ------
+        ValueError
+            If a lag column is missing or a lag is missing or infinite, as with the preprocessor and the model.
+        """
+
+        missing = {column for column in ["ticker", *self.lag_columns] if column not in features.columns}
+        if missing:
+            raise ValueError(f"columns are missing: {missing}")
+
+        tickers = features["ticker"].to_numpy().astype(str)
+        effects = np.zeros(len(tickers)) # unknown tickers have no dummy
+        if len(self.tickers):
+            positions = np.minimum(np.searchsorted(self.tickers, tickers), len(self.tickers) - 1)
+            known = self.tickers[positions] == tickers
+            effects[known] = self.effects[positions[known]]
+        lags = features[self.lag_columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        if not np.isfinite(lags).all(): # rejected rather than predicted as NaN, which is no advice and no valid JSON
+            raise ValueError("Input X contains NaN." if np.isnan(lags).any() else "Input X contains infinity or a value too large for dtype('float64').")
+
+        return self.intercept + effects + lags @ self.lag_coefficients
+
+    def save(self, path: str) -> str:
+        """Write the arrays of the model next to their destination and move them in place."""
+
+        with open(f"{path}.tmp", "wb") as model_file:
+            np.savez(model_file, tickers=self.tickers, effects=self.effects, lag_columns=np.array(self.lag_columns, dtype=str),
+                     lag_coefficients=self.lag_coefficients, intercept=np.array([self.intercept]))
+
+        os.replace(f"{path}.tmp", path)
+
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "CompactModel":
+        """Read a model written by `save`."""
+
+        with np.load(path, allow_pickle=False) as model_file:
+            return cls(tickers=model_file["tickers"], effects=model_file["effects"], lag_columns=model_file["lag_columns"].tolist(),
+                       lag_coefficients=model_file["lag_coefficients"], intercept=model_file["intercept"][0])
+
+
+def log_compact_model(tracking_uri: str, run_id: str) -> bool:
+    """Log the compact version of the preprocessor and model of a run in the same run.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    run_id : str
+        ID of the run that logged the model and the preprocessor.
+
+    Returns
+    -------
+    bool
+        False if the pipeline is not a linear model on ticker dummies and lags, which has no compact version.
+    """
+
+    mlflow.set_tracking_uri(tracking_uri)
+
+    preprocessor = mlflow.sklearn.load_model(model_uri=f"runs:/{run_id}/preprocessor")
+    model = mlflow.sklearn.load_model(model_uri=f"runs:/{run_id}/model")
+
+    compact = CompactModel.from_pipeline(preprocessor, model)
+    if compact is None:
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        MlflowClient(tracking_uri=tracking_uri).log_artifact(run_id, compact.save(os.path.join(tmp, COMPACT_MODEL_NAME)), COMPACT_MODEL_PATH)
+
+    return True
+
+
+def load_compact_model(tracking_uri: str, model_name: str, stage: str = "Production", cache: ArtifactCache = None) -> tuple:
+    """Load the compact version of the model of a stage, without scikit-learn or the MLflow model environment.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    model_name : str
+        Registered name of the model.
+    stage : str, optional
+        Stage of the model, by default "Production"
+    cache : ArtifactCache, optional
+        Artifact cache, by default None: downloaded on every call
+
+    Returns
+    -------
+    tuple
+        Compact model (None if the run of the version has none, e.g. it was
+        registered before compact models were logged) and version of the model.
+    """
+
+    model_version = resolve_stage(tracking_uri, model_name, stage)
+    artifact_uri = f"runs:/{model_version.run_id}/{COMPACT_MODEL_PATH}/{COMPACT_MODEL_NAME}"
+
+    try:
+        if cache is not None:
+            return CompactModel.load(cache.get(model_version, artifact_uri, tracking_uri=tracking_uri)), str(model_version.version)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = mlflow.artifacts.download_artifacts(artifact_uri=artifact_uri, dst_path=tmp, tracking_uri=tracking_uri)
+            return CompactModel.load(path), str(model_version.version)
+    except (MlflowException, OSError):
+        return None, str(model_version.version)
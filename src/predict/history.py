@@ -0,0 +1,225 @@
+import os
+import sqlite3
+
+import pandas as pd
+import numpy as np
+
+
+HISTORY_NAME = "advice_history.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS advice (
+    ticker TEXT NOT NULL,
+    ts INTEGER NOT NULL, -- seconds since the epoch (UTC) of the run
+    model_name TEXT,
+    model_version TEXT,
+    prediction REAL,
+    advice TEXT,
+    date INTEGER, -- seconds since the epoch (UTC) of the bar the features were taken from
+    features_hash TEXT, -- hash of the ticker and lags the prediction was made from
+    PRIMARY KEY (ticker, ts)
+) WITHOUT ROWID; -- rows clustered by ticker and time: a ticker range is one contiguous read
+CREATE INDEX IF NOT EXISTS advice_ts ON advice (ts); -- ranges over all tickers
+"""
+PREDICTION_COLUMNS = {"date": "INTEGER", "features_hash": "TEXT"} # added to histories written before the prediction log
+
+
+def _connect(history_path: str, read_only: bool = False) -> sqlite3.Connection:
+    """Open the history, creating its table and indexes unless read only."""
+
+    if read_only:
+        return sqlite3.connect(f"file:{history_path}?mode=ro", uri=True)
+
+    connection = sqlite3.connect(history_path)
+    connection.execute("PRAGMA journal_mode=WAL") # readers of the API are not blocked while a run appends
+    connection.executescript(SCHEMA)
+
+    existing = {row[1] for row in connection.execute("PRAGMA table_info(advice)")}
+    for name, kind in PREDICTION_COLUMNS.items():
+        if name not in existing:
+            connection.execute(f"ALTER TABLE advice ADD COLUMN {name} {kind}")
+    connection.execute("CREATE INDEX IF NOT EXISTS advice_date ON advice (date)") # predictions of a range of bars, for monitoring
+
+    return connection
+
+
+def _to_seconds(value) -> int:
+    """Convert a date-like value to seconds since the epoch, naive values being UTC."""
+
+    timestamp = pd.Timestamp(value)
+    if timestamp.tz is None:
+        timestamp = timestamp.tz_localize("UTC")
+
+    return int(timestamp.timestamp())
+
+
+def _dates_to_seconds(dates: pd.Index) -> np.ndarray:
+    """Convert dates to seconds since the epoch, naive dates being UTC."""
+
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+
+    return dates.to_numpy(dtype="datetime64[s]").view(np.int64)
+
+
+def features_hash(features: pd.DataFrame) -> np.ndarray:
+    """Hash the ticker and close growth lags of every row, to match a logged prediction with the features of a bar.
+
+    Parameters
+    ----------
+    features : pd.DataFrame
+        Columns ticker and close_growth_lag_1, close_growth_lag_2, ...
+
+    Returns
+    -------
+    np.ndarray
+        Hex digest per row, the same for the same ticker and lag values.
+    """
+
+    columns = features.filter(regex=r"^close_growth_lag_\d+$").columns
+    columns = sorted(columns, key=lambda column: int(column.rsplit("_", 1)[1])) # lag 2 before lag 10
+    values = features[columns].astype(np.float64).assign(ticker=features["ticker"].astype(str).to_numpy())
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+    return np.char.mod("%016x", hashes)
+
+
+def append_advice(history_path: str, advice: pd.DataFrame, model_name: str = None, model_version: str = None, timestamp=None) -> int:
+    """Append the advice of one run to the history.
+
+    Parameters
+    ----------
+    history_path : str
+        Path to the SQLite history.
+    advice : pd.DataFrame
+        Advice with the columns ticker, prediction and advice, and optionally
+        date (of the bar of the features) and features_hash, to log the
+        predictions for monitoring.
+    model_name : str, optional
+        Registered name of the model, by default None
+    model_version : str, optional
+        Version of the model, by default None
+    timestamp : str, date or pd.Timestamp, optional
+        Time of the run, by default now
+
+    Returns
+    -------
+    int
+        Number of rows appended. A rerun at the same timestamp replaces its rows.
+    """
+
+    ts = _to_seconds(timestamp if timestamp is not None else pd.Timestamp.now(tz="UTC"))
+    dates = _dates_to_seconds(advice["date"]).tolist() if "date" in advice else [None] * len(advice)
+    hashes = advice["features_hash"].tolist() if "features_hash" in advice else [None] * len(advice)
+    rows = [(str(ticker), ts, model_name, None if model_version is None else str(model_version), float(prediction), str(signal), date, features)
+            for ticker, prediction, signal, date, features in zip(advice["ticker"], advice["prediction"], advice["advice"], dates, hashes)]
+
+    connection = _connect(history_path)
+    try:
+        with connection: # one transaction per run
+            connection.executemany("INSERT OR REPLACE INTO advice (ticker, ts, model_name, model_version, prediction, advice, date, features_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    finally:
+        connection.close()
+
+    return len(rows)
+
+
+def read_history(history_path: str, ticker: str = None, start=None, end=None, limit: int = None) -> pd.DataFrame:
+    """Read the advice of a time range from the history, using its indexes.
+
+    Parameters
+    ----------
+    history_path : str
+        Path to the SQLite history.
+    ticker : str, optional
+        Only this ticker, by default all tickers
+    start : str, date or pd.Timestamp, optional
+        First run time (inclusive), by default the first run
+    end : str, date or pd.Timestamp, optional
+        Last run time (inclusive), by default the last run
+    limit : int, optional
+        Maximum number of rows, keeping the most recent ones, by default no limit
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns timestamp (UTC), ticker, model_name, model_version, prediction
+        and advice, by time then ticker.
+    """
+
+    columns = ["timestamp", "ticker", "model_name", "model_version", "prediction", "advice"]
+    if not os.path.exists(history_path):
+        return pd.DataFrame(columns=columns)
+
+    conditions, parameters = [], []
+    if ticker is not None:
+        conditions.append("ticker = ?")
+        parameters.append(ticker)
+    if start is not None:
+        conditions.append("ts >= ?")
+        parameters.append(_to_seconds(start))
+    if end is not None:
+        conditions.append("ts <= ?")
+        parameters.append(_to_seconds(end))
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT ts, ticker, model_name, model_version, prediction, advice FROM advice{where} ORDER BY ts, ticker"
+    if limit is not None: # the most recent rows, back in time order
+        query = f"SELECT * FROM (SELECT ts, ticker, model_name, model_version, prediction, advice FROM advice{where} ORDER BY ts DESC, ticker DESC LIMIT ?) ORDER BY ts, ticker"
+        parameters.append(int(limit))
+
+    connection = _connect(history_path, read_only=True)
+    try:
+        history = pd.DataFrame(connection.execute(query, parameters).fetchall(), columns=["ts"] + columns[1:])
+    finally:
+        connection.close()
+
+    history.insert(0, "timestamp", pd.to_datetime(history.pop("ts"), unit="s", utc=True))
+
+    return history
+
+
+def read_predictions(history_path: str, start=None) -> pd.DataFrame:
+    """Read the logged predictions of the bars from a date on, the last one per ticker and features.
+
+    Runs during a trading day predict from a bar that is still changing:
+    only the predictions made from the final values of a bar have the hash
+    of its features, and of those the last run is kept.
+
+    Parameters
+    ----------
+    history_path : str
+        Path to the SQLite history.
+    start : str, date or pd.Timestamp, optional
+        First date of the bars of the features (inclusive), by default all bars
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns ticker, features_hash, date (UTC), model_version and prediction.
+    """
+
+    columns = ["ticker", "features_hash", "date", "model_version", "prediction"]
+    if not os.path.exists(history_path):
+        return pd.DataFrame(columns=columns)
+
+    where, parameters = "features_hash IS NOT NULL", []
+    if start is not None:
+        where += " AND date >= ?"
+        parameters.append(_to_seconds(start))
+
+    # SQLite takes the bare columns from the row with the maximum ts of every group
+    query = f"SELECT ticker, features_hash, date, model_version, prediction, MAX(ts) FROM advice WHERE {where} GROUP BY ticker, features_hash"
+
+    connection = _connect(history_path, read_only=True)
+    try:
+        predictions = pd.DataFrame([row[:-1] for row in connection.execute(query, parameters)], columns=columns)
+    except sqlite3.OperationalError: # history not written since the prediction log was added
+        predictions = pd.DataFrame(columns=columns)
+    finally:
+        connection.close()
+
+    predictions["date"] = pd.to_datetime(predictions["date"], unit="s", utc=True)
+
+    return predictions
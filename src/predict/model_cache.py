@@ -0,0 +1,259 @@
+import os
+import threading
+
+import pandas as pd
+import numpy as np
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+from src.predict.advice import modify_data
+from src.predict.artifact_cache import ArtifactCache
+from src.predict.compact_model import CompactModel
+
+
+MODEL_PREFIX = "best-model-" # registered names used by `register_best_model_task`
+PREPROCESSOR_PREFIX = "preprocessor-"
+
+
+class ServedModel:
+    """A preprocessor and model pair loaded in memory, with the predictions for the latest data.
+
+    Instances are never modified once built: a new version is served by
+    replacing the whole instance, so a request always uses a consistent pair.
+
+    Parameters
+    ----------
+    key : tuple
+        Model name, model version, preprocessor name and preprocessor version.
+    preprocessor : ColumnTransformer
+        Fitted preprocessor.
+    model : LinearRegression
+        Fitted model.
+    data : pd.DataFrame, optional
+        Latest features (output of `modify_data`) to precompute the predictions for, by default None
+    data_version : tuple, optional
+        Version of the data file the features were read from, by default None
+    """
+
+    def __init__(self, key: tuple, preprocessor, model, data: pd.DataFrame = None, data_version: tuple = None):
+        self.key = key
+        self.preprocessor = preprocessor
+        self.model = model
+        self.data_version = data_version
+
+        self._compact = CompactModel.from_pipeline(preprocessor, model)
+
+        self.predictions = {}
+        if data is not None and len(data):
+            self.predictions = dict(zip(data["ticker"].astype(str), self.predict(data).tolist()))
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        """Predict the next day close growth of every row of the features.
+
+        Parameters
+        ----------
+        features : pd.DataFrame
+            Ticker and close growth lags.
+
+        Returns
+        -------
+        np.ndarray
+            One prediction per row.
+        """
+
+        if self._compact is None:
+            return np.asarray(self.model.predict(self.preprocessor.transform(features))).reshape(len(features), -1)[:, 0]
+
+        return self._compact.predict(features) # same result as the preprocessor and the model, without their per-call validation overhead
+
+
+class ModelCache:
+    """Keep the Production preprocessor and model in memory and swap them when the registry changes.
+
+    Without explicit names, the most recently updated model in the stage
+    whose name starts with `model_prefix` is served, with the preprocessor
+    version logged in the same run. A new pair is only served once both
+    are in the stage, and requests still running keep the previous pair.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    model_name : str, optional
+        Registered name of the model, by default the latest one starting with model_prefix
+    preprocessor_name : str, optional
+        Registered name of the preprocessor, by default model_name with model_prefix replaced by preprocessor_prefix
+    stage : str, optional
+        Stage to serve, by default "Production"
+    data_name : str, optional
+        Dataset (Parquet file or feature cache) to precompute the predictions of the latest date for, by default None
+    poll_seconds : float, optional
+        Seconds between two checks of the registry and of the data, by default 60
+    model_prefix : str, optional
+        Prefix of the registered model names, by default MODEL_PREFIX
+    preprocessor_prefix : str, optional
+        Prefix of the registered preprocessor names, by default PREPROCESSOR_PREFIX
+    artifacts : ArtifactCache, optional
+        Artifact cache the versions are loaded from, downloaded once by all the workers, by default None: downloaded by every worker
+    """
+
+    def __init__(self, tracking_uri: str, model_name: str = None, preprocessor_name: str = None, stage: str = "Production", data_name: str = None,
+                 poll_seconds: float = 60.0, model_prefix: str = MODEL_PREFIX, preprocessor_prefix: str = PREPROCESSOR_PREFIX, artifacts: ArtifactCache = None):
+        self.tracking_uri = tracking_uri
+        self.client = MlflowClient(tracking_uri=tracking_uri)
+        self.model_name = model_name
+        self.preprocessor_name = preprocessor_name
+        self.stage = stage
+        self.data_name = data_name
+        self.poll_seconds = poll_seconds
+        self.model_prefix = model_prefix
+        self.preprocessor_prefix = preprocessor_prefix
+        self.artifacts = artifacts
+
+        self._served = None # replaced as a whole, never modified
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = None
+        self._poller_pid = None
+
+    @property
+    def served(self) -> ServedModel:
+        """Pair currently served, None before the first successful load."""
+
+        return self._served
+
+    def _latest_model_version(self):
+        """Get the model version to serve: the named model or the latest one with the prefix."""
+
+        if self.model_name is not None:
+            versions = self.client.get_latest_versions(self.model_name, stages=[self.stage])
+        else:
+            versions = [version for registered_model in self.client.search_registered_models(filter_string=f"name LIKE '{self.model_prefix}%'")
+                        for version in registered_model.latest_versions if version.current_stage == self.stage]
+
+        if not versions:
+            return None
+
+        return max(versions, key=lambda version: (version.last_updated_timestamp, int(version.version)))
+
+    def resolve(self) -> tuple:
+        """Find the model and preprocessor versions to serve.
+
+        Returns
+        -------
+        tuple
+            Model name, model version, preprocessor name and preprocessor version,
+            None if there is no complete pair in the stage.
+        """
+
+        model_version = self._latest_model_version()
+        if model_version is None:
+            return None
+
+        preprocessor_name = self.preprocessor_name
+        if preprocessor_name is None:
+            preprocessor_name = self.preprocessor_prefix + model_version.name[len(self.model_prefix):]
+
+        # The preprocessor fitted in the same run, once it reached the stage as well
+        preprocessor_versions = [version for version in self.client.search_model_versions(f"name='{preprocessor_name}'")
+                                 if version.run_id == model_version.run_id and version.current_stage == self.stage]
+        if not preprocessor_versions:
+            return None
+
+        return model_version.name, str(model_version.version), preprocessor_name, str(preprocessor_versions[0].version) # versions are int or str depending on the store
+
+    def _load(self, name: str, version: str):
+        """Load a pinned version of a registered model, from the artifact cache if there is one."""
+
+        if self.artifacts is None:
+            return mlflow.sklearn.load_model(model_uri=self.client.get_model_version_download_uri(name, version))
+
+        return mlflow.sklearn.load_model(model_uri=self.artifacts.get(self.client.get_model_version(name, version), tracking_uri=self.tracking_uri))
+
+    def _data_version(self) -> tuple:
+        """Get the modification time and size of the data, to reload it only when it changed."""
+
+        if self.data_name is None or not os.path.exists(self.data_name):
+            return None
+
+        path = self.data_name
+        if os.path.isdir(path): # feature cache: its metadata is written last
+            path = os.path.join(path, "meta.json")
+
+        status = os.stat(path)
+
+        return status.st_mtime_ns, status.st_size
+
+    def refresh(self) -> bool:
+        """Load the pair to serve if it changed, and recompute the predictions if the data changed.
+
+        Returns
+        -------
+        bool
+            True if a new pair or new predictions are served.
+        """
+
+        with self._refresh_lock:
+            key = self.resolve()
+            if key is None:
+                return False
+
+            served = self._served
+            data_version = self._data_version()
+            if served is not None and served.key == key and served.data_version == data_version:
+                return False
+
+            if served is not None and served.key == key:
+                preprocessor, model = served.preprocessor, served.model
+            else:
+                model_name, model_version, preprocessor_name, preprocessor_version = key
+                # Pinned versions, not the stage: the stage may move between the two loads
+                preprocessor = self._load(preprocessor_name, preprocessor_version)
+                model = self._load(model_name, model_version)
+
+            data = modify_data(self.data_name) if data_version is not None else None
+
+            self._served = ServedModel(key=key, preprocessor=preprocessor, model=model, data=data, data_version=data_version) # atomic swap
+
+            return True
+
+    def start(self) -> "ModelCache":
+        """Load the pair to serve and poll the registry in a background thread of this process.
+
+        Safe to call on every request: a forked worker starts its own thread.
+        """
+
+        if self._poller is not None and self._poller_pid == os.getpid():
+            return self
+
+        with self._refresh_lock:
+            if self._poller is not None and self._poller_pid == os.getpid():
+                return self
+
+            self._poller_pid = os.getpid()
+            self._poller = threading.Thread(target=self._poll, name="model-cache-poller", daemon=True)
+
+        try:
+            self.refresh()
+        except Exception as error: # keep starting: the poller retries
+            print(f"Model cache: could not load the models: {error}")
+
+        self._poller.start()
+
+        return self
+
+    def _poll(self) -> None:
+        """Refresh until stopped, keeping the current pair when the registry cannot be reached."""
+
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                if self.refresh():
+                    print(f"Model cache: serving {self._served.key}")
+            except Exception as error:
+                print(f"Model cache: refresh failed, still serving {getattr(self._served, 'key', None)}: {error}")
+
+    def stop(self) -> None:
+        """Stop polling."""
+
+        self._stop.set()
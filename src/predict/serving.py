@@ -0,0 +1,153 @@
+from dotenv import load_dotenv
+import json
+import os
+
+from src.predict.advice import get_advice_thresholds
+from src.predict.advice_cache import AdviceCache, SIGNALS
+from src.predict.history import HISTORY_NAME, read_history
+from src.predict.artifact_cache import ARTIFACT_CACHE_NAME, artifact_cache
+from src.predict.model_cache import ModelCache
+
+# State shared by the requests of one server process, whatever the server (Flask/gunicorn or ASGI)
+
+load_dotenv(dotenv_path="../../.env") # once per process, not per request
+DATAPATH = os.getenv("DATAPATH")
+advice_thresholds = get_advice_thresholds(env_path="../../.env") # same hold band as the advice file, see `label_advice`
+
+advice_cache = AdviceCache(f"{DATAPATH}/advice.json", check_seconds=float(os.getenv("ADVICE_CHECK_SECONDS", 1)))
+model_cache = None # created on first use
+
+def get_model_cache() -> ModelCache:
+    """Get the model cache of this process, loading the Production models and polling the registry on first use.
+
+    Returns
+    -------
+    ModelCache
+        Model cache, None if no tracking uri is configured.
+    """
+
+    global model_cache
+
+    if model_cache is None:
+        tracking_uri = os.getenv("MLFLOW_TRACKING_URI")
+        if tracking_uri is None:
+            return None
+
+        data_name = os.path.join(DATAPATH, "BEL_20.features") if DATAPATH is not None else None
+        if data_name is not None and not os.path.exists(data_name):
+            data_name = os.path.join(DATAPATH, "BEL_20.parquet")
+
+        artifacts = artifact_cache(os.path.join(DATAPATH, ARTIFACT_CACHE_NAME)) if DATAPATH is not None else None # shared by the workers
+
+        model_cache = ModelCache(tracking_uri=tracking_uri, model_name=os.getenv("MODEL_NAME"), preprocessor_name=os.getenv("PREPROCESSOR_NAME"),
+                                 data_name=data_name, poll_seconds=float(os.getenv("MODEL_POLL_SECONDS", 60)), artifacts=artifacts)
+
+    return model_cache.start()
+
+def served_model():
+    """Get the pair currently served, None if no model is loaded yet."""
+
+    cache = get_model_cache()
+
+    return cache.served if cache is not None else None
+
+ADVICE_FILTERS = ("tickers", "signal", "min_prediction", "max_prediction")
+
+def parse_advice_query(args) -> dict:
+    """Parse the filters of an advice query from its query string parameters.
+
+    Parameters
+    ----------
+    args : Mapping
+        Query string parameters: tickers (comma separated), signal (BUY, HOLD or SELL),
+        min_prediction and max_prediction.
+
+    Returns
+    -------
+    dict
+        Keyword arguments of `AdviceIndex.query`, None if no filter is given.
+
+    Raises
+    ------
+    ValueError
+        If a signal or a bound is invalid.
+    """
+
+    if not any(name in args for name in ADVICE_FILTERS):
+        return None
+
+    query = {}
+    if "tickers" in args:
+        query["tickers"] = [ticker.strip() for ticker in args["tickers"].split(",") if ticker.strip()]
+    if "signal" in args:
+        query["signal"] = args["signal"].upper()
+        if query["signal"] not in SIGNALS:
+            raise ValueError(f"signal must be one of {', '.join(SIGNALS)}")
+    for bound in ("min_prediction", "max_prediction"):
+        if bound in args:
+            query[bound] = float(args[bound])
+
+    return query
+
+def query_advice(query: dict) -> tuple:
+    """Serialize the advice records matching a query.
+
+    Returns
+    -------
+    tuple
+        Body (bytes), ETag and last modification time of the advice, or None
+        if there is no advice yet. The ETag is the one of the advice: the
+        result only depends on the advice and the URL.
+    """
+
+    indexed = advice_cache.index()
+    if indexed is None:
+        return None
+
+    index, etag, last_modified = indexed
+
+    return json.dumps(index.query(**query)).encode(), etag, last_modified
+
+def ticker_advice(ticker: str) -> tuple:
+    """Get the serialized advice record of one ticker.
+
+    Returns
+    -------
+    tuple
+        Body (bytes), ETag and last modification time of the advice, None if
+        there is no advice yet, or an empty body if the ticker is unknown.
+    """
+
+    indexed = advice_cache.index()
+    if indexed is None:
+        return None
+
+    index, etag, last_modified = indexed
+
+    return index.serialized.get(ticker, b""), etag, last_modified
+
+def advice_history(args) -> bytes:
+    """Serialize the advice history of a time range, read from the indexes of the history store.
+
+    Parameters
+    ----------
+    args : Mapping
+        Query string parameters: ticker, from and to (dates or timestamps, UTC
+        if naive) and limit (most recent rows kept).
+
+    Returns
+    -------
+    bytes
+        Records with timestamp (ISO 8601), ticker, model_name, model_version, prediction and advice.
+
+    Raises
+    ------
+    ValueError
+        If a date or the limit is invalid.
+    """
+
+    history = read_history(os.path.join(DATAPATH, HISTORY_NAME), ticker=args.get("ticker"), start=args.get("from"), end=args.get("to"),
+                           limit=int(args["limit"]) if "limit" in args else None)
+    history["timestamp"] = history["timestamp"].map(lambda timestamp: timestamp.isoformat())
+
+    return history.to_json(orient="records").encode()
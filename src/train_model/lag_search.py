@@ -0,0 +1,149 @@
+import pandas as pd
+import numpy as np
+from scipy import linalg, sparse
+
+
+def lag_statistics(codes: np.ndarray, n_tickers: int, lags: np.ndarray, y: np.ndarray) -> dict:
+    """Compute the Gram matrices of the ticker dummies and lags once for every nested lag set.
+
+    A row is used by the model with k lags if its first k lags are known, so
+    the rows are bucketed by their number of leading known lags and the
+    statistics of the model with k lags are the sum of the buckets >= k.
+    Every row is read once, whatever the number of candidate lag counts.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        Ticker code of every row, between 0 and n_tickers - 1.
+    n_tickers : int
+        Number of tickers.
+    lags : np.ndarray
+        Lags of every row, shape (n_rows, max_lags), may contain NaNs.
+    y : np.ndarray
+        Target of every row, without NaNs.
+
+    Returns
+    -------
+    dict
+        Per number of lags k (index 0 to max_lags): "counts" (rows per
+        ticker), "dummy_lags" (D'X), "lag_lags" (X'X), "dummy_y" (D'y) and
+        "lag_y" (X'y), each stacked along the first axis.
+    """
+
+    n_rows, max_lags = lags.shape
+
+    known = ~np.isnan(lags)
+    n_known = np.where(known.all(axis=1), max_lags, np.argmin(known, axis=1)) # number of leading known lags
+    filled = np.where(known, lags, 0.0) # unknown lags never enter the blocks of the models that use them
+
+    dummies = sparse.csr_matrix((np.ones(n_rows), (codes, np.arange(n_rows))), shape=(n_tickers, n_rows))
+
+    statistics = {
+        "counts": np.zeros((max_lags + 1, n_tickers)),
+        "dummy_lags": np.zeros((max_lags + 1, n_tickers, max_lags)),
+        "lag_lags": np.zeros((max_lags + 1, max_lags, max_lags)),
+        "dummy_y": np.zeros((max_lags + 1, n_tickers)),
+        "lag_y": np.zeros((max_lags + 1, max_lags)),
+    }
+
+    for k in range(max_lags + 1): # one bucket per number of known lags
+        rows = np.flatnonzero(n_known == k)
+        if len(rows) == 0:
+            continue
+
+        bucket_dummies = dummies[:, rows]
+        statistics["counts"][k] = np.asarray(bucket_dummies.sum(axis=1)).ravel()
+        statistics["dummy_lags"][k] = bucket_dummies @ filled[rows]
+        statistics["lag_lags"][k] = filled[rows].T @ filled[rows]
+        statistics["dummy_y"][k] = bucket_dummies @ y[rows]
+        statistics["lag_y"][k] = filled[rows].T @ y[rows]
+
+    # Rows with at least k known lags: suffix sums over the buckets
+    return {name: np.cumsum(values[::-1], axis=0)[::-1] for name, values in statistics.items()}
+
+
+def solve_lags(statistics: dict, n_lags_used: int) -> tuple:
+    """Solve the least squares fit with ticker fixed effects and the first n_lags_used lags.
+
+    The ticker block of the Gram matrix is diagonal, so it is eliminated
+    with a Schur complement and only an n_lags_used x n_lags_used system is
+    solved, whatever the number of tickers.
+
+    Parameters
+    ----------
+    statistics : dict
+        Output of `lag_statistics`.
+    n_lags_used : int
+        Number of lags used in the model.
+
+    Returns
+    -------
+    tuple
+        Effect of every ticker (NaN for tickers without complete rows), lag
+        coefficients and number of rows used.
+    """
+
+    k = n_lags_used
+    counts = statistics["counts"][k]
+    present = counts > 0
+
+    dummy_lags = statistics["dummy_lags"][k][present, :k]
+    lag_lags = statistics["lag_lags"][k][:k, :k]
+    dummy_y = statistics["dummy_y"][k][present]
+    lag_y = statistics["lag_y"][k][:k]
+
+    schur = lag_lags - dummy_lags.T @ (dummy_lags / counts[present, None])
+    rhs = lag_y - dummy_lags.T @ (dummy_y / counts[present])
+
+    try:
+        lag_coefficients = linalg.solve(schur, rhs, assume_a="pos")
+    except (linalg.LinAlgError, ValueError): # singular system, e.g. duplicated lags
+        lag_coefficients = linalg.lstsq(schur, rhs)[0]
+
+    effects = np.full(len(counts), np.nan)
+    effects[present] = (dummy_y - dummy_lags @ lag_coefficients) / counts[present]
+
+    return effects, lag_coefficients, int(counts.sum())
+
+
+def to_linear_regression_coefficients(effects: np.ndarray, lag_coefficients: np.ndarray) -> tuple:
+    """Express a fixed effects fit as the coefficients `LinearRegression` finds on ticker dummies + lags.
+
+    With an intercept the dummies are collinear; `LinearRegression` returns
+    the minimum norm solution, i.e. dummy coefficients that sum to zero over
+    the tickers seen in training and zero for the others.
+
+    Parameters
+    ----------
+    effects : np.ndarray
+        Effect of every ticker, NaN for tickers without complete rows.
+    lag_coefficients : np.ndarray
+        Lag coefficients.
+
+    Returns
+    -------
+    tuple
+        Coefficients (dummies followed by lags) and intercept.
+    """
+
+    intercept = np.nanmean(effects)
+    dummy_coefficients = np.where(np.isnan(effects), 0.0, effects - intercept)
+
+    return np.r_[dummy_coefficients, lag_coefficients], intercept
+
+
+def encode_tickers(tickers: pd.Series) -> tuple:
+    """Encode tickers as integer codes in the (sorted) order `OneHotEncoder` uses.
+
+    Parameters
+    ----------
+    tickers : pd.Series
+        Ticker of every row.
+
+    Returns
+    -------
+    tuple
+        Vocabulary and code of every row.
+    """
+
+    return np.unique(np.asarray(tickers, dtype=object), return_inverse=True)
@@ -0,0 +1,394 @@
+import os
+
+import pandas as pd
+import numpy as np
+
+import mlflow
+
+from src.data.storage import read_dataset
+from src.train_model.lag_search import encode_tickers, lag_statistics, solve_lags
+from src.train_model.tracking import RunLogger
+from src.train_model.train_model import make_linear_model, make_preprocessor, register_run
+
+
+ONLINE_STATE_NAME = "online_model.npz"
+ONLINE_EXPERIMENT_NAME = "stock-prediction-BEL-20-online"
+MODEL_NAME = "best-model-BEL-20" # stable registered names: every update is a new version of the same model
+PREPROCESSOR_NAME = "preprocessor-BEL-20"
+STATISTICS = ("counts", "dummy_lags", "lag_lags", "dummy_y", "lag_y")
+PENDING = "pending_" # prefix of the statistics of the last bar in the state, replaced when the bar is refetched
+
+
+def _statistics(data: pd.DataFrame, n_lags_used: int) -> dict:
+    """Least squares statistics of the rows of the data with a target and their first n_lags_used lags, per ticker in sorted order."""
+
+    data = data[data["close_growth"].notna()]
+    lags = data[[f"close_growth_lag_{i}" for i in range(1, n_lags_used + 1)]].to_numpy(dtype=np.float64)
+    y = data["close_growth"].to_numpy(dtype=np.float64)
+    tickers, codes = encode_tickers(data["ticker"])
+
+    statistics = lag_statistics(codes=codes, n_tickers=len(tickers), lags=lags, y=y)
+
+    complete = ~np.isnan(lags).any(axis=1)
+    statistics["y_y"] = np.array([y[complete] @ y[complete]]) # for the residuals of the fit
+    statistics["tickers"] = tickers.astype(str)
+
+    return statistics
+
+
+def _align(statistics: dict, tickers: np.ndarray) -> dict:
+    """Express per-ticker statistics on a larger sorted set of tickers, with zeros for the new ones."""
+
+    positions = np.searchsorted(tickers, statistics["tickers"])
+    aligned = dict(statistics, tickers=tickers)
+    for name in ("counts", "dummy_lags", "dummy_y"):
+        values = np.zeros((statistics[name].shape[0], len(tickers)) + statistics[name].shape[2:])
+        values[:, positions] = statistics[name]
+        aligned[name] = values
+
+    return aligned
+
+
+def _combine(state: dict, statistics: dict, sign: int = 1) -> dict:
+    """Add (sign 1) or remove (sign -1) the statistics of some rows to or from the state, on the union of their tickers."""
+
+    tickers = np.union1d(state["tickers"], statistics["tickers"]).astype(str)
+    state, statistics = _align(state, tickers), _align(statistics, tickers)
+
+    combined = dict(state)
+    for name in STATISTICS + ("y_y",):
+        combined[name] = state[name] + sign * statistics[name]
+
+    return combined
+
+
+def _pending(state: dict) -> dict:
+    """Get the statistics of the last bar kept in the state, None for states saved before they were kept."""
+
+    if f"{PENDING}tickers" not in state:
+        return None
+
+    return {name[len(PENDING):]: value for name, value in state.items() if name.startswith(PENDING)}
+
+
+def _with_pending(state: dict, data: pd.DataFrame) -> dict:
+    """Keep the statistics of the rows of the last date of the data in the state, with that date as its last date."""
+
+    last_date = data.index.max()
+    pending = _statistics(data[data.index == last_date], int(state["n_lags_used"][0]))
+
+    state = dict(state, **{f"{PENDING}{name}": value for name, value in pending.items()})
+    state["last_date"] = np.array([pd.Timestamp(last_date).isoformat()])
+
+    return state
+
+
+def init_state(data: pd.DataFrame, n_lags_used: int, trained_at=None) -> dict:
+    """Start the state of the online model from the data of a full retrain.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Data indexed by date, with the columns ticker, close_growth and the close growth lags.
+    n_lags_used : int
+        Number of lags used in the model.
+    trained_at : str, date or pd.Timestamp, optional
+        Time of the full retrain, by default now
+
+    Returns
+    -------
+    dict
+        Statistics of the rows, number of lags, last date folded in, statistics
+        of the rows of that date and time of the full retrain.
+    """
+
+    state = _statistics(data, n_lags_used)
+    state["n_lags_used"] = np.array([n_lags_used])
+    state = _with_pending(state, data) # the last bar may still be incomplete
+    trained_at = pd.Timestamp(trained_at if trained_at is not None else pd.Timestamp.now(tz="UTC"))
+    state["trained_at"] = np.array([(trained_at if trained_at.tz is not None else trained_at.tz_localize("UTC")).isoformat()])
+
+    return state
+
+
+def _timestamp(state: dict, name: str) -> pd.Timestamp:
+    """Get a time stored in the state as an ISO string."""
+
+    return pd.Timestamp(str(state[name][0]))
+
+
+def new_rows(state: dict, data: pd.DataFrame) -> pd.DataFrame:
+    """Get the rows of the data from the last date folded into the state on: that bar is refetched as it may have been incomplete."""
+
+    if _pending(state) is None: # the rows of the last date cannot be replaced
+        return data[data.index > _timestamp(state, "last_date")]
+
+    return data[data.index >= _timestamp(state, "last_date")]
+
+
+def fold_in(state: dict, data: pd.DataFrame) -> dict:
+    """Add the rows of the data after the last date of the state to its statistics, and replace the rows of that date.
+
+    Least squares statistics are sums over the rows, so the cost only
+    depends on the number of new rows; tickers seen for the first time
+    are added to the model. The price store refetches the last bar on
+    every run as it may have been incomplete (e.g. during the session),
+    so the statistics of the rows of the last date are kept apart in the
+    state and replaced by those of the refetched rows.
+
+    Parameters
+    ----------
+    state : dict
+        State of the online model.
+    data : pd.DataFrame
+        Data indexed by date, may also hold the rows already folded in.
+
+    Returns
+    -------
+    dict
+        New state, the state given (returned as is when no bar is new or changed) is not modified.
+    """
+
+    data = new_rows(state, data)
+    if data.empty:
+        return state
+
+    pending = _pending(state)
+    refreshed = _with_pending(state, data)
+    if pending is not None and refreshed["last_date"][0] == state["last_date"][0] and \
+       all(np.array_equal(pending[name], refreshed[f"{PENDING}{name}"], equal_nan=pending[name].dtype.kind == "f") for name in pending):
+        return state # the last bar was refetched unchanged
+
+    if pending is not None:
+        refreshed = _combine(refreshed, pending, sign=-1)
+
+    return _combine(refreshed, _statistics(data, int(state["n_lags_used"][0])))
+
+
+def solve_state(state: dict) -> tuple:
+    """Solve the model of the state.
+
+    Returns
+    -------
+    tuple
+        Effect of every ticker of the state, lag coefficients, number of
+        rows and mean squared residual of the fit.
+    """
+
+    n_lags_used = int(state["n_lags_used"][0])
+    effects, lag_coefficients, n = solve_lags(state, n_lags_used)
+
+    # At the least squares solution, the residual sum of squares is y'y - b'X'y
+    explained = np.nansum(effects * state["dummy_y"][n_lags_used]) + lag_coefficients @ state["lag_y"][n_lags_used][:n_lags_used]
+    mse = (state["y_y"][0] - explained) / max(n, 1)
+
+    return effects, lag_coefficients, n, float(mse)
+
+
+def prediction_mse(state: dict, data: pd.DataFrame) -> float:
+    """Mean squared error of the model of the state on the complete rows of the data, NaN if there are none."""
+
+    n_lags_used = int(state["n_lags_used"][0])
+    effects, lag_coefficients, _, _ = solve_state(state)
+
+    data = data[data["close_growth"].notna()]
+    lags = data[[f"close_growth_lag_{i}" for i in range(1, n_lags_used + 1)]].to_numpy(dtype=np.float64)
+    tickers = np.asarray(data["ticker"], dtype=str)
+    positions = np.minimum(np.searchsorted(state["tickers"], tickers), len(state["tickers"]) - 1)
+    effect = np.where(state["tickers"][positions] == tickers, effects[positions], np.nan)
+    effect = np.where(np.isnan(effect), np.nanmean(effects), effect) # like the ignored dummies of an unknown ticker
+
+    errors = data["close_growth"].to_numpy(dtype=np.float64) - (effect + lags @ lag_coefficients)
+    errors = errors[~np.isnan(errors)]
+
+    return float(np.mean(errors ** 2)) if len(errors) else np.nan
+
+
+def save_state(state: dict, state_path: str) -> str:
+    """Write the state next to its destination and move it in place."""
+
+    with open(f"{state_path}.tmp", "wb") as state_file:
+        np.savez(state_file, **state)
+
+    os.replace(f"{state_path}.tmp", state_path)
+
+    return state_path
+
+
+def load_state(state_path: str) -> dict:
+    """Read a state written by `save_state`, None if there is none."""
+
+    if not os.path.exists(state_path):
+        return None
+
+    with np.load(state_path, allow_pickle=False) as state_file:
+        return {name: state_file[name] for name in state_file.files}
+
+
+def full_retrain_time(state_path: str) -> pd.Timestamp:
+    """Get the time of the full retrain the online model started from, None without an online model.
+
+    The online updates publish new versions of the same names, so this
+    is what identifies the model they all come from.
+    """
+
+    state = load_state(state_path)
+    if state is None:
+        return None
+
+    return _timestamp(state, "trained_at")
+
+
+def publish_state(state: dict, tracking_uri: str, experiment_name: str, model_name: str = MODEL_NAME, preprocessor_name: str = PREPROCESSOR_NAME) -> str:
+    """Log the model of the state and register it as a new Production version of the stable names.
+
+    Parameters
+    ----------
+    state : dict
+        State of the online model.
+    tracking_uri : str
+        Tracking uri.
+    experiment_name : str
+        Name of the experiment to log the update in.
+    model_name : str, optional
+        Registered name of the model, by default MODEL_NAME
+    preprocessor_name : str, optional
+        Registered name of the preprocessor, by default PREPROCESSOR_NAME
+
+    Returns
+    -------
+    str
+        Registered version of the model.
+    """
+
+    n_lags_used = int(state["n_lags_used"][0])
+    effects, lag_coefficients, n, mse = solve_state(state)
+
+    # Dummies in the order of the tickers of the state, which are sorted like the categories of OneHotEncoder
+    fit_frame = pd.DataFrame({"ticker": state["tickers"], **{f"close_growth_lag_{i}": 0.0 for i in range(1, n_lags_used + 1)}})
+    preprocessor = make_preprocessor(n_lags_used).fit(fit_frame)
+    model = make_linear_model(effects, lag_coefficients)
+
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment(experiment_name)
+    logger = RunLogger(tracking_uri=tracking_uri, experiment_id=experiment.experiment_id)
+
+    try:
+        with logger.start_run() as run_id:
+            logger.log_param(run_id, "model", "linear_regression")
+            logger.log_param(run_id, "features", f"close growth ({n_lags_used} lags) + ticker dummy")
+            logger.log_param(run_id, "target", "close growth")
+            logger.log_param(run_id, "training", "online")
+            logger.log_param(run_id, "n", n)
+            logger.log_param(run_id, "n_lags_used", n_lags_used)
+            logger.log_param(run_id, "last_date", _timestamp(state, "last_date"))
+            logger.log_param(run_id, "trained_at", _timestamp(state, "trained_at"))
+
+            logger.log_model(run_id, preprocessor, "preprocessor")
+            logger.log_model(run_id, model, "model")
+
+            logger.log_metric(run_id, "mse", mse)
+    finally:
+        logger.close() # the run must be complete before it is registered
+
+    return register_run(tracking_uri=tracking_uri, run_id=run_id, model_name=model_name, preprocessor_name=preprocessor_name)
+
+
+def start_online_model(data_name: str, state_path: str, n_lags_used: int, tracking_uri: str = None, experiment_name: str = ONLINE_EXPERIMENT_NAME,
+                       model_name: str = MODEL_NAME, preprocessor_name: str = PREPROCESSOR_NAME) -> str:
+    """Start the online model from the whole dataset after a full retrain, and publish it.
+
+    The full retrain selects the number of lags and registers the model of
+    its best run, fitted on the training dates only. The state is fitted on
+    the whole dataset, so its model is published right away: the registry
+    and the state then agree, and the fit of the state is the reference of
+    the drift ratio of the next updates.
+
+    Parameters
+    ----------
+    data_name : str
+        Path to the data file.
+    state_path : str
+        Path to write the state of the online model to.
+    n_lags_used : int
+        Number of lags selected by the full retrain.
+    tracking_uri : str, optional
+        Tracking uri, by default None: the state is not published
+    experiment_name : str, optional
+        Name of the experiment to log the model in, by default ONLINE_EXPERIMENT_NAME
+    model_name : str, optional
+        Registered name of the model, by default MODEL_NAME
+    preprocessor_name : str, optional
+        Registered name of the preprocessor, by default PREPROCESSOR_NAME
+
+    Returns
+    -------
+    str
+        Path to the state.
+    """
+
+    data = read_dataset(data_name, regex="ticker|close_growth") # Load only the columns used for training
+    state = init_state(data, n_lags_used)
+
+    if tracking_uri is not None:
+        publish_state(state, tracking_uri=tracking_uri, experiment_name=experiment_name, model_name=model_name, preprocessor_name=preprocessor_name)
+
+    return save_state(state, state_path)
+
+
+def update_online_model(data_name: str, state_path: str, tracking_uri: str, experiment_name: str, model_name: str = MODEL_NAME, preprocessor_name: str = PREPROCESSOR_NAME,
+                        full_retrain_days: float = 7, drift_ratio: float = 2.0, now=None) -> str:
+    """Fold the new bars of the dataset into the online model and publish it, unless a full retrain is due.
+
+    Parameters
+    ----------
+    data_name : str
+        Path to the data file.
+    state_path : str
+        Path to the state of the online model.
+    tracking_uri : str
+        Tracking uri.
+    experiment_name : str
+        Name of the experiment to log the updates in.
+    model_name : str, optional
+        Registered name of the model, by default MODEL_NAME
+    preprocessor_name : str, optional
+        Registered name of the preprocessor, by default PREPROCESSOR_NAME
+    full_retrain_days : float, optional
+        Days after a full retrain before the next one, by default 7
+    drift_ratio : float, optional
+        Retrain fully when the mean squared error on the new bars exceeds the
+        one of the fit of the state (the model in production) by this factor, by default 2.0
+    now : str, date or pd.Timestamp, optional
+        Current time, by default now
+
+    Returns
+    -------
+    str
+        "updated" or "unchanged" (no new or changed bars), or the reason for a full
+        retrain: "no state", "schedule" or "drift".
+    """
+
+    state = load_state(state_path)
+    if state is None:
+        return "no state"
+
+    now = pd.Timestamp(now if now is not None else pd.Timestamp.now(tz="UTC"))
+    if now.tz is None:
+        now = now.tz_localize("UTC")
+    if now - _timestamp(state, "trained_at").tz_convert("UTC") > pd.Timedelta(days=full_retrain_days):
+        return "schedule"
+
+    data = new_rows(state, read_dataset(data_name, regex="ticker|close_growth", start=_timestamp(state, "last_date"))) # only the last and new dates are read
+    folded = fold_in(state, data)
+    if folded is state or data["close_growth"].notna().sum() == 0:
+        return "unchanged"
+
+    if prediction_mse(state, data) > drift_ratio * solve_state(state)[3]:
+        return "drift"
+
+    state = folded
+    publish_state(state, tracking_uri=tracking_uri, experiment_name=experiment_name, model_name=model_name, preprocessor_name=preprocessor_name)
+    save_state(state, state_path) # only once published: a failed run folds the same bars in again
+
+    return "updated"
@@ -0,0 +1,188 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+
+import mlflow
+from mlflow.entities import Metric, Param
+from mlflow.exceptions import MlflowException
+from mlflow.models import Model
+from mlflow.tracking import MlflowClient
+from mlflow.tracking.context.registry import resolve_tags
+from mlflow.utils.time_utils import get_current_time_millis
+
+
+MAX_PARAMS_PER_BATCH = 100 # limits of one `log_batch` request
+MAX_METRICS_PER_BATCH = 1000
+
+
+class RunLogger:
+    """Log runs to MLFlow with one `log_batch` request per run and model uploads in the background.
+
+    Params and metrics are buffered until the run ends. Models are saved
+    locally and, with the buffered data, uploaded by a background thread
+    while the next run computes. `flush` blocks until everything is logged.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    experiment_id : str
+        Id of the experiment to log the runs in.
+    max_workers : int, optional
+        Number of background upload threads, by default 4
+    """
+
+    def __init__(self, tracking_uri: str, experiment_id: str, max_workers: int = 4):
+        self.client = MlflowClient(tracking_uri=tracking_uri)
+        self.experiment_id = experiment_id
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+        self._runs = {} # buffered params, metrics and saved models of the runs not uploaded yet
+        self._timings = {} # seconds spent per run in computation, in tracking calls and in background uploads
+        self._lock = threading.Lock()
+        self._requirements_lock = threading.Lock()
+        self._pip_requirements = None
+
+    def _time(self, run_id: str, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._timings[run_id][kind] += seconds
+
+    @contextmanager
+    def timer(self, run_id: str, kind: str = "compute"):
+        """Add the time spent in the block to the timings of a run."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._time(run_id, kind, time.perf_counter() - start)
+
+    @contextmanager
+    def start_run(self):
+        """Create a run, yield its id and hand its data to the background uploads at the end of the block."""
+
+        start = time.perf_counter()
+        run_id = self.client.create_run(self.experiment_id, tags=resolve_tags()).info.run_id
+        self._runs[run_id] = {"params": [], "metrics": [], "models": []}
+        with self._lock:
+            self._timings[run_id] = {"compute": 0.0, "tracking": time.perf_counter() - start, "upload": 0.0}
+
+        status = "FAILED"
+        try:
+            yield run_id
+            status = "FINISHED"
+        finally:
+            self.end_run(run_id, status=status)
+
+    def log_param(self, run_id: str, key: str, value) -> None:
+        """Buffer a param of a run."""
+
+        self._runs[run_id]["params"].append(Param(key, str(value)))
+
+    def log_metric(self, run_id: str, key: str, value: float, step: int = 0) -> None:
+        """Buffer a metric of a run."""
+
+        self._runs[run_id]["metrics"].append(Metric(key, float(value), get_current_time_millis(), step))
+
+    def log_model(self, run_id: str, sk_model, artifact_path: str) -> None:
+        """Keep a scikit-learn model of a run to save and upload it in the background.
+
+        The model must not be modified afterwards.
+        """
+
+        self._runs[run_id]["models"].append((sk_model, artifact_path))
+
+    def end_run(self, run_id: str, status: str = "FINISHED") -> None:
+        """Upload the buffered data of a run in the background and terminate the run."""
+
+        start = time.perf_counter()
+        run = self._runs.pop(run_id)
+        self._futures.append(self._executor.submit(self._upload, run_id, run, status))
+        self._time(run_id, "tracking", time.perf_counter() - start)
+
+    def _upload(self, run_id: str, run: dict, status: str) -> None:
+        """Log the params and metrics of a run in batches, then its models, then terminate it."""
+
+        start = time.perf_counter()
+
+        try:
+            params, metrics = run["params"], run["metrics"]
+            while params or metrics:
+                self.client.log_batch(run_id, params=params[:MAX_PARAMS_PER_BATCH], metrics=metrics[:MAX_METRICS_PER_BATCH])
+                params, metrics = params[MAX_PARAMS_PER_BATCH:], metrics[MAX_METRICS_PER_BATCH:]
+
+            for sk_model, artifact_path in run["models"]:
+                self._upload_model(run_id, sk_model, artifact_path)
+        except Exception:
+            status = "FAILED"
+            raise
+        finally:
+            self.client.set_terminated(run_id, status=status)
+            self._time(run_id, "upload", time.perf_counter() - start)
+
+    def _upload_model(self, run_id: str, sk_model, artifact_path: str) -> None:
+        """Save a model like `mlflow.sklearn.log_model` does and upload its folder."""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            local_path = os.path.join(tmp, artifact_path)
+            mlflow_model = Model(artifact_path=artifact_path, run_id=run_id)
+            self._save_model(sk_model, local_path, mlflow_model)
+
+            self.client.log_artifacts(run_id, local_path, artifact_path)
+
+        # The client has no public call to add the model to the logged models of a run: `mlflow.sklearn.log_model`
+        # needs an active fluent run, and the stack of active runs is global to the process in MLflow 2.6, not per
+        # thread, so the upload threads cannot use it. This is the call `log_model` makes, MLflow is pinned to 2.6 for it.
+        try:
+            self.client._record_logged_model(run_id, mlflow_model)
+        except MlflowException: # older tracking servers do not keep the model history of a run
+            pass
+
+    def _save_model(self, sk_model, local_path: str, mlflow_model: Model) -> None:
+        """Save a model, inferring its pip requirements only for the first one.
+
+        Inferring the requirements loads the model in a subprocess, and every
+        model of the training loop has the same ones.
+        """
+
+        with self._requirements_lock:
+            if self._pip_requirements is None:
+                mlflow.sklearn.save_model(sk_model, local_path, mlflow_model=mlflow_model)
+                with open(os.path.join(local_path, "requirements.txt"), "r") as requirements_file:
+                    self._pip_requirements = [line.strip() for line in requirements_file if line.strip()]
+                return
+
+        mlflow.sklearn.save_model(sk_model, local_path, mlflow_model=mlflow_model, pip_requirements=self._pip_requirements)
+
+    def flush(self) -> None:
+        """Wait until every run is logged, raising the first upload error."""
+
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        """Flush and stop the background threads."""
+
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def timings(self) -> pd.DataFrame:
+        """Get the seconds spent per run in computation, in tracking calls and in background uploads.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per run, with the columns compute, tracking and upload.
+        """
+
+        with self._lock:
+            return pd.DataFrame.from_dict(self._timings, orient="index", columns=["compute", "tracking", "upload"])
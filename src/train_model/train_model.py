@@ -7,6 +7,8 @@ from mlflow.entities import ViewType
 from mlflow.tracking import MlflowClient
 
 from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 
 from sklearn.linear_model import LinearRegression
 from sklearn.pipeline import Pipeline
@@ -15,9 +17,17 @@ from sklearn.compose import ColumnTransformer
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_percentage_error
 from scipy.sparse import issparse
 
-from hyperopt import hp, fmin, tpe, Trials
+from hyperopt import hp, fmin, tpe, Trials, space_eval, STATUS_OK, JOB_STATE_DONE
+from hyperopt.base import Domain
+from hyperopt.utils import coarse_utcnow
 import numpy as np
 
+from src.data.storage import read_dataset
+from src.train_model.tracking import RunLogger
+from src.train_model.lag_search import encode_tickers, lag_statistics, solve_lags, to_linear_regression_coefficients
+from src.predict.artifact_cache import forget_stage
+from src.predict.compact_model import log_compact_model
+
 def get_tracking_uri(env_path: str = ".env") -> str:
     """Get the tracking uri from the .env file.
     
@@ -55,10 +65,11 @@ def train_test_split(data_name: str, train_ratio: float = 0.8) -> tuple:
         Tuple containing the train and test sets.
     """
 
-    data = pd.read_pickle(data_name).sort_values("Date") # Load data
+    data = read_dataset(data_name, regex="ticker|close_growth").sort_values("Date") # Load only the columns used for training
 
-    # Assuming the dataset is sorted by date, you can split by index
+    # The dataset is sorted by date: split at the date of the row at train_ratio, so no date is in both sets
     train_size = int(train_ratio * len(data))  
+    train_size = np.searchsorted(data.index, data.index[train_size], side="left") if train_size < len(data) else train_size
     train_data = data.iloc[:train_size]
     test_data = data.iloc[train_size:]
 
@@ -75,15 +86,96 @@ def train_test_split(data_name: str, train_ratio: float = 0.8) -> tuple:
 
     return X_train, X_test, y_train, y_test
 
-def train_model(tracking_uri: str, experiment_name: str, X_train: pd.DataFrame, X_test: pd.DataFrame, y_train: pd.DataFrame, y_test: pd.DataFrame, max_lags_used: int = 10) -> None:
-    """Train the model and log results of optimisation in MLFlow.
+def make_preprocessor(n_lags_used: int) -> ColumnTransformer:
+    """Make the preprocessor: ticker dummies and the first n_lags_used lags.
 
     Parameters
     ----------
-    tracking_uri : str
-        Tracking uri.
-    experiment_name : str
-        Name of the experiment.
+    n_lags_used : int
+        Number of lags used in the model.
+
+    Returns
+    -------
+    ColumnTransformer
+        Unfitted preprocessor.
+    """
+
+    # Make dummies for categorical features
+    cat_features = ["ticker"]
+    cat_transformer = Pipeline(steps=[("create_dummies", OneHotEncoder(handle_unknown="ignore"))])
+
+    num_features = [f"close_growth_lag_{i}" for i in range(1, n_lags_used + 1)]
+
+    return ColumnTransformer(transformers=[("cat", cat_transformer, cat_features), 
+                                           ('num', 'passthrough', num_features)], remainder="drop")
+
+def make_linear_model(effects: np.ndarray, lag_coefficients: np.ndarray) -> LinearRegression:
+    """Make the fitted `LinearRegression` of a fixed effects fit, the same estimator as when fitting it on the preprocessed data.
+
+    Parameters
+    ----------
+    effects : np.ndarray
+        Effect of every ticker, in the order of the dummies, NaN for tickers without complete rows.
+    lag_coefficients : np.ndarray
+        Lag coefficients.
+
+    Returns
+    -------
+    LinearRegression
+        Fitted model.
+    """
+
+    coefficients, intercept = to_linear_regression_coefficients(effects, lag_coefficients)
+
+    model = LinearRegression()
+    model.coef_ = coefficients.reshape(1, -1)
+    model.intercept_ = np.array([intercept])
+    model.n_features_in_ = len(coefficients)
+
+    return model
+
+def drop_missing_rows(X, y: np.ndarray) -> tuple:
+    """Drop the rows with a missing value from a CSR or dense design matrix and the target.
+
+    Only the stored values of a sparse matrix are checked, so the cost
+    scales with the number of nonzeros, not with the number of dummies.
+
+    Parameters
+    ----------
+    X : scipy.sparse matrix or np.ndarray
+        Design matrix.
+    y : np.ndarray
+        Target, with one row per row of X.
+
+    Returns
+    -------
+    tuple
+        Design matrix and target without the rows with missing values.
+    """
+
+    if issparse(X):
+        X = X.tocsr()
+        missing = np.zeros(X.shape[0], dtype=bool)
+        missing[np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))[np.isnan(X.data)]] = True # row of every stored NaN
+    else:
+        X = np.asarray(X)
+        missing = np.isnan(X).any(axis=1)
+
+    keep = np.flatnonzero(~missing)
+
+    return X[keep], y[keep]
+
+def search_lags(logger: RunLogger, X_train: pd.DataFrame, X_test: pd.DataFrame, y_train: pd.DataFrame, y_test: pd.DataFrame, max_lags_used: int = 10, cv_mapes: pd.DataFrame = None) -> None:
+    """Fit the model for every number of lags from the Gram matrices and log each fit in MLFlow.
+
+    The Gram matrices of the largest lag set are computed once and every
+    nested lag set is solved from its sub-blocks, which gives the same fits
+    as refitting `LinearRegression` on each lag set.
+
+    Parameters
+    ----------
+    logger : RunLogger
+        Logger of the runs.
     X_train : pd.DataFrame
         Training set of features.
     X_test : pd.DataFrame
@@ -94,61 +186,94 @@ def train_model(tracking_uri: str, experiment_name: str, X_train: pd.DataFrame,
         Test set of target.
     max_lags_used : int
         Max number of lags used in the model.
+    cv_mapes : pd.DataFrame, optional
+        Output of `cross_validate_lags`, logged as the metrics cv_mape (mean
+        over the folds) and cv_mape_std, by default None
 
     Returns
     -------
-    None, but logs results of optimisation in MLFlow.
+    None, but logs one run per number of lags with the logger.
     """
 
-    mlflow.set_tracking_uri(tracking_uri)
-    mlflow.set_experiment(experiment_name)
+    vocabulary, codes = encode_tickers(X_train["ticker"])
+    lags = X_train[[f"close_growth_lag_{i}" for i in range(1, max_lags_used + 1)]].to_numpy(dtype=np.float64)
+    statistics = lag_statistics(codes=codes, n_tickers=len(vocabulary), lags=lags, y=y_train.to_numpy(dtype=np.float64).ravel())
 
-    def objective_function(params):
-        """Objective function for hyperparameter optimization.
-        """
-
-        n_lags_used = params["n_lags_used"]
+    for n_lags_used in range(1, max_lags_used + 1):
         print(f"n_lags_used: {n_lags_used}")
 
-        with mlflow.start_run() as run: 
+        with logger.start_run() as run_id:
+
+            with logger.timer(run_id):
+                effects, lag_coefficients, n = solve_lags(statistics, n_lags_used)
 
-            # Make dummies for categorical features
-            cat_features = ["ticker"]
-            cat_transformer = Pipeline(steps=[("create_dummies", OneHotEncoder(handle_unknown="ignore"))])
+                preprocessor = make_preprocessor(n_lags_used).fit(X_train) # dummies in the same order as the codes
+                model = make_linear_model(effects, lag_coefficients)
 
-            num_features = [f"close_growth_lag_{i}" for i in range(1, n_lags_used + 1)]
+                # Make predictions
+                y_pred = model.predict(preprocessor.transform(X_test))
 
-            preprocessor = ColumnTransformer(transformers=[("cat", cat_transformer, cat_features), 
-                                                        ('num', 'passthrough', num_features)], remainder="drop")
+            # Log parameters
+            logger.log_param(run_id, "model", "linear_regression")
+            logger.log_param(run_id, "features", f"close growth ({n_lags_used} lags) + ticker dummy")
+            logger.log_param(run_id, "target", "close growth")
+            logger.log_param(run_id, "n", n)
+            logger.log_param(run_id, "n_lags_used", n_lags_used)
 
-            
-            X_train_reduced = preprocessor.fit_transform(X_train)
+            # Log model and preprocessor
+            logger.log_model(run_id, preprocessor, "preprocessor")
+            logger.log_model(run_id, model, "model")
 
-            # Convert to DataFrame (handle both dense and sparse data)
-            if issparse(X_train_reduced):
-                X_train_reduced = pd.DataFrame.sparse.from_spmatrix(X_train_reduced, columns=preprocessor.get_feature_names_out(input_features=X_train.columns))
-            else:
-                X_train_reduced = pd.DataFrame(X_train_reduced, columns=preprocessor.get_feature_names_out(input_features=X_train.columns))
+            # Evaluate model
+            logger.log_metric(run_id, "mse", mean_squared_error(y_test, y_pred))
+            logger.log_metric(run_id, "r2", r2_score(y_test, y_pred))
+            logger.log_metric(run_id, "mape", mean_absolute_percentage_error(y_test, y_pred))
 
-            # Delete rows with missing values
-            X_train_reduced = X_train_reduced.dropna()
-            y_train_reduced = y_train.iloc[X_train_reduced.index, :]
-        
-            # Log parameters
-            mlflow.log_param("model", "linear_regression")
-            mlflow.log_param("features", f"close growth ({n_lags_used} lags) + ticker dummy")
-            mlflow.log_param("target", "close growth")
-            mlflow.log_param("n", len(X_train_reduced))
-            mlflow.log_param("n_lags_used", n_lags_used)
+            if cv_mapes is not None:
+                logger.log_param(run_id, "cv_folds", cv_mapes.shape[1])
+                logger.log_metric(run_id, "cv_mape", cv_mapes.loc[n_lags_used].mean())
+                logger.log_metric(run_id, "cv_mape_std", cv_mapes.loc[n_lags_used].std())
+
+    return None
+
+def fit_and_log_trial(logger: RunLogger, n_lags_used: int, X_train: pd.DataFrame, X_test: pd.DataFrame, y_train: pd.DataFrame, y_test: pd.DataFrame) -> float:
+    """Fit the model with n_lags_used lags and log it in a new run.
+
+    Parameters
+    ----------
+    logger : RunLogger
+        Logger of the runs.
+    n_lags_used : int
+        Number of lags used in the model.
+    X_train : pd.DataFrame
+        Training set of features.
+    X_test : pd.DataFrame
+        Test set of features.
+    y_train : pd.DataFrame
+        Training set of target.
+    y_test : pd.DataFrame
+        Test set of target.
+
+    Returns
+    -------
+    float
+        MAPE on the test set.
+    """
+
+    print(f"n_lags_used: {n_lags_used}")
+
+    with logger.start_run() as run_id:
+
+        with logger.timer(run_id):
+            preprocessor = make_preprocessor(n_lags_used)
+
+            # Delete rows with missing values, on the CSR or dense output of the preprocessor
+            X_train_reduced, y_train_reduced = drop_missing_rows(preprocessor.fit_transform(X_train), y_train.to_numpy(dtype=np.float64))
 
             # Fit model
             model = LinearRegression()
             model.fit(X_train_reduced, y_train_reduced)
 
-            # Log model and preprocessor
-            mlflow.sklearn.log_model(preprocessor, "preprocessor")
-            mlflow.sklearn.log_model(model, "model")
-
             # Make predictions
             X_test_reduced = preprocessor.transform(X_test)
             y_pred = model.predict(X_test_reduced)
@@ -158,12 +283,258 @@ def train_model(tracking_uri: str, experiment_name: str, X_train: pd.DataFrame,
             r2 = r2_score(y_test, y_pred)
             mape = mean_absolute_percentage_error(y_test, y_pred)
 
-            # Log metrics
-            mlflow.log_metric("mse", mse)
-            mlflow.log_metric("r2", r2)
-            mlflow.log_metric("mape", mape)
-        
-        return mape
+        # Log parameters
+        logger.log_param(run_id, "model", "linear_regression")
+        logger.log_param(run_id, "features", f"close growth ({n_lags_used} lags) + ticker dummy")
+        logger.log_param(run_id, "target", "close growth")
+        logger.log_param(run_id, "n", X_train_reduced.shape[0])
+        logger.log_param(run_id, "n_lags_used", n_lags_used)
+
+        # Log model and preprocessor
+        logger.log_model(run_id, preprocessor, "preprocessor")
+        logger.log_model(run_id, model, "model")
+
+        # Log metrics
+        logger.log_metric(run_id, "mse", mse)
+        logger.log_metric(run_id, "r2", r2)
+        logger.log_metric(run_id, "mape", mape)
+
+    return mape
+
+def date_folds(dates: pd.DatetimeIndex, n_folds: int = 5, test_ratio: float = 0.2, window: str = "expanding") -> list:
+    """Split dates into walk-forward folds: the last test_ratio of the dates is cut into n_folds consecutive test blocks.
+
+    Parameters
+    ----------
+    dates : pd.DatetimeIndex
+        Dates of the data, in any order and with repetitions.
+    n_folds : int, optional
+        Number of folds, by default 5
+    test_ratio : float, optional
+        Ratio of the dates tested over all folds, by default 0.2
+    window : str, optional
+        "expanding" to train on all dates before a test block, "rolling" on
+        as many dates as before the first test block, by default "expanding"
+
+    Returns
+    -------
+    list
+        First training date, first test date and last test date of every fold.
+    """
+
+    dates = pd.DatetimeIndex(dates).unique().sort_values()
+    first_test = len(dates) - max(int(round(test_ratio * len(dates))), n_folds)
+    if first_test < 1:
+        raise ValueError(f"{len(dates)} dates are too few for {n_folds} folds")
+
+    blocks = np.array_split(np.arange(first_test, len(dates)), n_folds)
+
+    return [(dates[0 if window == "expanding" else block[0] - first_test], dates[block[0]], dates[block[-1]]) for block in blocks]
+
+def _evaluate_fold(data_name: str, train_start: pd.Timestamp, test_start: pd.Timestamp, test_end: pd.Timestamp, max_lags_used: int) -> np.ndarray:
+    """MAPE of the model with every number of lags on one fold, fitted in closed form on the dates of the fold only."""
+
+    data = read_dataset(data_name, regex="ticker|close_growth", start=train_start, end=test_end) # a slice of the memory-mapped features, shared by all workers
+    data = data[data["close_growth"].notna()]
+    test = data.index >= test_start
+
+    lag_columns = [f"close_growth_lag_{i}" for i in range(1, max_lags_used + 1)]
+    vocabulary, codes = encode_tickers(data.loc[~test, "ticker"])
+    statistics = lag_statistics(codes=codes, n_tickers=len(vocabulary), lags=data.loc[~test, lag_columns].to_numpy(dtype=np.float64),
+                                y=data.loc[~test, "close_growth"].to_numpy(dtype=np.float64))
+
+    tickers = np.asarray(data.loc[test, "ticker"], dtype=object)
+    test_codes = np.minimum(np.searchsorted(vocabulary, tickers), len(vocabulary) - 1)
+    known_ticker = vocabulary[test_codes] == tickers
+    test_lags = data.loc[test, lag_columns].to_numpy(dtype=np.float64)
+    y_test = data.loc[test, "close_growth"].to_numpy(dtype=np.float64)
+
+    mapes = np.full(max_lags_used, np.nan)
+    for n_lags_used in range(1, max_lags_used + 1):
+        effects, lag_coefficients, _ = solve_lags(statistics, n_lags_used)
+        effects = np.where(np.isnan(effects), np.nanmean(effects), effects) # like the ignored dummies of a ticker unseen in training
+        complete = ~np.isnan(test_lags[:, :n_lags_used]).any(axis=1)
+        if complete.any():
+            y_pred = np.where(known_ticker, effects[test_codes], np.nanmean(effects)) + test_lags[:, :n_lags_used] @ lag_coefficients
+            mapes[n_lags_used - 1] = mean_absolute_percentage_error(y_test[complete], y_pred[complete])
+
+    return mapes
+
+def cross_validate_lags(data_name: str, max_lags_used: int = 10, n_folds: int = 5, test_ratio: float = 0.2, window: str = "expanding", n_jobs: int = 1) -> pd.DataFrame:
+    """Walk-forward cross-validation of every number of lags on date boundaries, with the folds evaluated in parallel.
+
+    Every worker opens the same dataset (memory-mapped if it is a feature
+    cache) and only reads the dates of its fold, so no data is pickled to
+    the workers and the wall-clock time does not grow with the number of
+    folds as long as there are cores.
+
+    Parameters
+    ----------
+    data_name : str
+        Path to the data file.
+    max_lags_used : int, optional
+        Max number of lags used in the model, by default 10
+    n_folds : int, optional
+        Number of folds, by default 5
+    test_ratio : float, optional
+        Ratio of the dates tested over all folds, by default 0.2
+    window : str, optional
+        "expanding" or "rolling" training window, by default "expanding"
+    n_jobs : int, optional
+        Number of folds evaluated in parallel processes, by default 1
+
+    Returns
+    -------
+    pd.DataFrame
+        MAPE per number of lags (index n_lags_used) and fold (columns).
+    """
+
+    folds = date_folds(read_dataset(data_name, columns=[]).index, n_folds=n_folds, test_ratio=test_ratio, window=window)
+    arguments = [[data_name] * n_folds, *zip(*folds), [max_lags_used] * n_folds]
+
+    if n_jobs > 1:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(n_jobs, n_folds), mp_context=context) as executor:
+            mapes = list(executor.map(_evaluate_fold, *arguments))
+    else:
+        mapes = list(map(_evaluate_fold, *arguments))
+
+    return pd.DataFrame(np.column_stack(mapes), index=pd.Index(range(1, max_lags_used + 1), name="n_lags_used"), columns=[f"fold_{i}" for i in range(n_folds)])
+
+def print_timings(logger: RunLogger, last: int = None) -> None:
+    """Print the seconds spent per run (only the last ones if given) in computation and in tracking, blocking and in the background."""
+
+    timings = logger.timings()
+    if last is not None:
+        timings = timings.tail(last)
+
+    if not timings.empty:
+        print(timings.round(3).to_string())
+        print(f"total compute: {timings['compute'].sum():.3f}s, tracking: {timings['tracking'].sum():.3f}s, background upload: {timings['upload'].sum():.3f}s")
+
+_worker_data = {} # logger and training data of a trial worker process, set once by `_init_trial_worker`
+
+def _init_trial_worker(tracking_uri: str, experiment_name: str, X_train: pd.DataFrame, X_test: pd.DataFrame, y_train: pd.DataFrame, y_test: pd.DataFrame) -> None:
+    """Set the MLFlow context of a trial worker process and keep the data it trains on."""
+
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment(experiment_name)
+
+    _worker_data.update(logger=RunLogger(tracking_uri=tracking_uri, experiment_id=experiment.experiment_id), X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test)
+
+def _run_trial(n_lags_used: int, seed: int) -> float:
+    """Run one trial in a worker process with a seed that only depends on the trial."""
+
+    np.random.seed(seed)
+
+    mape = fit_and_log_trial(n_lags_used=n_lags_used, **_worker_data)
+    _worker_data["logger"].flush() # the pool gives no hook to flush when the worker exits
+
+    print_timings(_worker_data["logger"], last=1)
+
+    return mape
+
+def parallel_fmin(space: dict, max_evals: int, n_jobs: int, initargs: tuple, seed: int = 42) -> Trials:
+    """Run the TPE search with batches of n_jobs trials evaluated in a local process pool.
+
+    Every batch is suggested from the trials completed so far, evaluated in
+    parallel and then reported back to the search, so the suggestions only
+    depend on the seed and n_jobs, not on the order in which workers finish.
+
+    Parameters
+    ----------
+    space : dict
+        Hyperopt search space.
+    max_evals : int
+        Number of trials.
+    n_jobs : int
+        Number of worker processes, i.e. trials evaluated at the same time.
+    initargs : tuple
+        Tracking uri, experiment name, X_train, X_test, y_train and y_test, sent once to every worker.
+    seed : int, optional
+        Seed of the search, by default 42
+
+    Returns
+    -------
+    Trials
+        Completed trials.
+    """
+
+    trials = Trials()
+    domain = Domain(lambda params: None, space) # trials are evaluated by the workers, not by the domain
+    rstate = np.random.default_rng(seed)
+
+    context = multiprocessing.get_context("spawn") # no forked copies of MLFlow clients or open files
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_trial_worker, initargs=initargs) as executor:
+        while len(trials) < max_evals:
+            batch = []
+            for tid in trials.new_trial_ids(min(n_jobs, max_evals - len(trials))): # one suggestion per id, as in `fmin`
+                batch.extend(tpe.suggest([tid], domain, trials, rstate.integers(2**31 - 1)))
+
+            params = [space_eval(space, {name: values[0] for name, values in doc["misc"]["vals"].items() if values}) for doc in batch]
+            seeds = [seed + doc["tid"] for doc in batch]
+            losses = list(executor.map(_run_trial, [trial_params["n_lags_used"] for trial_params in params], seeds))
+
+            for doc, loss in zip(batch, losses):
+                doc["state"] = JOB_STATE_DONE
+                doc["result"] = {"loss": loss, "status": STATUS_OK}
+                doc["refresh_time"] = coarse_utcnow()
+
+            trials.insert_trial_docs(batch)
+            trials.refresh()
+
+    return trials
+
+def train_model(tracking_uri: str, experiment_name: str, X_train: pd.DataFrame, X_test: pd.DataFrame, y_train: pd.DataFrame, y_test: pd.DataFrame, max_lags_used: int = 10, search: str = "gram", max_evals: int = 5, n_jobs: int = 1,
+                data_name: str = None, n_folds: int = 5, window: str = "expanding") -> None:
+    """Train the model and log results of optimisation in MLFlow.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    experiment_name : str
+        Name of the experiment.
+    X_train : pd.DataFrame
+        Training set of features.
+    X_test : pd.DataFrame
+        Test set of features.
+    y_train : pd.DataFrame
+        Training set of target.
+    y_test : pd.DataFrame
+        Test set of target.
+    max_lags_used : int
+        Max number of lags used in the model.
+    search : str, optional
+        "gram" to evaluate every number of lags in closed form, "cv" to do so
+        and also cross-validate them on data_name, "tpe" for the Hyperopt
+        search, by default "gram"
+    max_evals : int, optional
+        Number of trials of the Hyperopt search, by default 5
+    n_jobs : int, optional
+        Number of trials of the Hyperopt search (or folds) run in parallel processes, by default 1
+    data_name : str, optional
+        Path to the data file to cross-validate on, required for "cv", by default None
+    n_folds : int, optional
+        Number of walk-forward folds of "cv", by default 5
+    window : str, optional
+        "expanding" or "rolling" training window of "cv", by default "expanding"
+
+    Returns
+    -------
+    None, but logs results of optimisation in MLFlow.
+    """
+
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment(experiment_name)
+
+    logger = RunLogger(tracking_uri=tracking_uri, experiment_id=experiment.experiment_id)
+
+    def objective_function(params):
+        """Objective function for hyperparameter optimization.
+        """
+
+        return fit_and_log_trial(logger=logger, n_lags_used=params["n_lags_used"], X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test)
     
     # Define the search space
     space = {
@@ -171,46 +542,53 @@ def train_model(tracking_uri: str, experiment_name: str, X_train: pd.DataFrame,
     }
 
     # Hyperparameter optimization and registration of experiments
-    num_evals = 5
-    trials = Trials()
-    fmin(fn=objective_function, space=space, algo=tpe.suggest, max_evals=num_evals, trials=trials, rstate=np.random.default_rng(42))
+    num_evals = max_evals
+    try:
+        if search == "cv":
+            cv_mapes = cross_validate_lags(data_name=data_name, max_lags_used=max_lags_used, n_folds=n_folds, window=window, n_jobs=n_jobs)
+            search_lags(logger=logger, X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test, max_lags_used=max_lags_used, cv_mapes=cv_mapes)
+        elif search == "gram":
+            search_lags(logger=logger, X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test, max_lags_used=max_lags_used)
+        elif n_jobs > 1:
+            parallel_fmin(space=space, max_evals=num_evals, n_jobs=n_jobs, initargs=(tracking_uri, experiment_name, X_train, X_test, y_train, y_test))
+        else:
+            trials = Trials()
+            fmin(fn=objective_function, space=space, algo=tpe.suggest, max_evals=num_evals, trials=trials, rstate=np.random.default_rng(42))
+    finally:
+        logger.close() # every run is logged before `register_best_model` searches them
+
+    print_timings(logger)
 
     return None
 
-def register_best_model(tracking_uri: str, experiment_name: str, model_name: str, preprocessor_name: str) -> None: 
-    """Register the best model and preprocessor in MLFlow.
+def register_run(tracking_uri: str, run_id: str, model_name: str, preprocessor_name: str) -> str:
+    """Register the model and preprocessor of a run and transition both to Production.
+
+    The compact version of the pair is logged in the run first, so every
+    version in Production can be loaded with `load_compact_model`.
 
     Parameters
     ----------
     tracking_uri : str
         Tracking uri.
-    experiment_name : str
-        Name of the experiment.
+    run_id : str
+        ID of the run that logged the model and the preprocessor.
     model_name : str
         Name of the model.
     preprocessor_name : str
         Name of the preprocessor.
-    
+
     Returns
     -------
-    None, but registers the best model and preprocessor in MLFlow.
+    str
+        Registered version of the model.
     """
-    
-    mlflow.set_tracking_uri(tracking_uri)
-    mlflow.set_experiment(experiment_name)
 
+    log_compact_model(tracking_uri=tracking_uri, run_id=run_id) # coefficients in a small npz, for a fast cold start
 
-    # Search for the best model in terms of MAPE
-    run = mlflow.search_runs(
-        experiment_names=[experiment_name],
-        filter_string="",
-        run_view_type=ViewType.ACTIVE_ONLY,
-        max_results=1,
-        order_by=["metrics.mape ASC"],
-    )
+    mlflow.set_tracking_uri(tracking_uri)
 
-    # Get run ID and model/preprocessor URIs
-    run_id = run.run_id[0]
+    # Get model/preprocessor URIs
     model_uri = f"runs:/{run_id}/model"
     preprocessor_uri = f"runs:/{run_id}/preprocessor"
 
@@ -233,6 +611,50 @@ def register_best_model(tracking_uri: str, experiment_name: str, model_name: str
         version=preprocessor_details.version,
         stage="Production", 
         archive_existing_versions=True
-)
+    )
+
+    # The stages of both names resolve to the new versions in this process from now on
+    forget_stage(tracking_uri, model_name)
+    forget_stage(tracking_uri, preprocessor_name)
+
+    return str(model_details.version)
+
+def register_best_model(tracking_uri: str, experiment_name: str, model_name: str, preprocessor_name: str, metric: str = "mape") -> None: 
+    """Register the best model and preprocessor in MLFlow.
+
+    Parameters
+    ----------
+    tracking_uri : str
+        Tracking uri.
+    experiment_name : str
+        Name of the experiment.
+    model_name : str
+        Name of the model.
+    preprocessor_name : str
+        Name of the preprocessor.
+    metric : str, optional
+        Metric to select the best run on (lowest), e.g. "cv_mape" after a
+        cross-validated search, by default "mape"
+    
+    Returns
+    -------
+    None, but registers the best model and preprocessor in MLFlow.
+    """
+    
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment(experiment_name)
+
+
+    # Search for the best model in terms of MAPE (on the test set or cross-validated)
+    run = mlflow.search_runs(
+        experiment_names=[experiment_name],
+        filter_string="",
+        run_view_type=ViewType.ACTIVE_ONLY,
+        max_results=1,
+        order_by=[f"metrics.{metric} ASC"],
+    )
+
+    # Register the model and preprocessor of the best run and put them in production
+    register_run(tracking_uri=tracking_uri, run_id=run.run_id[0], model_name=model_name, preprocessor_name=preprocessor_name)
  
     return None
@@ -0,0 +1,35 @@
+import json
+
+import pandas as pd
+import numpy as np
+import pytest
+
+from src.predict.advice import label_advice, write_advice
+from src.predict.advice_cache import AdviceIndex
+
+
+def test_label_advice_hold_band():
+    predictions = np.array([0.02, 0.005, 0.0, -0.005, -0.02])
+
+    assert label_advice(predictions).tolist() == ["BUY", "BUY", "SELL", "SELL", "SELL"] # same as before without a band
+    advice = label_advice(predictions, buy_threshold=0.01, sell_threshold=-0.01)
+    assert advice.tolist() == ["BUY", "HOLD", "HOLD", "HOLD", "SELL"]
+    assert list(advice.categories) == ["BUY", "HOLD", "SELL"]
+
+    with pytest.raises(ValueError):
+        label_advice(predictions, buy_threshold=-0.01, sell_threshold=0.01)
+
+
+def test_write_advice_matches_to_json(tmp_path):
+    tickers = np.array(["ABI.BR", "KBC.BR", "UCB.BR"], dtype=object)
+    predictions = np.array([0.013, -0.002, 0.0])
+    advice = label_advice(predictions)
+    path = write_advice(tickers, predictions, advice, str(tmp_path / "advice.json"))
+
+    expected = json.loads(pd.DataFrame({"prediction": predictions, "advice": advice}, index=tickers).to_json(double_precision=15))
+    with open(path, "r") as advice_file:
+        written = json.load(advice_file)
+
+    assert written == expected
+    assert not (tmp_path / "advice.json.tmp").exists()
+    assert AdviceIndex(written).query(signal="BUY") == [{"ticker": "ABI.BR", "prediction": 0.013, "advice": "BUY"}]
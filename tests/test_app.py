@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mlflow
+from mlflow.tracking import MlflowClient
+from sklearn.linear_model import LinearRegression
+
+from src.data.storage import write_dataset
+from src.predict.advice import modify_data
+from src.predict.advice_cache import AdviceCache
+from src.predict import serving
+from src.predict.app import app as app_module
+from src.predict.app import asgi
+from src.predict.history import append_advice
+from src.predict.model_cache import ModelCache
+from src.train_model.train_model import make_preprocessor
+
+
+N_LAGS = 3
+
+
+@pytest.fixture
+def features():
+    # Latest features of three tickers on two dates, like the output of get_data
+    rng = np.random.default_rng(3)
+    frame = pd.DataFrame({"ticker": ["ABI.BR", "KBC.BR", "UCB.BR"] * 2, "close_growth": rng.normal(0, 0.01, 6)},
+                         index=pd.DatetimeIndex(np.repeat(pd.to_datetime(["2023-09-01", "2023-09-04"]), 3), name="Date"))
+    for i in range(1, N_LAGS + 1):
+        frame[f"close_growth_lag_{i}"] = rng.normal(0, 0.01, 6)
+    return frame
+
+
+def register_pair(tracking_uri, suffix, features, seed):
+    # Fit, log and register a preprocessor and model like train_model and register_best_model
+    rng = np.random.default_rng(seed)
+    X = features.drop(columns="close_growth").reset_index(drop=True)
+    y = rng.normal(0, 0.01, len(X))
+
+    preprocessor = make_preprocessor(N_LAGS - 1).fit(X)
+    model = LinearRegression().fit(preprocessor.transform(X), y)
+
+    mlflow.set_tracking_uri(tracking_uri)
+    with mlflow.start_run() as run:
+        mlflow.sklearn.log_model(preprocessor, "preprocessor", pip_requirements=["scikit-learn"])
+        mlflow.sklearn.log_model(model, "model", pip_requirements=["scikit-learn"])
+
+    client = MlflowClient(tracking_uri=tracking_uri)
+    versions = {}
+    for name, artifact_path in ((f"best-model-{suffix}", "model"), (f"preprocessor-{suffix}", "preprocessor")):
+        versions[artifact_path] = mlflow.register_model(f"runs:/{run.info.run_id}/{artifact_path}", name)
+
+    return client, versions, preprocessor, model
+
+
+def test_model_cache_swaps_complete_pairs_only(tmp_path, features):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    client, versions, preprocessor, model = register_pair(tracking_uri, "2023-09-01", features, seed=0)
+    cache = ModelCache(tracking_uri=tracking_uri)
+
+    assert not cache.refresh() # nothing in Production yet
+    for version in versions.values():
+        client.transition_model_version_stage(version.name, version.version, stage="Production")
+    assert cache.refresh()
+
+    X = features.drop(columns="close_growth")
+    np.testing.assert_allclose(cache.served.predict(X), model.predict(preprocessor.transform(X)))
+
+    # A new model is only served once its preprocessor reached the stage too
+    client, new_versions, new_preprocessor, new_model = register_pair(tracking_uri, "2023-09-04", features, seed=1)
+    client.transition_model_version_stage(new_versions["model"].name, new_versions["model"].version, stage="Production")
+    assert not cache.refresh()
+    assert cache.served.key[0] == "best-model-2023-09-01"
+
+    client.transition_model_version_stage(new_versions["preprocessor"].name, new_versions["preprocessor"].version, stage="Production")
+    assert cache.refresh()
+    assert cache.served.key == ("best-model-2023-09-04", "1", "preprocessor-2023-09-04", "1")
+    np.testing.assert_allclose(cache.served.predict(X), new_model.predict(new_preprocessor.transform(X)))
+
+
+def test_predict_endpoints(tmp_path, features):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    client, versions, preprocessor, model = register_pair(tracking_uri, "2023-09-01", features, seed=0)
+    for version in versions.values():
+        client.transition_model_version_stage(version.name, version.version, stage="Production")
+
+    data_name = write_dataset(features, str(tmp_path / "BEL_20.parquet"))
+    cache = ModelCache(tracking_uri=tracking_uri, data_name=data_name)
+    cache.refresh()
+
+    with patch.object(serving, "model_cache", cache), patch.object(cache, "start", return_value=cache):
+        client = app_module.app.test_client()
+
+        # Latest date, lags shifted by one day like in make_predictions
+        latest = modify_data(data_name)
+        expected = model.predict(preprocessor.transform(latest))
+
+        response = client.get("/predict?ticker=KBC.BR")
+        assert response.status_code == 200
+        assert response.get_json()["prediction"] == pytest.approx(expected[1])
+        assert response.get_json()["advice"] == ("BUY" if expected[1] > 0 else "SELL")
+        band = abs(expected[1]) + 1.0
+        with patch.object(serving, "advice_thresholds", {"buy_threshold": band, "sell_threshold": -band}): # same hold band as the advice file
+            assert client.get("/predict?ticker=KBC.BR").get_json()["advice"] == "HOLD"
+        assert client.get("/predict?ticker=UNKNOWN").status_code == 404
+
+        response = client.post("/predict", json=[{"ticker": "ABI.BR", "close_growth_lag_1": 0.01, "close_growth_lag_2": -0.02},
+                                                 {"ticker": "NEW.BR", "close_growth_lag_1": 0.0, "close_growth_lag_2": 0.0}])
+        records = pd.DataFrame({"ticker": ["ABI.BR", "NEW.BR"], "close_growth_lag_1": [0.01, 0.0], "close_growth_lag_2": [-0.02, 0.0]})
+        assert response.get_json()["predictions"] == pytest.approx(model.predict(preprocessor.transform(records)).tolist())
+        assert client.post("/predict", json={"ticker": "ABI.BR", "close_growth_lag_1": None, "close_growth_lag_2": 0.0}).status_code == 400
+
+
+def test_advice_is_cached_and_conditional(tmp_path):
+    path = tmp_path / "advice.json"
+    path.write_text(json.dumps({"prediction": {"ABI.BR": [0.01]}, "advice": {"ABI.BR": "BUY"}}))
+
+    with patch.object(serving, "advice_cache", AdviceCache(str(path), check_seconds=0)):
+        client = app_module.app.test_client()
+
+        response = client.get("/advice")
+        assert response.status_code == 200
+        assert response.get_json()["advice"] == {"ABI.BR": "BUY"}
+        etag = response.headers["ETag"]
+
+        # Unchanged advice: not modified, and the file is not read again
+        with patch("builtins.open", side_effect=AssertionError("file read again")):
+            assert client.get("/advice", headers={"If-None-Match": etag}).status_code == 304
+
+        # New advice: new body and ETag
+        path.write_text(json.dumps({"prediction": {"ABI.BR": [-0.01]}, "advice": {"ABI.BR": "SELL"}}))
+        os.utime(path, ns=(0, 10**18))
+        response = client.get("/advice", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.get_json()["advice"] == {"ABI.BR": "SELL"}
+        assert response.headers["ETag"] != etag
+
+
+def asgi_get(app, path, headers=()):
+    # Minimal ASGI client: one GET request, returns the status, headers and body
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    path, _, query_string = path.partition("?")
+    scope = {"type": "http", "http_version": "1.1", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": query_string.encode(),
+             "root_path": "", "scheme": "http", "server": ("testserver", 80), "client": ("testclient", 50000),
+             "headers": [(key.lower().encode(), value.encode()) for key, value in headers]}
+    asyncio.run(app(scope, receive, send))
+
+    start = next(message for message in messages if message["type"] == "http.response.start")
+    body = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+    return start["status"], {key.decode(): value.decode() for key, value in start["headers"]}, body
+
+
+def test_asgi_advice_matches_flask(tmp_path):
+    path = tmp_path / "advice.json"
+    path.write_text(json.dumps({"prediction": {"ABI.BR": [0.01]}, "advice": {"ABI.BR": "BUY"}}))
+
+    with patch.object(serving, "advice_cache", AdviceCache(str(path), check_seconds=0)):
+        flask_response = app_module.app.test_client().get("/advice")
+        status, headers, body = asgi_get(asgi.app, "/advice")
+
+        assert status == 200
+        assert json.loads(body) == flask_response.get_json()
+        assert headers["etag"] == flask_response.headers["ETag"]
+        assert headers["last-modified"] == flask_response.headers["Last-Modified"]
+
+        assert asgi_get(asgi.app, "/advice", headers=[("If-None-Match", headers["etag"])])[0] == 304
+        assert asgi_get(asgi.app, "/advice", headers=[("If-Modified-Since", headers["last-modified"])])[0] == 304
+        assert asgi_get(asgi.app, "/advice", headers=[("If-None-Match", '"other"')])[0] == 200
+
+
+def test_advice_queries(tmp_path):
+    path = tmp_path / "advice.json"
+    predictions = {"ABI.BR": 0.02, "KBC.BR": -0.01, "UCB.BR": 0.005, "SOLB.BR": -0.03}
+    path.write_text(json.dumps({"prediction": {ticker: [prediction] for ticker, prediction in predictions.items()}, # nested like make_predictions
+                                "advice": {ticker: "BUY" if prediction > 0 else "SELL" for ticker, prediction in predictions.items()}}))
+
+    with patch.object(serving, "advice_cache", AdviceCache(str(path), check_seconds=0)):
+        flask_client = app_module.app.test_client()
+
+        assert flask_client.get("/advice/KBC.BR").get_json() == {"ticker": "KBC.BR", "prediction": -0.01, "advice": "SELL"}
+        assert flask_client.get("/advice/UNKNOWN").status_code == 404
+        assert asgi_get(asgi.app, "/advice/KBC.BR")[2] == flask_client.get("/advice/KBC.BR").data
+
+        tickers = lambda url: [record["ticker"] for record in flask_client.get(url).get_json()]
+        assert tickers("/advice?tickers=UCB.BR,ABI.BR,NEW.BR") == ["UCB.BR", "ABI.BR"]
+        assert tickers("/advice?signal=buy") == ["UCB.BR", "ABI.BR"]
+        assert tickers("/advice?signal=SELL&min_prediction=-0.02") == ["KBC.BR"]
+        assert tickers("/advice?min_prediction=-0.01&max_prediction=0.005") == ["KBC.BR", "UCB.BR"]
+        assert tickers("/advice?tickers=ABI.BR,KBC.BR&max_prediction=0") == ["KBC.BR"]
+        assert flask_client.get("/advice?signal=WAIT").status_code == 400
+        assert flask_client.get("/advice?min_prediction=high").status_code == 400
+
+        for url in ("/advice?signal=buy", "/advice?tickers=ABI.BR,KBC.BR&max_prediction=0", "/advice?signal=WAIT"): # same answers from the ASGI app
+            status, _, body = asgi_get(asgi.app, url)
+            assert status == flask_client.get(url).status_code
+            if status == 200:
+                assert json.loads(body) == flask_client.get(url).get_json()
+
+
+def test_advice_history_endpoint(tmp_path):
+    for day, prediction in enumerate([0.01, -0.02], start=1):
+        append_advice(str(tmp_path / "advice_history.sqlite"), pd.DataFrame({"ticker": ["ABI.BR"], "prediction": [prediction], "advice": ["BUY" if prediction > 0 else "SELL"]}),
+                      model_name="best-model", model_version=day, timestamp=f"2023-09-0{day}")
+
+    with patch.object(serving, "DATAPATH", str(tmp_path)):
+        client = app_module.app.test_client()
+
+        records = client.get("/advice/history?ticker=ABI.BR&from=2023-09-02").get_json()
+        assert records == [{"timestamp": "2023-09-02T00:00:00+00:00", "ticker": "ABI.BR", "model_name": "best-model", "model_version": "2", "prediction": -0.02, "advice": "SELL"}]
+        assert len(client.get("/advice/history").get_json()) == 2
+        assert client.get("/advice/history?from=yesterday-ish").status_code == 400
+
+        status, _, body = asgi_get(asgi.app, "/advice/history?ticker=ABI.BR&from=2023-09-02")
+        assert status == 200 and json.loads(body) == records
@@ -0,0 +1,118 @@
+import os
+import shutil
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+from src.predict.artifact_cache import ArtifactCache, forget_stage, load_registered_model, resolve_stage
+from src.predict.compact_model import load_compact_model
+from src.train_model.online import MODEL_NAME, PREPROCESSOR_NAME, init_state, publish_state
+
+
+@pytest.fixture
+def bars():
+    rng = np.random.default_rng(5)
+    dates = pd.bdate_range("2023-01-02", periods=60, name="Date")
+    frames = []
+    for ticker in ["ABI.BR", "KBC.BR"]:
+        frame = pd.DataFrame({"ticker": ticker, "close_growth": rng.normal(0, 0.01, len(dates))}, index=dates)
+        for lag in range(1, 4):
+            frame[f"close_growth_lag_{lag}"] = frame["close_growth"].shift(lag)
+        frames.append(frame)
+    return pd.concat(frames).sort_index(kind="stable").dropna()
+
+
+def test_registered_versions_are_loaded_locally(tmp_path, bars):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    publish_state(init_state(bars, n_lags_used=2), tracking_uri=tracking_uri, experiment_name="online")
+    cache = ArtifactCache(str(tmp_path / "artifacts"))
+
+    compact, version = load_compact_model(tracking_uri, MODEL_NAME, cache=cache)
+    preprocessor = load_registered_model(tracking_uri, PREPROCESSOR_NAME, cache=cache)
+
+    # Repeated loads of the same version ask neither the registry nor the artifact store
+    with patch.object(MlflowClient, "get_latest_versions", side_effect=AssertionError("registry")), \
+         patch("mlflow.artifacts.download_artifacts", side_effect=AssertionError("download")):
+        same, same_version = load_compact_model(tracking_uri, MODEL_NAME, cache=cache)
+        assert load_registered_model(tracking_uri, PREPROCESSOR_NAME, cache=cache) is not preprocessor # read again from the local copy
+
+    assert same_version == version == "1"
+    np.testing.assert_array_equal(same.predict(bars), compact.predict(bars))
+    assert sorted(os.listdir(tmp_path / "artifacts")) == sorted([MODEL_NAME, PREPROCESSOR_NAME])
+
+    # A new version in the stage is resolved as soon as it is registered
+    publish_state(init_state(bars.iloc[10:], n_lags_used=2), tracking_uri=tracking_uri, experiment_name="online")
+    assert load_compact_model(tracking_uri, MODEL_NAME, cache=cache)[1] == "2"
+
+
+def test_resolve_stage_ttl(tmp_path):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    versions = [SimpleNamespace(name="model", version=1, run_id="a", source="")]
+    with patch.object(MlflowClient, "get_latest_versions", return_value=versions) as get_latest_versions:
+        for _ in range(3):
+            assert resolve_stage(tracking_uri, "model") is versions[0]
+        assert get_latest_versions.call_count == 1
+
+        resolve_stage(tracking_uri, "model", ttl=0) # asks again, the next calls reuse it
+        resolve_stage(tracking_uri, "model")
+        forget_stage(tracking_uri, "model")
+        resolve_stage(tracking_uri, "model")
+        assert get_latest_versions.call_count == 3
+
+    with patch.object(MlflowClient, "get_latest_versions", return_value=[]), pytest.raises(LookupError):
+        resolve_stage(tracking_uri, "other")
+
+
+def test_least_recently_used_versions_are_evicted(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    versions = []
+    for i in range(3):
+        (source / f"model-{i}").mkdir()
+        (source / f"model-{i}" / "model.pkl").write_bytes(bytes(1000))
+        versions.append(SimpleNamespace(name="best-model", version=i + 1, run_id=f"run{i}", source=str(source / f"model-{i}")))
+
+    # Versions used recently, maybe by another process, are kept whatever the size
+    kept = ArtifactCache(str(tmp_path / "kept"), max_bytes=500)
+    assert all(os.path.exists(kept.get(version)) for version in versions)
+    assert len(os.listdir(tmp_path / "kept" / "best-model")) == 3
+
+    cache = ArtifactCache(str(tmp_path / "artifacts"), max_bytes=2500, grace_seconds=0)
+    paths = [cache.get(versions[0]), cache.get(versions[1])]
+    assert all(os.path.exists(os.path.join(path, "model.pkl")) for path in paths)
+
+    time.sleep(0.01) # distinct modification times
+    cache.get(versions[0]) # used again, so the first version is the most recently used
+    time.sleep(0.01)
+    cache.get(versions[2])
+
+    assert sorted(os.listdir(tmp_path / "artifacts" / "best-model")) == ["1-run0", "3-run2"]
+
+
+def test_version_removed_by_another_process_is_downloaded_again(tmp_path):
+    (tmp_path / "model").mkdir()
+    (tmp_path / "model" / "model.pkl").write_bytes(bytes(10))
+    version = SimpleNamespace(name="best-model", version=1, run_id="run", source=str(tmp_path / "model"))
+    cache = ArtifactCache(str(tmp_path / "artifacts"))
+    entry = cache.entry("best-model", 1, "run")
+    utime = os.utime
+
+    def evicted(path, *args, **kwargs):
+        if path == entry and not evicted.done: # another process removes the entry between the check and the use
+            evicted.done = True
+            shutil.rmtree(entry)
+            raise FileNotFoundError(path)
+        return utime(path, *args, **kwargs)
+    evicted.done = False
+
+    path = cache.get(version)
+    with patch("os.utime", side_effect=evicted):
+        assert cache.get(version) == path
+    assert evicted.done and os.path.exists(os.path.join(path, "model.pkl"))
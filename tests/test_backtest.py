@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+
+from src.backtest.backtest import backtest
+
+
+@pytest.fixture
+def market():
+    # Four tickers over 60 business days, one ticker listed later, lags missing at the start like in get_data
+    rng = np.random.default_rng(7)
+    dates = pd.bdate_range("2023-01-02", periods=60, tz="Europe/Brussels", name="Date")
+    frames = []
+    for i, ticker in enumerate(["ABI.BR", "KBC.BR", "UCB.BR", "ARGX.BR"]):
+        growth = 0.001 * i + rng.normal(0, 0.01, len(dates))
+        frame = pd.DataFrame({"ticker": ticker, "close_growth": growth}, index=dates)
+        for lag in range(1, 4):
+            frame[f"close_growth_lag_{lag}"] = frame["close_growth"].shift(lag)
+        frames.append(frame.iloc[25:] if ticker == "ARGX.BR" else frame)
+    return pd.concat(frames)
+
+
+def naive_returns(data, n_lags_used, refit_every, train_window, min_train_dates):
+    # Refit on the rows of every window (the dummies hold the intercept) and trade the next dates, one date at a time
+    dates = np.sort(data.index.unique())
+    lag_columns = [f"close_growth_lag_{i}" for i in range(1, n_lags_used + 1)]
+    tickers = sorted(data["ticker"].unique())
+    complete = data.dropna(subset=["close_growth"] + lag_columns)
+
+    def design(rows):
+        return np.c_[pd.get_dummies(pd.Categorical(rows["ticker"], categories=tickers)).to_numpy(float), rows[lag_columns].to_numpy()]
+
+    returns = []
+    for refit in range(min_train_dates, len(dates), refit_every):
+        first = 0 if train_window is None else max(refit - train_window, 0)
+        train = complete[(complete.index >= dates[first]) & (complete.index < dates[refit])]
+        model = LinearRegression(fit_intercept=False).fit(design(train), train["close_growth"])
+        seen = set(train["ticker"])
+
+        for date in dates[refit:refit + refit_every]:
+            rows = complete[(complete.index == date) & complete["ticker"].isin(seen)]
+            predictions = model.predict(design(rows))
+            returns.append(np.mean(np.where(predictions > 0, 1, -1) * np.expm1(rows["close_growth"].to_numpy())))
+
+    return np.array(returns)
+
+
+@pytest.mark.parametrize("train_window", [None, 15])
+def test_backtest_matches_refitting_every_window(market, train_window):
+    daily, summary = backtest(market, n_lags_used=2, refit_every=5, train_window=train_window, min_train_dates=20)
+
+    np.testing.assert_allclose(daily["return"].to_numpy(), naive_returns(market, 2, 5, train_window, 20), atol=1e-12)
+    assert daily.index[0] == market.index.unique().sort_values()[20]
+    assert summary["n_refits"] == 8 and summary["n_dates"] == 40
+    assert summary["max_drawdown"] == pytest.approx(daily["drawdown"].min())
+    assert summary["total_return"] == pytest.approx(np.prod(1 + daily["return"]) - 1)
+
+
+def test_backtest_hold_band_and_costs(market):
+    daily, summary = backtest(market, n_lags_used=2, buy_threshold=np.inf, sell_threshold=-np.inf)
+    assert summary["n_trades"] == 0 and (daily["return"] == 0).all() # HOLD everywhere: always flat
+
+    long_only, _ = backtest(market, n_lags_used=2, allow_short=False)
+    costly, costly_summary = backtest(market, n_lags_used=2, allow_short=False, cost_bps=10)
+    np.testing.assert_allclose(long_only["return"] - costly["return"], 10 / 1e4 * long_only["turnover"])
+    assert costly_summary["mean_turnover"] > 0
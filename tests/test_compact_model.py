@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import mlflow
+from mlflow.tracking import MlflowClient
+from sklearn.linear_model import LinearRegression
+from sklearn.tree import DecisionTreeRegressor
+
+from src.predict.compact_model import CompactModel, load_compact_model
+from src.train_model.online import MODEL_NAME, PREPROCESSOR_NAME, init_state, publish_state
+from src.train_model.train_model import make_preprocessor
+
+
+@pytest.fixture
+def features():
+    rng = np.random.default_rng(3)
+    features = pd.DataFrame({"ticker": rng.choice(["ABI.BR", "KBC.BR", "UCB.BR"], 200), **{f"close_growth_lag_{i}": rng.normal(0, 0.01, 200) for i in range(1, 4)}})
+    features["close_growth"] = 0.3 * features["close_growth_lag_1"] + features["ticker"].map({"ABI.BR": 0.001, "KBC.BR": 0.0, "UCB.BR": -0.002}) + rng.normal(0, 0.001, 200)
+    return features
+
+
+def test_compact_model_matches_pipeline(tmp_path, features):
+    preprocessor = make_preprocessor(3).fit(features)
+    model = LinearRegression(fit_intercept=False).fit(preprocessor.transform(features), features["close_growth"]) # the dummies span the intercept
+
+    compact = CompactModel.from_pipeline(preprocessor, model)
+    new = features.head(5).assign(ticker=["UCB.BR", "ARGX.BR", "ABI.BR", "KBC.BR", "ARGX.BR"]) # a ticker without dummy
+
+    np.testing.assert_allclose(compact.predict(new), model.predict(preprocessor.transform(new)), atol=1e-12)
+
+    loaded = CompactModel.load(compact.save(str(tmp_path / "compact_model.npz")))
+    np.testing.assert_array_equal(loaded.predict(new), compact.predict(new))
+    assert loaded.lag_columns == ["close_growth_lag_1", "close_growth_lag_2", "close_growth_lag_3"]
+
+    assert CompactModel.from_pipeline(preprocessor, DecisionTreeRegressor().fit(preprocessor.transform(features), features["close_growth"])) is None
+
+
+def test_compact_model_rejects_invalid_features_as_pipeline(features):
+    preprocessor = make_preprocessor(3).fit(features)
+    model = LinearRegression(fit_intercept=False).fit(preprocessor.transform(features), features["close_growth"])
+    compact = CompactModel.from_pipeline(preprocessor, model)
+
+    new = features.head(3)
+    for invalid in [new.assign(close_growth_lag_1=[0.01, np.nan, 0.02]), new.assign(close_growth_lag_2=[0.01, None, 0.02]),
+                    new.assign(close_growth_lag_3=[np.inf, 0.0, 0.0]), new.drop(columns="close_growth_lag_2")]:
+        with pytest.raises(ValueError) as pipeline_error:
+            model.predict(preprocessor.transform(invalid))
+        with pytest.raises(ValueError) as compact_error:
+            compact.predict(invalid)
+        assert str(pipeline_error.value).startswith(str(compact_error.value))
+
+
+def test_load_compact_model(tmp_path, features):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    data = features.set_index(pd.bdate_range("2023-01-02", periods=len(features), name="Date"))
+
+    publish_state(init_state(data, n_lags_used=2), tracking_uri=tracking_uri, experiment_name="online") # registers with `register_run`
+    compact, version = load_compact_model(tracking_uri, MODEL_NAME)
+
+    preprocessor = mlflow.sklearn.load_model(f"models:/{PREPROCESSOR_NAME}/Production")
+    model = mlflow.sklearn.load_model(f"models:/{MODEL_NAME}/Production")
+    assert version == "1"
+    np.testing.assert_allclose(compact.predict(features), model.predict(preprocessor.transform(features)).reshape(-1), atol=1e-12)
+
+    # A version registered before compact models were logged
+    with mlflow.start_run() as run:
+        mlflow.sklearn.log_model(model, "model")
+    mlflow.register_model(f"runs:/{run.info.run_id}/model", "other-model")
+    MlflowClient(tracking_uri=tracking_uri).transition_model_version_stage("other-model", 1, "Production")
+
+    assert load_compact_model(tracking_uri, "other-model") == (None, "1")
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from src.data.features import build_features
+
+
+def build_features_groupby(data, n_lags):
+    data = data.copy()
+    data["close_previous_day"] = data.groupby("ticker")["Close"].shift(1)
+    data["close_growth"] = np.log(data["Close"]) - np.log(data["close_previous_day"])
+    data.rename(columns={"Close": "close"}, inplace=True)
+    for i in range(1, n_lags + 1):
+        data[f"close_growth_lag_{i}"] = data.groupby("ticker")["close_growth"].shift(i)
+    return data.filter(regex="ticker|Date|close")
+
+
+def test_build_features_matches_groupby():
+    rng = np.random.default_rng(0)
+    frames = []
+    for ticker, periods in [("AAPL", 40), ("SHORT", 3), ("GOOG", 25)]: # SHORT has fewer bars than lags
+        index = pd.date_range("2023-01-01", periods=periods, tz="Europe/Brussels", name="Date")
+        frames.append(pd.DataFrame({"Close": rng.uniform(10, 20, periods), "Volume": 1, "ticker": ticker}, index=index))
+    data = pd.concat(frames)
+
+    expected = build_features_groupby(data, n_lags=5)
+    pd.testing.assert_frame_equal(build_features(data, n_lags=5), expected)
+
+    # Unsorted input is laid out per ticker (in order of appearance), then by date
+    shuffled = build_features(data.sample(frac=1, random_state=0), n_lags=5)
+    pd.testing.assert_frame_equal(shuffled.sort_values("ticker", kind="stable"), expected.sort_values("ticker", kind="stable"))
@@ -0,0 +1,31 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from src.data.feature_cache import write_feature_cache
+from src.data.fingerprint import fingerprint, task_cache_key
+
+
+def test_cache_key_follows_content(tmp_path):
+    data = pd.DataFrame({"ticker": ["ABI.BR", "KBC.BR"], "close_growth": [0.01, -0.02]}, index=pd.DatetimeIndex(["2023-09-01"] * 2, name="Date"))
+    context = SimpleNamespace(task=SimpleNamespace(name="train_test_split_task"))
+
+    data_name = write_feature_cache(data, str(tmp_path / "features"))
+    key = task_cache_key(context, {"data_name": data_name, "train_ratio": 0.8})
+
+    time.sleep(0.01)
+    write_feature_cache(data, data_name) # an off-hours run rewrites the same bars
+    assert task_cache_key(context, {"data_name": data_name, "train_ratio": 0.8}) == key
+    assert task_cache_key(context, {"data_name": data_name, "train_ratio": 0.7}) != key
+    assert task_cache_key(SimpleNamespace(task=SimpleNamespace(name="model_monitoring")), {"data_name": data_name, "train_ratio": 0.8}) != key
+
+    before = fingerprint(data_name)
+    write_feature_cache(data.assign(close_growth=[0.01, -0.03]), data_name)
+    assert fingerprint(data_name) != before
+    assert task_cache_key(context, {"data_name": data_name, "train_ratio": 0.8}) != key
+
+    frame_key = task_cache_key(context, {"X_train": data, "max_lags_used": 10})
+    assert task_cache_key(context, {"X_train": data.copy(), "max_lags_used": 10}) == frame_key
+    assert task_cache_key(context, {"X_train": data.assign(close_growth=np.nan), "max_lags_used": 10}) != frame_key
@@ -0,0 +1,105 @@
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.get_data import get_data, update_price_store
+from src.data.storage import read_dataset
+from src.data.price_store import append_bars, last_bar, read_bars
+from src.data.providers import MarketDataProvider, ReplayProvider, write_replay_data
+
+
+def make_bars(start, periods):
+    index = pd.date_range(start=start, periods=periods, freq="D", tz="Europe/Brussels", name="Date")
+    close = np.linspace(10, 20, periods)
+    return pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close, "Volume": 100}, index=index)
+
+
+def test_append_bars_only_adds_tail(tmp_path):
+    store_path = str(tmp_path)
+
+    assert append_bars(store_path, "AAPL", make_bars("2023-01-20", 20)) == 20
+    assert last_bar(store_path, "AAPL") == pd.Timestamp("2023-02-08", tz="Europe/Brussels")
+
+    # Overlapping download: the last stored bar is refreshed, only 5 bars are new
+    assert append_bars(store_path, "AAPL", make_bars("2023-02-08", 6)) == 5
+
+    bars = read_bars(store_path)
+    assert len(bars) == 25
+    assert bars.index.is_unique
+    assert (bars["ticker"] == "AAPL").all()
+
+
+def test_read_bars_date_range(tmp_path):
+    store_path = str(tmp_path)
+    append_bars(store_path, "AAPL", make_bars("2023-01-01", 90))
+    append_bars(store_path, "GOOG", make_bars("2023-01-01", 90))
+
+    bars = read_bars(store_path, tickers=["GOOG"], start="2023-02-10", end="2023-02-20")
+
+    assert len(bars) == 11
+    assert bars.index.min() == pd.Timestamp("2023-02-10", tz="Europe/Brussels")
+    assert set(bars["ticker"]) == {"GOOG"}
+
+
+def test_get_data_fetches_missing_tail(tmp_path):
+    calls = []
+
+    class FakeTicker:
+        def __init__(self, ticker):
+            self.ticker = ticker
+
+        def history(self, period=None, start=None):
+            calls.append((self.ticker, period, start))
+            return make_bars("2023-01-01", 30) if start is None else make_bars(start, 3)
+
+    with patch("src.data.providers.yf.Ticker", FakeTicker):
+        get_data(["AAPL", "GOOG"], str(tmp_path), length_of_data="60d", n_lags=2)
+        data_name = get_data(["AAPL", "GOOG"], str(tmp_path), length_of_data="60d", n_lags=2)
+
+    assert sorted(calls[2:]) == [("AAPL", None, "2023-01-30"), ("GOOG", None, "2023-01-30")] # fetched concurrently, in any order
+
+    data = read_dataset(data_name)
+    assert len(data) == 2 * 32
+    assert data.filter(like="close_growth").columns.tolist() == ["close_growth", "close_growth_lag_1", "close_growth_lag_2"]
+    assert data.groupby("ticker")["close_growth_lag_2"].apply(lambda x: x.isna().sum()).eq(3).all()
+
+
+def test_get_data_concurrent_partial_failure(tmp_path):
+    attempts = {}
+
+    class StubProvider(MarketDataProvider):
+        def history(self, ticker, period=None, start=None):
+            attempts[ticker] = attempts.get(ticker, 0) + 1
+            time.sleep(0.2)
+            if ticker == "BROKEN" or (ticker == "FLAKY" and attempts[ticker] == 1):
+                raise ConnectionError(ticker)
+            return make_bars("2023-01-01", 30)
+
+    tickers = [f"T{i}" for i in range(8)] + ["FLAKY", "BROKEN"]
+
+    start = time.perf_counter()
+    n_new_bars, failures = update_price_store(tickers, str(tmp_path), max_workers=10, retries=1, backoff_seconds=0.01, provider=StubProvider())
+    elapsed = time.perf_counter() - start
+
+    assert n_new_bars == 9 * 30
+    assert list(failures) == ["BROKEN"]
+    assert attempts["FLAKY"] == 2 and attempts["BROKEN"] == 2
+    assert elapsed < 8 * 0.2 # downloads overlap instead of running one after the other
+
+
+def test_get_data_replay_provider(tmp_path):
+    tickers = write_replay_data(str(tmp_path / "replay"), n_tickers=5, n_days=100, end="2023-06-30")
+
+    provider = ReplayProvider(str(tmp_path / "replay"), end="2023-05-31")
+    get_data(tickers, str(tmp_path), length_of_data="60d", n_lags=3, provider=provider)
+
+    provider.end = "2023-06-30" # replay the next month: only the tail is served
+    data_name = get_data(tickers, str(tmp_path), length_of_data="60d", n_lags=3, provider=provider)
+
+    data = read_dataset(data_name)
+    assert provider.list_tickers() == tickers
+    assert data.index.max() == pd.Timestamp("2023-06-30", tz="Europe/Brussels")
+    assert set(data["ticker"]) == set(tickers)
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from src.predict.history import append_advice, features_hash, read_history, read_predictions
+
+
+@pytest.fixture
+def history_path(tmp_path):
+    # Three hourly runs for two tickers
+    path = str(tmp_path / "advice_history.sqlite")
+    for hour, prediction in enumerate([0.01, -0.02, 0.03]):
+        advice = pd.DataFrame({"ticker": ["ABI.BR", "KBC.BR"], "prediction": [prediction, -prediction]})
+        advice["advice"] = advice["prediction"].map(lambda x: "BUY" if x > 0 else "SELL")
+        append_advice(path, advice, model_name="best-model-2023-09-01", model_version=hour + 1, timestamp=f"2023-09-01 0{hour}:00")
+    return path
+
+
+def test_read_history_ranges(history_path):
+    history = read_history(history_path, ticker="KBC.BR", start="2023-09-01 01:00", end="2023-09-01 02:00")
+
+    assert history["ticker"].tolist() == ["KBC.BR", "KBC.BR"]
+    assert history["prediction"].tolist() == [0.02, -0.03]
+    assert history["advice"].tolist() == ["BUY", "SELL"]
+    assert history["model_version"].tolist() == ["2", "3"]
+    assert history["timestamp"].tolist() == [pd.Timestamp("2023-09-01 01:00", tz="UTC"), pd.Timestamp("2023-09-01 02:00", tz="UTC")]
+
+    assert len(read_history(history_path)) == 6
+    assert read_history(history_path, limit=3)["timestamp"].dt.hour.tolist() == [1, 2, 2] # the most recent rows, in time order
+    assert read_history(history_path, ticker="ABI.BR", start="2023-09-01T01:30:00+02:00")["prediction"].tolist() == [0.01, -0.02, 0.03]
+    assert read_history(history_path + ".missing").empty
+
+
+def test_rerun_replaces_rows_and_queries_use_indexes(history_path):
+    advice = pd.DataFrame({"ticker": ["ABI.BR"], "prediction": [0.5], "advice": ["BUY"]})
+    append_advice(history_path, advice, model_version=4, timestamp="2023-09-01 02:00")
+
+    assert read_history(history_path, ticker="ABI.BR")["prediction"].tolist() == [0.01, -0.02, 0.5]
+
+    connection = sqlite3.connect(history_path)
+    plans = [" ".join(row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN SELECT * FROM advice WHERE {where}"))
+             for where in ("ticker = 'ABI.BR' AND ts >= 0 AND ts <= 1", "ts >= 0 AND ts <= 1")]
+    connection.close()
+
+    assert all("SEARCH" in plan for plan in plans)
+
+
+def test_prediction_log_on_an_existing_history(tmp_path):
+    # History written before the prediction log: no date or features_hash columns
+    path = str(tmp_path / "advice_history.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE advice (ticker TEXT NOT NULL, ts INTEGER NOT NULL, model_name TEXT, model_version TEXT, prediction REAL, advice TEXT, PRIMARY KEY (ticker, ts)) WITHOUT ROWID")
+    connection.execute("INSERT INTO advice VALUES ('ABI.BR', 0, NULL, '1', 0.1, 'BUY')")
+    connection.commit()
+    connection.close()
+
+    assert read_predictions(path).empty
+
+    features = pd.DataFrame({"ticker": ["ABI.BR", "KBC.BR"], "close_growth_lag_1": [0.01, -0.01], "close_growth_lag_2": [0.02, 0.0]},
+                            index=pd.DatetimeIndex(["2023-09-01"] * 2, tz="Europe/Brussels", name="Date"))
+    for hour, (prediction, hashes) in enumerate([(0.3, ["a", "b"]), (0.4, features_hash(features)), (0.5, features_hash(features))]):
+        advice = pd.DataFrame({"ticker": features["ticker"].to_numpy(), "prediction": prediction, "advice": "BUY", "date": features.index, "features_hash": hashes})
+        append_advice(path, advice, model_version=hour + 1, timestamp=f"2023-09-01 1{hour}:00")
+
+    predictions = read_predictions(path, start="2023-08-31 22:00")
+    hashes = features_hash(features)
+
+    assert len(read_history(path)) == 7
+    assert {(ticker, features): (prediction, version) for ticker, features, prediction, version
+            in zip(predictions["ticker"], predictions["features_hash"], predictions["prediction"], predictions["model_version"])} == {
+        ("ABI.BR", "a"): (0.3, "1"), ("KBC.BR", "b"): (0.3, "1"), ("ABI.BR", hashes[0]): (0.5, "3"), ("KBC.BR", hashes[1]): (0.5, "3")} # the last run per features
+    assert (predictions["date"] == pd.Timestamp("2023-08-31 22:00", tz="UTC")).all()
+    assert read_predictions(path, start="2023-09-01").empty
@@ -0,0 +1,77 @@
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from src.data.storage import read_dataset, write_dataset
+from src.monitoring.evidently_monitoring import add_report, compact_workspace, get_reference_data, list_reports, load_report_snapshot, open_workspace_project
+
+
+def _frame(n, shift=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({"ticker": rng.choice(["ABI.BR", "KBC.BR"], n), "close_growth_lag_1": rng.normal(shift, 1, n), "close_growth": rng.normal(shift, 1, n)})
+    return frame.assign(target=frame["close_growth"], prediction=0.5 * frame["close_growth_lag_1"])
+
+
+def test_compact_workspace(tmp_path):
+    project_id, workspace = open_workspace_project(str(tmp_path / "workspace"))
+    add_report(workspace, project_id, _frame(300), _frame(100, seed=1))
+    add_report(workspace, project_id, _frame(300), _frame(100, shift=2.0, seed=2))
+    project = workspace.get_project(project_id)
+    reports = [load_report_snapshot(project, snapshot.id) for snapshot in sorted(list_reports(project), key=lambda snapshot: snapshot.timestamp)]
+    for report in reports:
+        workspace.delete_snapshot(project_id, report.id)
+
+    # Hourly reports: two on each of two days over two weeks ago, two in a week 100 days ago, one recent
+    now = pd.Timestamp("2024-06-01 12:00")
+    times = ["2024-05-14 08:00", "2024-05-14 09:00", "2024-05-15 08:00", "2024-05-15 09:00", "2024-02-20 08:00", "2024-02-22 08:00", "2024-05-31 08:00"]
+    for i, time in enumerate(times):
+        workspace.add_snapshot(project_id, reports[i % 2].copy(update={"id": uuid.uuid4(), "timestamp": pd.Timestamp(time).to_pydatetime()}))
+
+    folder = tmp_path / "workspace" / str(project_id) / "snapshots"
+    size = sum(path.stat().st_size for path in folder.iterdir())
+
+    assert compact_workspace(workspace, project_id, full_days=7, daily_days=90, now=now) == 3
+    assert compact_workspace(workspace, project_id, full_days=7, daily_days=90, now=now) == 0 # already merged
+
+    snapshots = {f"{snapshot.timestamp:%Y-%m-%d %H:%M}": snapshot for snapshot in list_reports(workspace.get_project(project_id))}
+    assert sorted(snapshots) == ["2024-02-22 08:00", "2024-05-14 09:00", "2024-05-15 09:00", "2024-05-31 08:00"]
+    assert "compacted" not in snapshots["2024-05-31 08:00"].metadata
+    assert {name: (snapshot.metadata["compacted"], snapshot.metadata["snapshots"]) for name, snapshot in snapshots.items() if name != "2024-05-31 08:00"} == {
+        "2024-02-22 08:00": ("week", "2"), "2024-05-14 09:00": ("day", "2"), "2024-05-15 09:00": ("day", "2")}
+
+    # The summary of a period covers both reports, whose target drifted in one only
+    metadata = snapshots["2024-05-14 09:00"].metadata
+    assert float(metadata["min"]["MAPE"]) <= float(metadata["mean"]["MAPE"]) <= float(metadata["max"]["MAPE"])
+    assert float(metadata["min"]["Drift Score"]) < float(metadata["max"]["Drift Score"])
+    assert sum(path.stat().st_size for path in folder.iterdir()) < size / 4
+
+    # Merged days become weeks once old enough, the dashboard still reads the kept metrics
+    assert compact_workspace(workspace, project_id, full_days=7, daily_days=10, now=now) == 1
+    week = [snapshot for snapshot in list_reports(workspace.get_project(project_id)) if snapshot.metadata.get("compacted") == "week"]
+    assert sorted(snapshot.metadata["snapshots"] for snapshot in week) == ["2", "4"]
+    assert workspace.get_project(project_id).build_dashboard_info(None, None).widgets
+
+
+def test_rolling_reference(tmp_path):
+    dates = pd.bdate_range("2023-01-02", periods=40, tz="Europe/Brussels", name="Date")
+    data = pd.DataFrame({"ticker": "ABI.BR", "close_growth": np.linspace(0, 1, len(dates))}, index=dates)
+    data_name = write_dataset(data, str(tmp_path / "BEL_20.parquet"))
+
+    first = get_reference_data(str(tmp_path), data_name=data_name, reference_days=14, pin="model-1", keep=2)
+    assert read_dataset(first).index.min() == dates[-1] - pd.Timedelta(days=14)
+
+    write_dataset(data.iloc[:30], data_name) # a pinned reference is not taken again for new data
+    assert get_reference_data(str(tmp_path), data_name=data_name, reference_days=14, pin="model-1", keep=2) == first
+    assert len(read_dataset(first)) == 11
+    os.utime(first, (0, 1e9 + 1))
+
+    for version in (2, 3):
+        latest = get_reference_data(str(tmp_path), data_name=data_name, reference_days=14, pin=f"model-{version}", keep=2)
+        os.utime(latest, (0, 1e9 + version)) # distinct modification times
+    assert read_dataset(latest).index.max() == dates[29]
+    assert sorted(os.listdir(tmp_path / "references")) == ["BEL_20_reference-model-2.parquet", "BEL_20_reference-model-3.parquet"]
+
+    # Without a pin, the reference rolls with the date of the last bar
+    assert get_reference_data(str(tmp_path), data_name=data_name, reference_days=14).endswith(f"BEL_20_reference-{dates[29]:%Y-%m-%d}.parquet")
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+from mlflow.tracking import MlflowClient
+
+from src.data.feature_cache import write_feature_cache
+from src.predict.compact_model import load_compact_model
+from src.train_model.online import MODEL_NAME, fold_in, full_retrain_time, init_state, load_state, prediction_mse, save_state, solve_state, start_online_model, update_online_model
+
+
+@pytest.fixture
+def bars():
+    # Three tickers over 60 business days, a fourth one listed after 45 days
+    rng = np.random.default_rng(5)
+    dates = pd.bdate_range("2023-01-02", periods=60, tz="Europe/Brussels", name="Date")
+    frames = []
+    for i, ticker in enumerate(["ABI.BR", "KBC.BR", "UCB.BR", "ARGX.BR"]):
+        frame = pd.DataFrame({"ticker": ticker, "close_growth": 0.002 * i + rng.normal(0, 0.01, len(dates))}, index=dates)
+        for lag in range(1, 4):
+            frame[f"close_growth_lag_{lag}"] = frame["close_growth"].shift(lag)
+        frames.append(frame.iloc[45:] if ticker == "ARGX.BR" else frame)
+    return pd.concat(frames).sort_index(kind="stable")
+
+
+def test_fold_in_matches_full_fit(bars):
+    cut = bars.index.unique()[40]
+    state = init_state(bars[bars.index <= cut], n_lags_used=2)
+    folded = fold_in(state, bars) # rows already in the state are skipped
+    full = init_state(bars, n_lags_used=2)
+
+    assert folded["tickers"].tolist() == full["tickers"].tolist() == ["ABI.BR", "ARGX.BR", "KBC.BR", "UCB.BR"]
+    assert folded["last_date"][0] == full["last_date"][0]
+    for name in ("counts", "dummy_lags", "lag_lags", "dummy_y", "lag_y", "y_y"):
+        np.testing.assert_allclose(folded[name], full[name], atol=1e-12)
+
+    # Same fit and residuals as a regression on the ticker dummies and lags
+    effects, lag_coefficients, n, mse = solve_state(folded)
+    complete = bars.dropna(subset=["close_growth_lag_1", "close_growth_lag_2"])
+    X = np.c_[pd.get_dummies(complete["ticker"]).sort_index(axis=1).to_numpy(float), complete[["close_growth_lag_1", "close_growth_lag_2"]].to_numpy()]
+    coefficients, residuals = np.linalg.lstsq(X, complete["close_growth"].to_numpy(), rcond=None)[:2]
+
+    np.testing.assert_allclose(np.r_[effects, lag_coefficients], coefficients, atol=1e-10)
+    assert n == len(complete)
+    assert mse == pytest.approx(residuals[0] / n)
+    assert prediction_mse(folded, complete) == pytest.approx(mse)
+
+
+def test_refetched_last_bar_matches_full_fit(bars):
+    dates = bars.index.unique()
+    partial = bars.copy()
+    partial.loc[partial.index == dates[40], "close_growth"] *= 0.5 # intraday bar, completed by the next runs
+
+    state = init_state(partial[partial.index <= dates[40]], n_lags_used=2)
+    refetched = fold_in(state, bars[bars.index <= dates[40]]) # same date, the completed bar replaces the partial one
+    full = init_state(bars[bars.index <= dates[40]], n_lags_used=2)
+    for name in ("counts", "dummy_lags", "lag_lags", "dummy_y", "lag_y", "y_y", "pending_counts", "pending_dummy_y"):
+        np.testing.assert_allclose(refetched[name], full[name], atol=1e-12)
+    assert fold_in(refetched, bars[bars.index <= dates[40]]) is refetched # refetched unchanged
+
+    # A partial bar folded in by an update, completed once the next bars arrive
+    updated = fold_in(init_state(bars[bars.index <= dates[30]], n_lags_used=2), partial[partial.index <= dates[40]])
+    folded = fold_in(updated, bars)
+    full = init_state(bars, n_lags_used=2)
+    assert folded["last_date"][0] == full["last_date"][0]
+    for name in ("counts", "dummy_lags", "lag_lags", "dummy_y", "lag_y", "y_y"):
+        np.testing.assert_allclose(folded[name], full[name], atol=1e-12)
+
+
+def test_update_online_model(tmp_path, bars):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    state_path = str(tmp_path / "online_model.npz")
+    data_name = write_feature_cache(bars, str(tmp_path / "features"))
+    now = "2023-03-27"
+
+    assert update_online_model(data_name, state_path, tracking_uri, "online", now=now) == "no state"
+    assert full_retrain_time(state_path) is None
+
+    save_state(init_state(bars[bars.index < "2023-03-20"], n_lags_used=2, trained_at="2023-03-20"), state_path)
+    assert update_online_model(data_name, state_path, tracking_uri, "online", now="2023-04-01") == "schedule"
+
+    assert update_online_model(data_name, state_path, tracking_uri, "online", now=now) == "updated"
+    assert load_state(state_path)["last_date"][0] == bars.index.max().isoformat()
+    assert full_retrain_time(state_path) == pd.Timestamp("2023-03-20", tz="UTC") # the same for every online update
+    assert [str(version.version) for version in MlflowClient(tracking_uri=tracking_uri).get_latest_versions(MODEL_NAME, stages=["Production"])] == ["1"]
+
+    assert update_online_model(data_name, state_path, tracking_uri, "online", now=now) == "unchanged" # the last bar is refetched but did not change
+
+    shocked = bars.copy()
+    shocked.loc[shocked.index == shocked.index.max(), "close_growth"] = 0.5 # a crash the model never saw
+    save_state(init_state(bars[bars.index < bars.index.max()], n_lags_used=2, trained_at="2023-03-20"), state_path)
+    assert update_online_model(write_feature_cache(shocked, str(tmp_path / "shocked")), state_path, tracking_uri, "online", now=now) == "drift"
+
+
+def test_start_online_model_publishes_the_state(tmp_path, bars):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    state_path = str(tmp_path / "online_model.npz")
+    data_name = write_feature_cache(bars, str(tmp_path / "features"))
+
+    start_online_model(data_name, state_path, n_lags_used=2, tracking_uri=tracking_uri, experiment_name="online")
+
+    # The model in production is the one of the state, so no bar means no new version
+    compact, version = load_compact_model(tracking_uri, MODEL_NAME)
+    effects, lag_coefficients, _, _ = solve_state(load_state(state_path))
+    complete = bars.dropna(subset=["close_growth_lag_1", "close_growth_lag_2"])
+    expected = pd.Series(effects, index=["ABI.BR", "ARGX.BR", "KBC.BR", "UCB.BR"])[complete["ticker"]].to_numpy() + complete[["close_growth_lag_1", "close_growth_lag_2"]].to_numpy() @ lag_coefficients
+    np.testing.assert_allclose(compact.predict(complete), expected, atol=1e-12)
+
+    assert update_online_model(data_name, state_path, tracking_uri, "online", now=pd.Timestamp.now(tz="UTC")) == "unchanged"
+    assert version == "1" and len(MlflowClient(tracking_uri=tracking_uri).search_model_versions(f"name='{MODEL_NAME}'")) == 1
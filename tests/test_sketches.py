@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import patch
+
+from src.data.storage import write_dataset
+from src.monitoring.evidently_monitoring import monitor_data
+from src.predict.advice import modify_data
+from src.predict.compact_model import load_compact_model
+from src.predict.history import append_advice, features_hash
+from src.monitoring.sketches import build_reference_sketch, empty_window, update_window, window_drift, window_quality
+from src.train_model.online import MODEL_NAME, PREPROCESSOR_NAME, init_state, publish_state
+
+
+@pytest.fixture
+def bars():
+    # Three tickers over 80 business days
+    rng = np.random.default_rng(7)
+    dates = pd.bdate_range("2023-01-02", periods=80, tz="Europe/Brussels", name="Date")
+    frames = []
+    for i, ticker in enumerate(["ABI.BR", "KBC.BR", "UCB.BR"]):
+        frame = pd.DataFrame({"ticker": ticker, "close_growth": 0.002 * i + rng.normal(0, 0.01, len(dates))}, index=dates)
+        for lag in range(1, 4):
+            frame[f"close_growth_lag_{lag}"] = frame["close_growth"].shift(lag)
+        frames.append(frame)
+    return pd.concat(frames).sort_index(kind="stable").dropna()
+
+
+def _scored(data, shift=0.0):
+    return data.assign(target=data["close_growth"] + shift, prediction=0.5 * data["close_growth_lag_1"] + shift)
+
+
+def test_drift(bars):
+    columns = ["close_growth_lag_1", "target", "prediction"]
+    sketch, sample = build_reference_sketch(_scored(bars), columns, n_bins=10, sample_size=50)
+
+    assert len(sample) == 50 and sample.index.is_monotonic_increasing
+    assert sketch["counts"].sum(axis=1).tolist() == [len(bars)] * 3
+
+    same = window_drift(sketch, update_window(empty_window(sketch), sketch, _scored(bars), window_dates=1000))
+    assert same["psi"].max() == pytest.approx(0.0, abs=1e-12) and not same["drifted"].any()
+
+    shifted = window_drift(sketch, update_window(empty_window(sketch), sketch, _scored(bars, shift=0.05), window_dates=1000))
+    assert shifted.loc[["target", "prediction"], "drifted"].all() and not shifted.loc["close_growth_lag_1", "drifted"]
+
+
+def test_update_window_matches_batch(bars):
+    rows = _scored(bars)
+    sketch, _ = build_reference_sketch(rows, ["close_growth_lag_1", "target", "prediction"], n_bins=10)
+    dates = rows.index.unique()
+
+    window = empty_window(sketch)
+    for first, last in [(0, 30), (30, 31), (31, len(dates))]: # new bars in several runs
+        window = update_window(window, sketch, rows[(rows.index >= dates[first]) & (rows.index <= dates[last - 1])], window_dates=20)
+
+    recent = rows[rows.index >= dates[-20]]
+    batch = update_window(empty_window(sketch), sketch, recent, window_dates=20)
+
+    assert len(window["dates"]) == 20
+    for name in batch:
+        np.testing.assert_allclose(window[name], batch[name])
+
+    errors = recent["target"] - recent["prediction"]
+    quality = window_quality(window)
+    assert quality["n"] == len(recent)
+    assert quality["rmse"] == pytest.approx(np.sqrt(np.mean(errors ** 2)))
+    assert quality["mape"] == pytest.approx(np.mean(np.abs(errors) / np.abs(recent["target"])))
+
+
+def test_monitor_data(tmp_path, bars):
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    history_path = str(tmp_path / "advice_history.sqlite")
+    dates = bars.index.unique()
+    ref_data_name = write_dataset(bars[bars.index < dates[40]], str(tmp_path / "reference.parquet"))
+    publish_state(init_state(bars[bars.index < dates[40]], n_lags_used=2), tracking_uri=tracking_uri, experiment_name="online")
+
+    def monitor(data):
+        data_name = write_dataset(data, str(tmp_path / "data.parquet"))
+        return monitor_data(data_name, ref_data_name, str(tmp_path), tracking_uri, MODEL_NAME, PREPROCESSOR_NAME, window_dates=10, sample_size=30, history_path=history_path)
+
+    # Nothing logged yet: the rows are scored with the model
+    sample, rows, drift, quality, version = monitor(bars[bars.index < dates[60]])
+    assert len(sample) == 30 and "prediction" in sample
+    assert rows.index.unique().tolist() == dates[50:60].tolist()
+    assert drift.index.tolist() == ["close_growth_lag_1", "close_growth_lag_2", "close_growth_lag_3", "target", "prediction"]
+    assert quality["n"] == len(rows)
+
+    # Predictions logged by the next runs, from the features of the latest bar
+    for i, date in enumerate(dates[59:-1]):
+        features = modify_data(write_dataset(bars[bars.index <= date], str(tmp_path / "latest.parquet")))
+        advice = pd.DataFrame({"ticker": features["ticker"].to_numpy(), "prediction": 0.001 * i, "advice": "BUY",
+                               "date": features.index, "features_hash": features_hash(features)})
+        append_advice(history_path, advice, model_version=1, timestamp=date + pd.Timedelta(hours=18))
+        stale = advice.assign(prediction=1.0, features_hash="0") # an earlier run on a bar that was still changing
+        append_advice(history_path, stale, model_version=1, timestamp=date + pd.Timedelta(hours=12))
+
+    # Only the new bars are read, joined with the logged predictions without loading the model
+    with patch("mlflow.pyfunc.load_model", side_effect=AssertionError("model loaded")):
+        _, rows, _, quality, same_version = monitor(bars)
+
+    assert same_version == version
+    assert rows.index.unique().tolist() == dates[-10:].tolist()
+    new = rows[rows.index >= dates[60]]
+    np.testing.assert_allclose(new["prediction"], 0.001 * (pd.Index(dates).get_indexer(new.index) - 60))
+    assert quality["n"] == len(rows)
+
+    # A new reference starts from the rows of the previous window, the files of the older one are removed
+    new_reference = write_dataset(bars[bars.index < dates[50]], str(tmp_path / "reference-2.parquet"))
+    with patch("mlflow.pyfunc.load_model", side_effect=AssertionError("model loaded")), patch("mlflow.sklearn.load_model", side_effect=AssertionError("model loaded")):
+        seeded_sample, seeded, _, seeded_quality, new_version = monitor_data(str(tmp_path / "data.parquet"), new_reference, str(tmp_path), tracking_uri, MODEL_NAME, PREPROCESSOR_NAME,
+                                                                            window_dates=10, sample_size=30, history_path=history_path, keep=1) # scored with the compact model
+    assert new_version != version
+    pd.testing.assert_frame_equal(seeded, rows)
+    assert seeded_quality == quality
+    assert sorted(os.listdir(tmp_path / "monitoring")) == [f"{name}-{new_version}.{extension}" for name in ("reference", "window") for extension in ("npz", "parquet")]
+
+    # A new model in the stage only scores the sample of the same reference again
+    publish_state(init_state(bars[bars.index < dates[50]], n_lags_used=3), tracking_uri=tracking_uri, experiment_name="online")
+    rescored, same_rows, _, _, same_reference = monitor_data(str(tmp_path / "data.parquet"), new_reference, str(tmp_path), tracking_uri, MODEL_NAME, PREPROCESSOR_NAME,
+                                                             window_dates=10, sample_size=30, history_path=history_path, keep=1)
+    assert same_reference == new_version
+    assert not np.allclose(rescored["prediction"], seeded_sample["prediction"])
+    np.testing.assert_allclose(rescored["prediction"], load_compact_model(tracking_uri, MODEL_NAME)[0].predict(rescored))
+    pd.testing.assert_frame_equal(same_rows, rows) # the logged predictions of the window are kept
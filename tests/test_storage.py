@@ -0,0 +1,91 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.data.feature_cache import write_feature_cache
+from src.data.storage import read_dataset, read_latest, write_dataset
+
+
+def backed_by_file(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def test_read_projection(tmp_path):
+    dates = pd.date_range("2023-01-01", periods=30, tz="Europe/Brussels", name="Date")
+    data = pd.DataFrame(
+        {
+            "close": np.arange(60.0),
+            "ticker": ["AAPL", "GOOG"] * 30,
+            "close_growth": np.arange(60.0),
+            "close_growth_lag_1": np.arange(60.0),
+        },
+        index=dates.repeat(2),
+    )
+    path = write_dataset(data, str(tmp_path / "data.parquet"))
+
+    latest = read_latest(path, regex="ticker|close_growth")
+    assert latest.columns.tolist() == ["ticker", "close_growth", "close_growth_lag_1"]
+    assert (latest.index == dates[-1]).all() and len(latest) == 2
+
+    window = read_dataset(path, columns=["close"], start="2023-01-10", end="2023-01-12")
+    assert window["close"].tolist() == [18.0, 19.0, 20.0, 21.0, 22.0, 23.0]
+
+    pd.testing.assert_frame_equal(read_dataset(path), data)
+
+
+def test_feature_cache_matches_parquet(tmp_path):
+    dates = pd.date_range("2023-03-20", periods=20, tz="Europe/Brussels", name="Date") # spans a DST change
+    data = pd.DataFrame(
+        {
+            "close": np.arange(40.0),
+            "ticker": ["GOOG", "AAPL"] * 20,
+            "close_growth": np.arange(40.0) / 10,
+            "close_growth_lag_1": np.arange(40.0) / 100,
+        },
+        index=dates.repeat(2),
+    )
+    parquet_path = write_dataset(data, str(tmp_path / "data.parquet"))
+    cache_path = write_feature_cache(data, str(tmp_path / "data.features"))
+
+    for kwargs in [{}, {"regex": "ticker|close_growth"}, {"columns": ["close"], "start": "2023-03-25", "end": "2023-03-27"}]:
+        cached = read_dataset(cache_path, **kwargs)
+        expected = read_dataset(parquet_path, **kwargs)
+        if "ticker" in cached:
+            cached["ticker"] = cached["ticker"].astype(object)
+        pd.testing.assert_frame_equal(cached, expected)
+
+    latest = read_latest(cache_path, regex="close_growth")
+    assert backed_by_file(latest["close_growth"].to_numpy()) # a view on the file, not a copy
+    assert (latest.index == dates[-1]).all() and latest.columns.tolist() == ["close_growth", "close_growth_lag_1"]
+
+
+def test_feature_cache_rewrite_keeps_readers_consistent(tmp_path):
+    dates = pd.bdate_range("2023-09-01", periods=10, name="Date")
+    data = pd.DataFrame({"ticker": ["ABI.BR", "KBC.BR"] * 10, "close_growth": np.arange(20.0)}, index=dates.repeat(2))
+    cache_path = write_feature_cache(data, str(tmp_path / "data.features"))
+
+    opened = read_dataset(cache_path) # memory-mapped before the rewrite
+    with open(tmp_path / "data.features" / "meta.json") as meta_file:
+        meta = json.load(meta_file) # a reader that read the meta just before the rewrite
+
+    longer = pd.DataFrame({"ticker": ["UCB.BR", "ABI.BR", "KBC.BR"] * 12, "close_growth": -np.arange(36.0)}, index=pd.bdate_range("2023-09-01", periods=12, name="Date").repeat(3))
+    write_feature_cache(longer, cache_path)
+
+    assert opened["ticker"].astype(object).tolist() == data["ticker"].tolist()
+    np.testing.assert_array_equal(opened["close_growth"], data["close_growth"])
+    assert len(np.load(tmp_path / "data.features" / meta["version"] / "dates.npy")) == len(np.load(tmp_path / "data.features" / meta["version"] / "tickers.npy")) == len(data)
+
+    rewritten = read_dataset(cache_path)
+    assert rewritten["ticker"].astype(object).tolist() == longer["ticker"].tolist()
+    np.testing.assert_array_equal(rewritten["close_growth"], longer["close_growth"])
+
+    # Only the last builds are kept
+    for i in range(3):
+        write_feature_cache(longer.assign(close_growth=float(i)), cache_path)
+    assert len([name for name in os.listdir(cache_path) if name.startswith("v-")]) == 2
@@ -1,11 +1,22 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import numpy as np
 import pandas as pd
 import pytest
+from scipy import sparse
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_absolute_percentage_error
+import mlflow
+from hyperopt import hp
+from mlflow.tracking import MlflowClient
 
-from src.train_model.train_model import train_test_split
+from src.data.feature_cache import write_feature_cache
+from src.train_model.lag_search import encode_tickers, lag_statistics, solve_lags, to_linear_regression_coefficients
+from src.train_model.tracking import RunLogger
+from src.train_model.train_model import cross_validate_lags, date_folds, drop_missing_rows, make_preprocessor, parallel_fmin, train_test_split
 
 
 @pytest.fixture
@@ -23,7 +34,7 @@ def mock_data():
 
 
 def test_train_test_split(mock_data):
-    with patch("pandas.read_pickle", return_value=mock_data):
+    with patch("src.train_model.train_model.read_dataset", return_value=mock_data):
         train_ratio = 0.8
         X_train, X_test, y_train, y_test = train_test_split(
             "fake_data.pkl", train_ratio
@@ -39,3 +50,145 @@ def test_train_test_split(mock_data):
     assert len(X_test) == 20
     assert len(y_train) == 80
     assert len(y_test) == 20
+
+
+@pytest.fixture
+def lagged_data():
+    # Three tickers, lags missing at the start of each ticker like in get_data
+    rng = np.random.default_rng(1)
+    frames = []
+    for ticker in ["GOOG", "AAPL", "AMZN"]:
+        growth = rng.normal(0, 0.01, 60)
+        frame = pd.DataFrame({"ticker": ticker, "close_growth": growth})
+        for i in range(1, 5):
+            frame[f"close_growth_lag_{i}"] = frame["close_growth"].shift(i)
+        frames.append(frame.iloc[1:])
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_lag_search_matches_linear_regression(lagged_data):
+    X = lagged_data.drop(columns="close_growth")
+    y = lagged_data[["close_growth"]]
+
+    vocabulary, codes = encode_tickers(X["ticker"])
+    statistics = lag_statistics(codes, len(vocabulary), X.filter(like="lag").to_numpy(), y.to_numpy().ravel())
+
+    for n_lags_used in range(1, 5):
+        preprocessor = make_preprocessor(n_lags_used)
+        X_reduced = preprocessor.fit_transform(X)
+        complete = ~np.isnan(X_reduced).any(axis=1)
+
+        # Reference: least squares on dummies + lags (the dummies already span the intercept)
+        expected = np.linalg.lstsq(X_reduced[complete], y[complete].to_numpy().ravel(), rcond=None)[0]
+
+        effects, lag_coefficients, n = solve_lags(statistics, n_lags_used)
+        coefficients, intercept = to_linear_regression_coefficients(effects, lag_coefficients)
+
+        assert n == complete.sum()
+        np.testing.assert_allclose(effects, expected[:3], atol=1e-12)
+        np.testing.assert_allclose(lag_coefficients, expected[3:], atol=1e-12)
+        np.testing.assert_allclose(X_reduced[complete] @ coefficients + intercept, X_reduced[complete] @ expected, atol=1e-12)
+
+
+def test_parallel_fmin_is_deterministic():
+    space = {"n_lags_used": hp.choice("n_lags_used", np.arange(1, 11, dtype=int))}
+
+    def run_trial(n_lags_used, seed):
+        return abs(n_lags_used - 3) + 0.1
+
+    def executor(max_workers, mp_context, initializer, initargs):
+        return ThreadPoolExecutor(max_workers=max_workers)
+
+    searches = []
+    for n_jobs in (2, 2, 3):
+        with patch("src.train_model.train_model.ProcessPoolExecutor", executor), patch("src.train_model.train_model._run_trial", run_trial):
+            trials = parallel_fmin(space=space, max_evals=25, n_jobs=n_jobs, initargs=())
+        searches.append([trial["misc"]["vals"]["n_lags_used"][0] for trial in trials.trials])
+
+        assert len(trials.trials) == 25
+        assert all(trial["result"]["status"] == "ok" for trial in trials.trials)
+        assert all(trial["result"]["loss"] == pytest.approx(abs(trial["misc"]["vals"]["n_lags_used"][0] + 1 - 3) + 0.1) for trial in trials.trials)
+
+    assert searches[0] == searches[1]
+
+
+def test_run_logger_flushes_batched_runs(tmp_path):
+    tracking_uri = f"file:{tmp_path}"
+    experiment_id = MlflowClient(tracking_uri=tracking_uri).create_experiment("test")
+    logger = RunLogger(tracking_uri=tracking_uri, experiment_id=experiment_id)
+
+    run_ids = []
+    for n_lags_used in range(1, 4):
+        with logger.start_run() as run_id:
+            with logger.timer(run_id):
+                mape = 1.0 / n_lags_used
+            logger.log_param(run_id, "n_lags_used", n_lags_used)
+            logger.log_metric(run_id, "mape", mape)
+            if n_lags_used == 1:
+                logger.log_model(run_id, LinearRegression().fit([[0.0], [1.0]], [0.0, 1.0]), "model")
+        run_ids.append(run_id)
+
+    logger.close()
+
+    for n_lags_used, run_id in enumerate(run_ids, start=1):
+        run = logger.client.get_run(run_id)
+        assert run.info.status == "FINISHED"
+        assert run.data.params == {"n_lags_used": str(n_lags_used)}
+        assert run.data.metrics == {"mape": 1.0 / n_lags_used}
+
+    assert logger.timings().loc[run_ids].shape == (3, 3)
+
+    # Recorded like `mlflow.sklearn.log_model`, which fails here if the private call it relies on changed with MLflow
+    history = json.loads(logger.client.get_run(run_ids[0]).data.tags["mlflow.log-model.history"])
+    assert [model["artifact_path"] for model in history] == ["model"]
+    assert mlflow.sklearn.load_model(f"{logger.client.get_run(run_ids[0]).info.artifact_uri}/model").predict([[2.0]]) == pytest.approx([2.0])
+
+
+def test_drop_missing_rows_sparse_and_dense(lagged_data):
+    X = lagged_data.drop(columns="close_growth")
+    y = lagged_data[["close_growth"]]
+    preprocessor = make_preprocessor(3)
+    design = preprocessor.fit_transform(X)
+    complete = X[[f"close_growth_lag_{i}" for i in range(1, 4)]].notna().all(axis=1).to_numpy()
+
+    for matrix in (sparse.csr_matrix(design), sparse.csr_matrix(design).toarray()):
+        X_reduced, y_reduced = drop_missing_rows(matrix, y.to_numpy())
+
+        assert X_reduced.shape[0] == complete.sum()
+        np.testing.assert_array_equal(y_reduced, y.to_numpy()[complete])
+        np.testing.assert_array_equal(sparse.csr_matrix(X_reduced).toarray(), sparse.csr_matrix(design).toarray()[complete])
+
+
+def test_date_folds_split_on_dates():
+    dates = pd.DatetimeIndex(np.repeat(pd.bdate_range("2023-01-02", periods=50), 3)) # three tickers per date
+
+    expanding = date_folds(dates, n_folds=5, test_ratio=0.2)
+    assert [test_start for _, test_start, _ in expanding] == list(pd.bdate_range("2023-01-02", periods=50)[40::2])
+    assert all(train_start == dates[0] for train_start, _, _ in expanding)
+
+    rolling = date_folds(dates, n_folds=5, test_ratio=0.2, window="rolling")
+    assert [len(pd.bdate_range(train_start, test_start)) - 1 for train_start, test_start, _ in rolling] == [40] * 5
+
+
+def test_cross_validate_lags_matches_linear_regression(tmp_path, lagged_data):
+    # Same rows on 59 dates, in a feature cache like the one of get_data
+    data = lagged_data.set_index(pd.DatetimeIndex(np.tile(pd.bdate_range("2023-01-02", periods=59), 3), name="Date"))
+    data_name = write_feature_cache(data, str(tmp_path / "features"))
+
+    def executor(max_workers, mp_context):
+        return ThreadPoolExecutor(max_workers=max_workers)
+
+    with patch("src.train_model.train_model.ProcessPoolExecutor", executor):
+        mapes = cross_validate_lags(data_name, max_lags_used=4, n_folds=3, n_jobs=3)
+    assert mapes.shape == (4, 3)
+    pd.testing.assert_frame_equal(mapes, cross_validate_lags(data_name, max_lags_used=4, n_folds=3, n_jobs=1))
+
+    _, test_start, test_end = date_folds(data.index, n_folds=3)[1]
+    for n_lags_used in range(1, 5):
+        train, test = data[data.index < test_start], data[(data.index >= test_start) & (data.index <= test_end)]
+        preprocessor = make_preprocessor(n_lags_used)
+        X_train, y_train = drop_missing_rows(preprocessor.fit_transform(train), train["close_growth"].to_numpy())
+        model = LinearRegression(fit_intercept=False).fit(X_train, y_train) # the dummies hold the intercept
+        expected = mean_absolute_percentage_error(test["close_growth"], model.predict(preprocessor.transform(test)))
+
+        assert mapes.loc[n_lags_used, "fold_1"] == pytest.approx(expected)